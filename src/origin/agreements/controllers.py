@@ -5,6 +5,7 @@ from origin.auth import User, UserQuery, requires_login
 from origin.db import inject_session, atomic
 from origin.http import Controller
 from origin.common import DateTimeRange, DataSet, SummaryResolution
+from origin.common.export import export_response
 from origin.config import SEND_AGREEMENT_INVITATION_EMAIL
 from origin.ggo import TransactionQuery
 
@@ -21,6 +22,7 @@ from .schemas import (
     GetAgreementListResponse,
     GetAgreementSummaryRequest,
     GetAgreementSummaryResponse,
+    ExportTransferListRequest,
     SubmitAgreementProposalRequest,
     SubmitAgreementProposalResponse,
     RespondToProposalRequest,
@@ -263,6 +265,7 @@ class GetAgreementSummary(AbstractAgreementController):
             resolution=resolution,
             utc_offset=request.utc_offset,
             grouping=['technology'],
+            subject=user.subject,
         )
 
         if fill:
@@ -277,6 +280,53 @@ class GetAgreementSummary(AbstractAgreementController):
         )
 
 
+class ExportTransferList(Controller):
+    """
+    Exports the GGOs transferred to or from the user as NDJSON or CSV,
+    optionally limited to a single agreement and/or direction. The export
+    is streamed from the database as it is written to the client, so it
+    is not limited in size.
+    """
+    Request = md.class_schema(ExportTransferListRequest)
+
+    @requires_login
+    def handle_request(self, request, user):
+        """
+        :param ExportTransferListRequest request:
+        :param origin.auth.User user:
+        :rtype: flask.Response
+        """
+        return export_response(
+            lambda session: self.get_query(request, user, session),
+            request.format, 'transfers')
+
+    def get_query(self, request, user, session):
+        """
+        :param ExportTransferListRequest request:
+        :param origin.auth.User user:
+        :param sqlalchemy.orm.Session session:
+        :rtype: sqlalchemy.orm.Query
+        """
+        query = TransactionQuery(session)
+
+        if request.filters:
+            query = query.apply_filters(request.filters)
+
+        # Specific agreement?
+        if request.public_id:
+            query = query.has_reference(request.public_id)
+
+        # Transfer direction
+        if request.direction is AgreementDirection.INBOUND:
+            query = query.received_by_user(user)
+        elif request.direction is AgreementDirection.OUTBOUND:
+            query = query.sent_by_user(user)
+        else:
+            query = query.sent_or_received_by_user(user)
+
+        return query.get_export_query()
+
+
 class CancelAgreement(Controller):
     """
     TODO
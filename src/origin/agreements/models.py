@@ -1,3 +1,4 @@
+import pytz
 import sqlalchemy as sa
 from sqlalchemy import func
 from sqlalchemy.dialects.postgresql import ARRAY
@@ -133,6 +134,32 @@ class TradeAgreement(ModelBase):
         """
         return self.state == AgreementState.PENDING
 
+    def is_operating_at(self, begin):
+        """
+        In-memory equivalent of AgreementQuery.is_operating_at().
+
+        :param datetime.datetime begin:
+        :rtype: bool
+        """
+        b = begin.astimezone(pytz.timezone('Europe/Copenhagen')).date()
+
+        return self.date_from <= b <= self.date_to
+
+    def is_eligible_to_trade(self, ggo):
+        """
+        In-memory equivalent of AgreementQuery.is_elibigle_to_trade().
+
+        :param Ggo ggo:
+        :rtype: bool
+        """
+        if not self.is_operating_at(ggo.begin):
+            return False
+        elif self.facility_gsrn:
+            return ggo.issue_gsrn is not None and str(ggo.issue_gsrn) in \
+                [str(gsrn) for gsrn in self.facility_gsrn]
+        else:
+            return True
+
     def decline_proposal(self):
         self.state = AgreementState.DECLINED
         self.declined = func.now()
@@ -101,6 +101,15 @@ class AgreementQuery(SqlQuery):
             TradeAgreement.user_from_subject == user.subject,
         ))
 
+    def is_outbound_from_any(self, subjects):
+        """
+        :param list[str] subjects:
+        :rtype: AgreementQuery
+        """
+        return AgreementQuery(self.session, self.query.filter(
+            TradeAgreement.user_from_subject.in_(subjects),
+        ))
+
     def is_pending(self):
         """
         :rtype: AgreementQuery
@@ -187,6 +196,20 @@ class AgreementQuery(SqlQuery):
             TradeAgreement.date_to >= b,
         ))
 
+    def is_operating_within(self, date_from, date_to):
+        """
+        Only include agreements which are operating at any time
+        between the provided dates (both included).
+
+        :param datetime.date date_from:
+        :param datetime.date date_to:
+        :rtype: AgreementQuery
+        """
+        return AgreementQuery(self.session, self.query.filter(
+            TradeAgreement.date_from <= date_to,
+            TradeAgreement.date_to >= date_from,
+        ))
+
     def is_elibigle_to_trade(self, ggo):
         """
         :param Ggo ggo:
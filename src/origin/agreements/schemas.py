@@ -4,7 +4,8 @@ from dataclasses import dataclass, field
 
 from origin.meteringpoints import MappedMeteringPoint
 from origin.auth import subject_exists
-from origin.common import Unit, DateRange, DataSet
+from origin.common import Unit, DateRange, DataSet, ExportFormat
+from origin.ggo.schemas import TransferFilters
 
 from .models import AgreementState, AgreementDirection
 
@@ -79,6 +80,17 @@ class GetAgreementSummaryResponse:
     ggos: List[DataSet]
 
 
+# -- ExportTransferList request -----------------------------------------------
+
+
+@dataclass
+class ExportTransferListRequest:
+    filters: TransferFilters = field(default=None)
+    public_id: str = field(default=None, metadata=dict(data_key='id'))
+    direction: AgreementDirection = field(default=None, metadata=dict(by_value=True))
+    format: ExportFormat = field(default=ExportFormat.NDJSON, metadata=dict(by_value=True))
+
+
 # -- CancelAgreement request and response ------------------------------------
 
 
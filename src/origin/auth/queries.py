@@ -88,6 +88,17 @@ class UserQuery(SqlQuery):
             User.subject == subject,
         ))
 
+    def has_any_subject(self, subjects):
+        """
+        Only include users with any of the provided subjects.
+
+        :param list[str] subjects:
+        :rtype: UserQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            User.subject.in_(subjects),
+        ))
+
     def has_gsrn(self, gsrn):
         """
         Only include users which owns the MeteringPoint identified with
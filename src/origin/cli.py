@@ -3,9 +3,14 @@ import click
 from .app import app
 from .config import DEVELOP_HOST, DEVELOP_PORT
 from .auth import users_group
+from .ggo.cli import ggo_group
 from .measurements.cli import measurements_group
+from .ledger.cli import ledger_group
 from .meteringpoints import meteringpoints_group
 from .technologies import technologies_group
+from .commodities.cli import hourly_matching
+from .processes.cli import \
+    consume_ggos, consume_pending, retire_back_in_time, benchmark_group
 
 
 # -- Development server-------------------------------------------------------
@@ -47,6 +52,13 @@ def main():
 
 
 main.add_command(debug, "debug")
+main.add_command(consume_ggos, "consume")
+main.add_command(consume_pending, "consume-pending")
+main.add_command(retire_back_in_time, "retire-back-in-time")
+main.add_command(hourly_matching, "hourly-matching")
+main.add_command(benchmark_group, "benchmark")
+main.add_command(ggo_group, "ggo")
+main.add_command(ledger_group, "ledger")
 main.add_command(measurements_group, "measurements")
 main.add_command(meteringpoints_group, "meteringpoints")
 main.add_command(technologies_group, "technologies")
@@ -0,0 +1,80 @@
+import csv
+import sys
+import numpy as np
+from click import echo
+from cloup import command, option, DateTime, Choice
+
+from origin.db import inject_session
+from origin.measurements import MeasurementQuery
+
+from .matching import HourlyMatching
+
+
+# -- Commands ----------------------------------------------------------------
+
+
+@command()
+@option(
+    '--gsrn',
+    type=str,
+    required=True,
+    multiple=True,
+    help='GSRN number (can be provided multiple times)',
+)
+@option(
+    '--from',
+    'from_',
+    type=DateTime(formats=['%Y-%m-%d %H:%M']),
+    required=True,
+    prompt=True,
+    help='Begin from (included)',
+)
+@option(
+    '--to',
+    'to_',
+    type=DateTime(formats=['%Y-%m-%d %H:%M']),
+    required=True,
+    prompt=True,
+    help='Begin to (excluded)',
+)
+@option(
+    '--out',
+    type=Choice(('summary', 'csv')),
+    required=True,
+    default='summary',
+    help='Output format (csv includes every hour)',
+)
+@inject_session
+def hourly_matching(gsrn, from_, to_, out, session):
+    """
+    Report hourly (24/7) matching of consumption against retired GGOs
+    """
+    query = MeasurementQuery(session) \
+        .has_any_gsrn(list(gsrn))
+
+    matching = HourlyMatching.from_query(query, from_, to_)
+
+    if out == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(('begin', 'consumed', 'matched', 'unmatched', 'matched_percentage'))
+        writer.writerows(zip(
+            (b.isoformat() for b in matching.begins),
+            matching.consumed,
+            matching.matched,
+            matching.unmatched,
+            ('' if np.isnan(p) else f'{p:.2f}' for p in matching.matched_percentage),
+        ))
+        return
+
+    percentage = matching.matched_percentage
+    measured = percentage[~np.isnan(percentage)]
+
+    echo(f'Hours: {len(matching.consumed)} ({len(measured)} with consumption)')
+    echo(f'Consumed: {matching.total_consumed} Wh')
+    echo(f'Matched: {matching.total_matched} Wh')
+    echo(f'Unmatched: {matching.total_consumed - matching.total_matched} Wh')
+
+    if matching.total_matched_percentage is not None:
+        echo(f'Matched percentage: {matching.total_matched_percentage:.2f}%')
+        echo(f'Fully matched hours: {(measured >= 100).sum()}')
+        echo(f'Unmatched hours: {(measured == 0).sum()}')
@@ -1,12 +1,13 @@
+import numpy as np
 import marshmallow_dataclass as md
-from functools import partial
+from datetime import datetime, time, timedelta, timezone
 
 from origin.http import Controller
 from origin.db import inject_session
-from origin.ggo import GgoQuery, GgoCategory, TransactionQuery
+from origin.ggo import GgoQuery, GgoDistributions
 from origin.common import DataSet, DateTimeRange, SummaryResolution
 from origin.auth import User, requires_login
-from origin.measurements import MeasurementQuery, Measurement
+from origin.measurements import MeasurementQuery
 
 from .schemas import (
     GgoTechnology,
@@ -19,11 +20,13 @@ from .schemas import (
     GetGgoSummaryRequest,
     GetGgoSummaryResponse, GetPeakMeasurementRequest,
     GetPeakMeasurementResponse,
+    GetHourlyMatchingRequest,
+    GetHourlyMatchingResponse,
 )
+from .matching import HourlyMatching
 
 
 # -- Helper functions --------------------------------------------------------
-from ..ggo.schemas import TransferDirection
 
 
 def get_resolution(delta):
@@ -109,186 +112,28 @@ class GetGgoDistributions(Controller):
         :rtype: GetGgoDistributionsResponse
         """
         begin_range = DateTimeRange.from_date_range(request.date_range)
+        distributions = GgoDistributions(session, user, begin_range)
 
-        kwargs = {
-            'user': user,
-            'session': session,
-            'begin_range': begin_range,
-            'utc_offset': request.utc_offset,
-            'resolution': SummaryResolution.all,
-            'fill': False,
-        }
-
-        bundle = GgoDistributionBundle(
-            issued=self.get_issued(**kwargs),
-            stored=self.get_stored(**kwargs),
-            retired=self.get_retired(**kwargs),
-            expired=self.get_expired(**kwargs),
-            inbound=self.get_inbound(**kwargs),
-            outbound=self.get_outbound(**kwargs),
-        )
+        bundle = GgoDistributionBundle(**{
+            name: self.get_distribution(distributions, name)
+            for name in GgoDistributions.DISTRIBUTIONS
+        })
 
         return GetGgoDistributionsResponse(
             success=True,
             distributions=bundle,
         )
 
-    def get_issued(self, **kwargs):
-        """
-        :param sqlalchemy.orm.Session session:
-        :rtype: GgoDistribution
-        """
-        return self.get_distributions(partial(
-            self.get_ggo_summary,
-            category=GgoCategory.ISSUED,
-            **kwargs,
-        ))
-
-    def get_stored(self, **kwargs):
-        """
-        :rtype: GgoDistribution
-        """
-        return self.get_distributions(partial(
-            self.get_ggo_summary,
-            category=GgoCategory.STORED,
-            **kwargs,
-        ))
-
-    def get_retired(self, **kwargs):
+    def get_distribution(self, distributions, name):
         """
+        :param GgoDistributions distributions:
+        :param str name:
         :rtype: GgoDistribution
         """
-        return self.get_distributions(partial(
-            self.get_ggo_summary,
-            category=GgoCategory.RETIRED,
-            **kwargs,
-        ))
-
-    def get_expired(self, **kwargs):
-        """
-        :rtype: GgoDistribution
-        """
-        return self.get_distributions(partial(
-            self.get_ggo_summary,
-            category=GgoCategory.EXPIRED,
-            **kwargs,
-        ))
-
-    def get_inbound(self, **kwargs):
-        """
-        :rtype: GgoDistribution
-        """
-        return self.get_distributions(partial(
-            self.get_transfer_summary,
-            direction=TransferDirection.INBOUND,
-            **kwargs,
-        ))
-
-    def get_outbound(self, **kwargs):
-        """
-        :rtype: GgoDistribution
-        """
-        return self.get_distributions(partial(
-            self.get_transfer_summary,
-            direction=TransferDirection.OUTBOUND,
-            **kwargs,
-        ))
-
-    def get_distributions(self, get_summary_groups_func):
-        """
-        :param function get_summary_groups_func: A function which returns a
-            list of SummaryGroup objects
-        :rtype: GgoDistribution
-        """
-        distribution = GgoDistribution()
-
-        groups, labels = get_summary_groups_func()
-
-        for summary_group in groups:
-            distribution.technologies.append(GgoTechnology(
-                technology=summary_group.group[0],
-                amount=sum(summary_group.values),
-            ))
-
-        return distribution
-
-    def get_transfer_summary(self, user, session, direction,
-                             resolution, begin_range, utc_offset, fill):
-        """
-        Get either Issued, Stored, Retired and Expired from GgoSummary.
-
-        :param origin.auth.User user:
-        :param sqlalchemy.orm.Session session:
-        :param TransferDirection direction:
-        :param SummaryResolution resolution:
-        :param DateTimeRange begin_range:
-        :param int utc_offset:
-        :param bool fill:
-        :rtype: List[SummaryGroup]
-        """
-        query = TransactionQuery(session) \
-            .begins_within(begin_range)
-
-        if direction is TransferDirection.INBOUND:
-            query = query.received_by_user(user)
-        elif direction is TransferDirection.OUTBOUND:
-            query = query.sent_by_user(user)
-        else:
-            query = query.sent_or_received_by_user(user)
-
-        summary = query.get_summary(
-            resolution=resolution,
-            utc_offset=utc_offset,
-            grouping=['technology'],
-        )
-
-        return summary.groups, summary.labels
-
-        # response = account_service.get_transfer_summary(
-        #     token=token,
-        #     request=acc.GetTransferSummaryRequest(
-        #         utc_offset=utc_offset,
-        #         direction=direction,
-        #         resolution=resolution,
-        #         fill=fill,
-        #         grouping=[acc.SummaryGrouping.TECHNOLOGY],
-        #         filters=acc.TransferFilters(
-        #             begin_range=begin_range,
-        #         ),
-        #     ),
-        # )
-        #
-        # return response.groups, response.labels
-
-    def get_ggo_summary(self, user, session, category, resolution,
-                        begin_range, utc_offset, fill):
-        """
-        Get either Issued, Stored, Retired and Expired from GgoSummary.
-
-        :param origin.auth.User user:
-        :param sqlalchemy.orm.Session session:
-        :param acc.GgoCategory category:
-        :param SummaryResolution resolution:
-        :param DateTimeRange begin_range:
-        :param int utc_offset:
-        :param bool fill:
-        :rtype: (List[SummaryGroup], List[str])
-        """
-        query = GgoQuery(session) \
-            .belongs_to(user) \
-            .begins_within(begin_range) \
-            .in_category(category)
-
-        summary = query.get_summary(
-            resolution=resolution,
-            utc_offset=utc_offset,
-            grouping=['technology'],
-        )
-
-        if fill:
-            summary.fill(begin_range)
-
-        return summary.groups, summary.labels
+        return GgoDistribution(technologies=[
+            GgoTechnology(technology=technology, amount=amount)
+            for technology, amount in distributions.get(name)
+        ])
 
 
 class GetGgoSummary(Controller):
@@ -319,6 +164,7 @@ class GetGgoSummary(Controller):
             resolution=resolution,
             grouping=['technology'],
             utc_offset=request.utc_offset,
+            subject=user.subject,
         )
 
         summary.fill(begin_range)
@@ -350,11 +196,58 @@ class GetPeakMeasurement(Controller):
             .belongs_to(user) \
             .begins_within(DateTimeRange.from_date_range(request.date_range)) \
             .is_type(request.measurement_type) \
-            .order_by(Measurement.amount.desc()) \
-            .limit(1) \
-            .one_or_none()
+            .get_peak_measurement()
 
         return GetPeakMeasurementResponse(
             success=measurement is not None,
             measurement=measurement,
         )
+
+
+class GetHourlyMatching(Controller):
+    """
+    Returns the hourly (24/7) matching of the user's consumption against
+    the GGOs retired to it, optionally narrowed down to specific GSRNs.
+    """
+    Request = md.class_schema(GetHourlyMatchingRequest)
+    Response = md.class_schema(GetHourlyMatchingResponse)
+
+    @requires_login
+    @inject_session
+    def handle_request(self, request, user, session):
+        """
+        :param GetHourlyMatchingRequest request:
+        :param origin.auth.User user:
+        :param sqlalchemy.orm.Session session:
+        :rtype: GetHourlyMatchingResponse
+        """
+        tzinfo = timezone(timedelta(hours=request.utc_offset))
+
+        begin_from = datetime.combine(
+            request.date_range.begin, time(), tzinfo=tzinfo)
+        begin_to = datetime.combine(
+            request.date_range.end + timedelta(days=1), time(), tzinfo=tzinfo)
+
+        query = MeasurementQuery(session) \
+            .belongs_to(user)
+
+        if request.gsrn:
+            query = query.has_any_gsrn(request.gsrn)
+
+        matching = HourlyMatching.from_query(query, begin_from, begin_to)
+
+        return GetHourlyMatchingResponse(
+            success=True,
+            labels=[b.astimezone(tzinfo).strftime('%Y-%m-%d %H:00')
+                    for b in matching.begins],
+            consumed=DataSet('Consumed', matching.consumed.tolist()),
+            matched=DataSet('Matched', matching.matched.tolist()),
+            unmatched=DataSet('Unmatched', matching.unmatched.tolist()),
+            matched_percentage=[
+                None if np.isnan(p) else round(float(p), 2)
+                for p in matching.matched_percentage
+            ],
+            total_consumed=matching.total_consumed,
+            total_matched=matching.total_matched,
+            total_matched_percentage=matching.total_matched_percentage,
+        )
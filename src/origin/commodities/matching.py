@@ -0,0 +1,111 @@
+import numpy as np
+from datetime import timedelta, timezone
+
+from origin.measurements import Measurement
+
+
+class HourlyMatching(object):
+    """
+    Hourly (24/7) matching of consumption against the GGOs retired to it.
+
+    For each hour within a period of time, "consumed" is the total
+    consumption measured, "matched" is the part of it covered by retired
+    GGOs, and "unmatched" is the residual. Hours without consumption
+    measured have a matched percentage of NaN.
+    """
+
+    HOUR = timedelta(hours=1)
+
+    def __init__(self, begin_from, begin_to, consumed, matched):
+        """
+        :param datetime begin_from: Begin from (included)
+        :param datetime begin_to: Begin to (excluded)
+        :param np.ndarray consumed: Consumption per hour
+        :param np.ndarray matched: Matched consumption per hour
+        """
+        self.begin_from = begin_from
+        self.begin_to = begin_to
+        self.consumed = consumed
+        self.matched = matched
+
+    @classmethod
+    def from_query(cls, query, begin_from, begin_to):
+        """
+        Matches the consumption measurements in the provided query (within
+        the period) using a single aggregated query.
+
+        :param origin.measurements.MeasurementQuery query:
+        :param datetime begin_from: Begin from (included)
+        :param datetime begin_to: Begin to (excluded)
+        :rtype: HourlyMatching
+        """
+        begin_from = begin_from.astimezone(timezone.utc)
+        begin_to = begin_to.astimezone(timezone.utc)
+
+        rows = query \
+            .is_consumption() \
+            .filter(Measurement.begin >= begin_from) \
+            .filter(Measurement.begin < begin_to) \
+            .get_hourly_retired_amount()
+
+        H = -(-(begin_to - begin_from) // cls.HOUR)
+        consumed = np.zeros(H, dtype=np.int64)
+        matched = np.zeros(H, dtype=np.int64)
+
+        if rows:
+            begins, consumed_amount, matched_amount = zip(*rows)
+            seconds = np.array([b.timestamp() for b in begins])
+            h = ((seconds - begin_from.timestamp()) // 3600).astype(np.int64)
+            np.add.at(consumed, h, np.array(consumed_amount, dtype=np.int64))
+            np.add.at(matched, h, np.array(matched_amount, dtype=np.int64))
+
+        return cls(begin_from, begin_to, consumed,
+                   np.minimum(matched, consumed))
+
+    @property
+    def begins(self):
+        """
+        :rtype: list[datetime]
+        """
+        return [self.begin_from + h * self.HOUR
+                for h in range(len(self.consumed))]
+
+    @property
+    def unmatched(self):
+        """
+        :rtype: np.ndarray
+        """
+        return self.consumed - self.matched
+
+    @property
+    def matched_percentage(self):
+        """
+        :rtype: np.ndarray
+        """
+        percentage = np.full(self.consumed.shape, np.nan)
+        np.divide(self.matched * 100, self.consumed,
+                  out=percentage, where=self.consumed > 0)
+        return percentage
+
+    @property
+    def total_consumed(self):
+        """
+        :rtype: int
+        """
+        return int(self.consumed.sum())
+
+    @property
+    def total_matched(self):
+        """
+        :rtype: int
+        """
+        return int(self.matched.sum())
+
+    @property
+    def total_matched_percentage(self):
+        """
+        :rtype: float | None
+        """
+        if self.total_consumed > 0:
+            return self.total_matched * 100 / self.total_consumed
+        return None
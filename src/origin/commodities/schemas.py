@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 from dataclasses import dataclass, field
 
 from origin.common import DateRange, DataSet
@@ -102,3 +102,26 @@ class GetPeakMeasurementRequest:
 class GetPeakMeasurementResponse:
     success: bool
     measurement: MappedMeasurement = None
+
+
+# -- GetHourlyMatching request and response ----------------------------------
+
+
+@dataclass
+class GetHourlyMatchingRequest:
+    utc_offset: int = field(metadata=dict(required=False, missing=0, data_key='utcOffset'))
+    date_range: DateRange = field(metadata=dict(data_key='dateRange'))
+    gsrn: List[str] = field(default_factory=list)
+
+
+@dataclass
+class GetHourlyMatchingResponse:
+    success: bool
+    labels: List[str] = field(default_factory=list)
+    consumed: DataSet = field(default=None)
+    matched: DataSet = field(default=None)
+    unmatched: DataSet = field(default=None)
+    matched_percentage: List[Optional[float]] = field(default_factory=list, metadata=dict(data_key='matchedPercentage'))
+    total_consumed: int = field(default=0, metadata=dict(data_key='totalConsumed'))
+    total_matched: int = field(default=0, metadata=dict(data_key='totalMatched'))
+    total_matched_percentage: Optional[float] = field(default=None, metadata=dict(data_key='totalMatchedPercentage'))
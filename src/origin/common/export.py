@@ -0,0 +1,156 @@
+import io
+import csv
+import json
+from enum import Enum
+from datetime import datetime, date
+from flask import Response
+
+from origin.db import make_private_session
+from origin.config import EXPORT_BATCH_SIZE
+
+from .schemas import ExportFormat
+
+
+MIMETYPES = {
+    ExportFormat.NDJSON: 'application/x-ndjson',
+    ExportFormat.CSV: 'text/csv',
+}
+
+
+def export_response(get_query, format, filename):
+    """
+    Returns a HTTP response which streams the rows of the provided query
+    as either NDJSON (one JSON object per line) or CSV (with a header),
+    using the labels of the query's columns as keys/headers.
+
+    Rows are fetched from a server-side cursor EXPORT_BATCH_SIZE rows at
+    a time, and written to the client as they are fetched, so memory is
+    constant no matter how many rows are exported. The query must select
+    columns, not ORM entities (see GgoQuery.get_export_query()).
+
+    The query is built by invoking get_query() with a private session
+    (see make_private_session()), as the thread's shared session may be
+    closed (ie. by @inject_session) before the response is streamed.
+    The private session is closed if building the query fails, and
+    otherwise once the response is closed by the server (whether it has
+    been streamed, the client disconnected, or it was never iterated
+    at all).
+
+    :param collections.abc.Callable[[sqlalchemy.orm.Session], sqlalchemy.orm.Query] get_query:
+    :param ExportFormat format:
+    :param str filename: Without extension
+    :rtype: flask.Response
+    """
+    session = make_private_session()
+
+    try:
+        query = get_query(session)
+    except:
+        session.close()
+        raise
+
+    response = Response(
+        status=200,
+        mimetype=MIMETYPES[format],
+        response=stream_export(query, format),
+        headers={
+            'Content-Disposition': 'attachment; filename="%s.%s"' % (
+                filename, format.value),
+        },
+    )
+
+    response.call_on_close(session.close)
+
+    return response
+
+
+def stream_export(query, format):
+    """
+    Yields the rows of the provided query as chunks of NDJSON or CSV,
+    one chunk per batch of rows.
+
+    :param sqlalchemy.orm.Query query:
+    :param ExportFormat format:
+    :rtype: collections.abc.Iterable[str]
+    """
+    fields = [c['name'] for c in query.column_descriptions]
+    rows = query.yield_per(EXPORT_BATCH_SIZE)
+
+    if format == ExportFormat.CSV:
+        yield from stream_csv(fields, rows)
+    else:
+        yield from stream_ndjson(fields, rows)
+
+
+def stream_ndjson(fields, rows):
+    """
+    :param list[str] fields:
+    :param collections.abc.Iterable[tuple] rows:
+    :rtype: collections.abc.Iterable[str]
+    """
+    lines = []
+
+    for row in rows:
+        lines.append(json.dumps(
+            dict(zip(fields, row)), default=serialize_value))
+
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines.clear()
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def stream_csv(fields, rows):
+    """
+    :param list[str] fields:
+    :param collections.abc.Iterable[tuple] rows:
+    :rtype: collections.abc.Iterable[str]
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+
+    for row in rows:
+        writer.writerow([serialize_csv_value(v) for v in row])
+        count += 1
+
+        if count >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+
+    yield buffer.getvalue()
+
+
+def serialize_value(value):
+    """
+    Serializes values which are not JSON serializable by default.
+
+    :param typing.Any value:
+    :rtype: typing.Any
+    """
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    elif isinstance(value, Enum):
+        return value.value
+    else:
+        raise TypeError('Can not serialize %r' % value)
+
+
+def serialize_csv_value(value):
+    """
+    :param typing.Any value:
+    :rtype: typing.Any
+    """
+    if value is None:
+        return ''
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    elif isinstance(value, (datetime, date, Enum)):
+        return serialize_value(value)
+    else:
+        return value
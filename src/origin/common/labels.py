@@ -0,0 +1,166 @@
+import threading
+import sqlalchemy as sa
+from sqlalchemy import func
+from collections import OrderedDict
+from dateutil.relativedelta import relativedelta
+from datetime import timezone, timedelta
+
+from origin.config import LABEL_CALENDAR_CACHE_SIZE
+
+from .schemas import SummaryResolution
+
+
+class LabelCalendar(object):
+    """
+    Generates the labels of summaries (see LabelRange, GgoSummary, and
+    MeasurementSummary), ie. a label per resolution from begin to end.
+
+    Labels are cached as immutable tuples keyed by the wall-clock time
+    of (begin, end, resolution, utc_offset), so the same range is only
+    labelled once per process. Alternatively, labels can be generated
+    by the database (see get_label_axis()), so summaries can fill gaps
+    in data by joining on them.
+
+    Memory is bounded by the number of ranges cached; the least recently
+    used labels are evicted first.
+    """
+
+    RESOLUTIONS_PYTHON = {
+        SummaryResolution.hour: '%Y-%m-%d %H:00',
+        SummaryResolution.day: '%Y-%m-%d',
+        SummaryResolution.month: '%Y-%m',
+        SummaryResolution.year: '%Y',
+    }
+
+    RESOLUTIONS_POSTGRES = {
+        SummaryResolution.hour: 'YYYY-MM-DD HH24:00',
+        SummaryResolution.day: 'YYYY-MM-DD',
+        SummaryResolution.month: 'YYYY-MM',
+        SummaryResolution.year: 'YYYY',
+    }
+
+    LABEL_STEP = {
+        SummaryResolution.hour: relativedelta(hours=1),
+        SummaryResolution.day: relativedelta(days=1),
+        SummaryResolution.month: relativedelta(months=1),
+        SummaryResolution.year: relativedelta(years=1),
+    }
+
+    LABEL_STEP_POSTGRES = {
+        SummaryResolution.hour: '1 hour',
+        SummaryResolution.day: '1 day',
+        SummaryResolution.month: '1 month',
+        SummaryResolution.year: '1 year',
+    }
+
+    def __init__(self, max_size):
+        """
+        :param int max_size: Maximum number of ranges to cache labels for
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_labels(self, begin, end, resolution, utc_offset=None,
+                   include_end=False):
+        """
+        Returns the labels from begin to end (formatted in begin's time
+        zone, or in UTC offset by utc_offset hours if provided).
+
+        :param datetime begin:
+        :param datetime end:
+        :param SummaryResolution resolution:
+        :param int utc_offset:
+        :param bool include_end: Whether to include end
+        :rtype: tuple[str]
+        """
+        begin, end = self.get_wall_clock(begin, end, utc_offset)
+        key = (begin, end, resolution, include_end)
+
+        with self.lock:
+            labels = self.entries.get(key)
+            if labels is not None:
+                self.entries.move_to_end(key)
+                return labels
+
+        labels = self.build_labels(begin, end, resolution, include_end)
+
+        if self.max_size > 0:
+            with self.lock:
+                self.entries[key] = labels
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+
+        return labels
+
+    def build_labels(self, begin, end, resolution, include_end):
+        """
+        :param datetime begin:
+        :param datetime end:
+        :param SummaryResolution resolution:
+        :param bool include_end: Whether to include end
+        :rtype: tuple[str]
+        """
+        format = self.RESOLUTIONS_PYTHON[resolution]
+        step = self.LABEL_STEP[resolution]
+        labels = []
+
+        while begin < end or (include_end and begin == end):
+            labels.append(begin.strftime(format))
+            begin += step
+
+        return tuple(labels)
+
+    def get_label_axis(self, begin, end, resolution, utc_offset=None,
+                       include_end=False):
+        """
+        Returns the same labels as get_labels() as a subquery with the
+        columns (label, i), where i is the ordinality of the label,
+        generated by the database.
+
+        :param datetime begin:
+        :param datetime end:
+        :param SummaryResolution resolution:
+        :param int utc_offset:
+        :param bool include_end: Whether to include end
+        :rtype: sqlalchemy.sql.Subquery
+        """
+        begin, end = self.get_wall_clock(begin, end, utc_offset)
+
+        series = func.generate_series(
+            sa.cast(begin, sa.DateTime()),
+            sa.cast(end, sa.DateTime()),
+            sa.cast(self.LABEL_STEP_POSTGRES[resolution], sa.Interval()),
+        ).table_valued('value', with_ordinality='i').render_derived()
+
+        query = sa.select(
+            func.to_char(series.c.value, self.RESOLUTIONS_POSTGRES[resolution]).label('label'),
+            series.c.i.label('i'),
+        )
+
+        if not include_end:
+            query = query.where(series.c.value < end)
+
+        return query.subquery()
+
+    def get_wall_clock(self, begin, end, utc_offset=None):
+        """
+        Returns begin and end as naive datetimes in the time zone which
+        labels are formatted in.
+
+        :param datetime begin:
+        :param datetime end:
+        :param int utc_offset:
+        :rtype: (datetime, datetime)
+        """
+        if utc_offset is not None:
+            tz = timezone(timedelta(hours=utc_offset))
+            begin = begin.replace(tzinfo=begin.tzinfo or timezone.utc).astimezone(tz)
+            end = end.replace(tzinfo=end.tzinfo or timezone.utc).astimezone(tz)
+        elif begin.tzinfo is not None and end.tzinfo is not None:
+            end = end.astimezone(begin.tzinfo)
+
+        return begin.replace(tzinfo=None), end.replace(tzinfo=None)
+
+
+label_calendar = LabelCalendar(LABEL_CALENDAR_CACHE_SIZE)
@@ -0,0 +1,141 @@
+import json
+import base64
+import sqlalchemy as sa
+from datetime import datetime
+
+from .schemas import TotalCount
+
+
+def paginate(query, columns, limit=None, cursor=None, descending=False,
+             offset=0):
+    """
+    Returns a page of results using keyset (cursor-based) pagination,
+    ordered by the provided columns, the last of which must be unique
+    (ie. (Ggo.begin, Ggo.id)).
+
+    Rather than skipping rows with OFFSET, which gets slower the deeper
+    the page, the cursor (returned with the previous page) filters on the
+    values of the columns of the previous page's last row, so every page
+    costs the same. The returned cursor is None when there are no more
+    results (or no limit is provided).
+
+    :param sqlalchemy.orm.Query query:
+    :param list[sqlalchemy.orm.attributes.InstrumentedAttribute] columns:
+    :param int limit:
+    :param str cursor: Cursor returned with the previous page, if any
+    :param bool descending:
+    :param int offset:
+    :rtype: (list, str)
+    :raises ValueError: If the cursor is invalid
+    """
+    if cursor is not None:
+        values = decode_cursor(cursor, columns)
+        query = query.filter(get_keyset_condition(columns, values, descending))
+
+    if descending:
+        query = query.order_by(*(c.desc() for c in columns))
+    else:
+        query = query.order_by(*(c.asc() for c in columns))
+
+    if offset:
+        query = query.offset(offset)
+
+    if not limit:
+        return query.all(), None
+
+    # Fetching one more than the limit tells whether there are more
+    results = query.limit(limit + 1).all()
+
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    else:
+        next_cursor = None
+
+    return results, next_cursor
+
+
+def get_total(query, total):
+    """
+    Returns the total number of results of the provided query, either
+    exact, estimated (which is cheap no matter the size of the result
+    set), or None, depending on what the client requested.
+
+    :param origin.db.SqlQuery query:
+    :param TotalCount total:
+    :rtype: int | None
+    """
+    if total == TotalCount.EXACT:
+        return query.get_count()
+    elif total == TotalCount.ESTIMATE:
+        return query.get_estimated_count()
+    else:
+        return None
+
+
+def get_keyset_condition(columns, values, descending=False):
+    """
+    Returns a condition which only includes rows after the provided
+    values (of the columns) in order, ie. for columns (a, b)::
+
+        a >= :a AND (a > :a OR b > :b)
+
+    The leading "a >= :a" allows using an index on "a" alone.
+
+    :param list[sqlalchemy.orm.attributes.InstrumentedAttribute] columns:
+    :param list values:
+    :param bool descending:
+    :rtype: sqlalchemy.sql.ColumnElement
+    """
+    def after(column, value):
+        return column < value if descending else column > value
+
+    condition = after(columns[-1], values[-1])
+
+    for column, value in reversed(list(zip(columns[:-1], values[:-1]))):
+        condition = sa.or_(
+            after(column, value),
+            sa.and_(column == value, condition),
+        )
+
+    first, value = columns[0], values[0]
+    at_or_after = first <= value if descending else first >= value
+
+    return sa.and_(at_or_after, condition)
+
+
+def encode_cursor(values):
+    """
+    :param list values:
+    :rtype: str
+    """
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, columns):
+    """
+    :param str cursor:
+    :param list[sqlalchemy.orm.attributes.InstrumentedAttribute] columns:
+    :rtype: list
+    :raises ValueError: If the cursor is invalid
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+
+    for i, column in enumerate(columns):
+        if isinstance(column.type, sa.DateTime):
+            if not isinstance(values[i], str):
+                raise ValueError('Invalid cursor')
+            values[i] = datetime.fromisoformat(values[i])
+        elif isinstance(column.type, sa.Integer):
+            if not isinstance(values[i], int):
+                raise ValueError('Invalid cursor')
+
+    return values
@@ -2,7 +2,6 @@ from typing import List
 from enum import Enum, IntEnum
 from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
-from dateutil.relativedelta import relativedelta
 
 from marshmallow import validates_schema, ValidationError
 
@@ -105,6 +104,17 @@ class SummaryResolution(IntEnum):
     hour = 4
 
 
+class TotalCount(Enum):
+    EXACT = 'exact'
+    ESTIMATE = 'estimate'
+    NONE = 'none'
+
+
+class ExportFormat(Enum):
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
 @dataclass
 class SummaryGroup:
     group: List[str] = field(default_factory=list)
@@ -129,21 +139,6 @@ class LabelRange(object):
 
     """
 
-    RESOLUTIONS = {
-        SummaryResolution.hour: '%Y-%m-%d %H:00',
-        SummaryResolution.day: '%Y-%m-%d',
-        SummaryResolution.month: '%Y-%m',
-        SummaryResolution.year: '%Y',
-    }
-
-    LABEL_STEP = {
-        SummaryResolution.hour: relativedelta(hours=1),
-        SummaryResolution.day: relativedelta(days=1),
-        SummaryResolution.month: relativedelta(months=1),
-        SummaryResolution.year: relativedelta(years=1),
-        SummaryResolution.all: None,
-    }
-
     def __init__(self, begin, end, resolution):
         """
         :param datetime begin:
@@ -158,13 +153,7 @@ class LabelRange(object):
         return iter(self.get_label_range())
 
     def get_label_range(self):
-        format = self.RESOLUTIONS[self.resolution]
-        step = self.LABEL_STEP[self.resolution]
-        begin = self.begin
-        labels = []
-
-        while begin < self.end:
-            labels.append(begin.strftime(format))
-            begin += step
+        from .labels import label_calendar
 
-        return labels
+        return list(label_calendar.get_labels(
+            self.begin, self.end, self.resolution))
@@ -0,0 +1,174 @@
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from .schemas import SummaryResolution, SummaryGroup
+from .labels import label_calendar
+
+
+class ColumnarSummary(object):
+    """
+    Base class for summaries (see GgoSummary and MeasurementSummary),
+    which pivots the summary's query in SQL, returning one row per group
+    with an array of amounts; one per label, in order of labels.
+
+    The labels are either generated in SQL by the label calendar (see
+    LabelCalendar) when filling gaps in data, or the distinct labels of
+    the summary's query.
+
+    Subclasses must implement get_query(), which returns the summary's
+    query with the columns (label, *group, amount). They may override
+    get_results() to cache results.
+    """
+
+    RESOLUTIONS_POSTGRES = {
+        SummaryResolution.hour: 'YYYY-MM-DD HH24:00',
+        SummaryResolution.day: 'YYYY-MM-DD',
+        SummaryResolution.month: 'YYYY-MM',
+        SummaryResolution.year: 'YYYY',
+    }
+
+    ALL_TIME_LABEL = 'All-time'
+
+    # Whether the end of the fill range is included in labels
+    FILL_INCLUDES_END = True
+
+    resolution = None
+    fill_range = None
+    _pivoted_results = None
+
+    def get_query(self):
+        """
+        :rtype: sqlalchemy.orm.Query
+        """
+        raise NotImplementedError
+
+    def get_results(self, query):
+        """
+        Executes a query.
+
+        :param sqlalchemy.orm.Query query:
+        :rtype: list[tuple]
+        """
+        return query.all()
+
+    @property
+    def labels(self):
+        """
+        :rtype list[str]:
+        """
+        if self.resolution == SummaryResolution.all:
+            return [self.ALL_TIME_LABEL]
+        elif self.fill_range is None:
+            results = self.pivoted_results
+            return list(results[0][-1]) if results else []
+        else:
+            return list(label_calendar.get_labels(
+                self.fill_range.begin,
+                self.fill_range.end,
+                self.resolution,
+                include_end=self.FILL_INCLUDES_END,
+            ))
+
+    @property
+    def groups(self):
+        """
+        :rtype list[SummaryGroup]:
+        """
+        if self.fill_range is None or self.resolution == SummaryResolution.all:
+            return [SummaryGroup(group=row[:-2], values=row[-2])
+                    for row in self.pivoted_results]
+        else:
+            return [SummaryGroup(group=row[:-1], values=row[-1])
+                    for row in self.pivoted_results]
+
+    @property
+    def arrays(self):
+        """
+        Returns the values of each group as a NumPy array, with NaN
+        where there is no data.
+
+        :rtype: list[(tuple, numpy.ndarray)]
+        """
+        return [(tuple(g.group), np.array(g.values, dtype=float))
+                for g in self.groups]
+
+    @property
+    def pivoted_results(self):
+        """
+        :rtype: list[tuple]
+        """
+        if self._pivoted_results is None:
+            self._pivoted_results = self.get_pivoted_results()
+        return self._pivoted_results
+
+    def get_pivoted_results(self):
+        """
+        :rtype: list[tuple]
+        """
+        query = self.get_query()
+
+        if self.fill_range is None or self.resolution == SummaryResolution.all:
+            axis = None
+        else:
+            axis = label_calendar.get_label_axis(
+                self.fill_range.begin,
+                self.fill_range.end,
+                self.resolution,
+                include_end=self.FILL_INCLUDES_END,
+            )
+
+        return self.get_results(pivot(query, axis))
+
+
+def pivot(query, axis=None):
+    """
+    Pivots a summary query with the columns (label, *group, amount) into
+    one row per group (ordered by group) with the columns (*group, amounts),
+    where amounts is an array of amounts per label on the axis (NULL where
+    there is no data). Groups which have no data are omitted.
+
+    If no axis is provided (see LabelCalendar.get_label_axis()), the
+    distinct labels of the query (ordered) are used, and returned as an
+    additional column (*group, amounts, labels).
+
+    :param sqlalchemy.orm.Query query:
+    :param sqlalchemy.sql.Subquery axis:
+    :rtype: sqlalchemy.orm.Query
+    """
+    results = query.order_by(None).subquery()
+    label, *groups, amount = results.c
+
+    if axis is None:
+        # Labels are ordered by code point (like sorted() in Python)
+        axis = sa.select(
+            label.label('label'),
+            func.dense_rank().over(order_by=label.collate('C')).label('i'),
+        ).distinct().subquery()
+        labels = [func.array_agg(aggregate_order_by(axis.c.label, axis.c.i))]
+    else:
+        labels = []
+
+    distinct_groups = sa.select(
+        *groups, sa.literal(1).label('present'),
+    ).select_from(results).distinct().subquery()
+
+    group_columns = list(distinct_groups.c)[:-1]
+
+    return query.session.query(
+        *group_columns,
+        func.array_agg(aggregate_order_by(amount, axis.c.i)),
+        *labels,
+    ).select_from(
+        distinct_groups
+        .join(axis, sa.true())
+        .outerjoin(results, sa.and_(
+            label == axis.c.label,
+            *(c.is_not_distinct_from(g) for c, g in zip(groups, group_columns)),
+        ))
+    ).group_by(
+        # Also grouping by present, so there are no rows when there is no
+        # data, even without groups
+        distinct_groups.c.present, *group_columns,
+    ).order_by(*group_columns)
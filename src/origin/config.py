@@ -91,6 +91,53 @@ SEND_AGREEMENT_INVITATION_EMAIL = config(
 GGO_EXPIRE_TIME = timedelta(days=config('GGO_EXPIRE_TIME', default=90))
 GGO_ISSUE_INTERVAL = timedelta(minutes=config('GGO_ISSUE_INTERVAL', default=60))
 
+# Size of each chunk (transaction) when retiring GGOs back in time
+RETIRE_BACK_IN_TIME_CHUNK_SIZE = timedelta(
+    days=config('RETIRE_BACK_IN_TIME_CHUNK_SIZE', default=7, cast=int))
+
+# Whether to defer consumption of issued GGOs to a worker
+# (see "consume-pending"), rather than consuming them when importing
+CONSUME_GGOS_DEFERRED = config(
+    'CONSUME_GGOS_DEFERRED', default=False, cast=bool)
+
+# Maximum total number of rows, and seconds, to cache GGO summaries for
+# (see SummaryCache). Set GGO_SUMMARY_CACHE_ROWS to 0 to disable caching
+GGO_SUMMARY_CACHE_ROWS = config(
+    'GGO_SUMMARY_CACHE_ROWS', default=200000, cast=int)
+GGO_SUMMARY_CACHE_TTL = config(
+    'GGO_SUMMARY_CACHE_TTL', default=600, cast=int)
+
+# Maximum number of ranges to cache summary labels for (see LabelCalendar)
+LABEL_CALENDAR_CACHE_SIZE = config(
+    'LABEL_CALENDAR_CACHE_SIZE', default=4096, cast=int)
+
+# Number of rows to fetch from the database (and write to the client) at a
+# time when streaming exports (see export_response())
+EXPORT_BATCH_SIZE = config('EXPORT_BATCH_SIZE', default=1000, cast=int)
+
+# Maximum number of GGOs to compose in a single request (see ComposeGgoBulk)
+COMPOSE_BULK_MAX_ITEMS = config(
+    'COMPOSE_BULK_MAX_ITEMS', default=1000, cast=int)
+
+# Whether to leave composed batches PENDING for the ledger submitter
+# (see "ledger submit"), rather than completing them immediately
+SUBMIT_BATCHES_TO_LEDGER = config(
+    'SUBMIT_BATCHES_TO_LEDGER', default=False, cast=bool)
+
+# Maximum number of batches to submit to, and to poll the status of
+# from, the ledger in a single round trip (see origin.ledger.submitter)
+LEDGER_SUBMIT_BATCH_SIZE = config(
+    'LEDGER_SUBMIT_BATCH_SIZE', default=100, cast=int)
+LEDGER_POLL_BATCH_SIZE = config(
+    'LEDGER_POLL_BATCH_SIZE', default=500, cast=int)
+
+# Seconds to wait before polling the ledger for the status of a submitted
+# batch, doubled each time it is polled, up to LEDGER_POLL_MAX_INTERVAL
+LEDGER_POLL_INTERVAL = config(
+    'LEDGER_POLL_INTERVAL', default=1, cast=float)
+LEDGER_POLL_MAX_INTERVAL = config(
+    'LEDGER_POLL_MAX_INTERVAL', default=60, cast=float)
+
 UNKNOWN_TECHNOLOGY_LABEL = 'Unknown'
 
 # Used when debugging for importing test data
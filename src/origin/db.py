@@ -5,6 +5,8 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import \
     sessionmaker, scoped_session, configure_mappers, load_only, Query
+from sqlalchemy.sql.expression import Executable, ClauseElement
+from sqlalchemy.ext.compiler import compiles
 
 from origin.config import SQL_DATABASE_URI, SQL_ALCHEMY_SETTINGS
 
@@ -19,6 +21,7 @@ if SQL_DATABASE_URI:
     Session = scoped_session(factory)
 else:
     from sqlalchemy.orm import Session
+    factory = Session
 
 
 def make_session(*args, **kwargs):
@@ -30,6 +33,32 @@ def make_session(*args, **kwargs):
     return Session(*args, **kwargs)
 
 
+def make_private_session(*args, **kwargs):
+    """
+    Create a new SQLAlchemy session, which, unlike make_session(), is not
+    the session shared by the current thread. It must be closed by the
+    caller, and is not closed by others closing the shared session.
+
+    :rtype: sqlalchemy.orm.Session
+    """
+    return factory(*args, **kwargs)
+
+
+# Postgres error code of "FOR UPDATE NOWAIT" failing to lock a row
+LOCK_NOT_AVAILABLE = '55P03'
+
+
+def is_lock_not_available(e):
+    """
+    Returns whether a database error was caused by failing to lock a row
+    locked by another transaction (ie. using "FOR UPDATE NOWAIT").
+
+    :param sqlalchemy.exc.DBAPIError e:
+    :rtype: bool
+    """
+    return getattr(e.orig, 'pgcode', None) == LOCK_NOT_AVAILABLE
+
+
 @decorator
 def inject_session(wrapped, instance, args, kwargs):
     """
@@ -61,6 +90,23 @@ def atomic(wrapped, instance, args, kwargs):
         return return_value
 
 
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN statement which returns the query plan of a statement
+    (without executing it) as JSON.
+    """
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kwargs):
+    return 'EXPLAIN (FORMAT JSON) %s' % compiler.process(
+        element.statement, **kwargs)
+
+
 class SqlQuery(object):
     """ORM-level SQL construction class."""
 
@@ -136,3 +182,23 @@ class SqlQuery(object):
         :return: True if result count is >= 1
         """
         return self.count() > 0
+
+    def get_count(self):
+        """
+        Returns the number of rows in the result set.
+
+        :rtype: int
+        """
+        return self.query.count()
+
+    def get_estimated_count(self):
+        """
+        Returns the query planner's estimate of the number of rows in the
+        result set. It is cheap no matter the size of the result set,
+        but only as accurate as the table statistics.
+
+        :rtype: int
+        """
+        statement = self.query.enable_eagerloads(False).statement
+        plan = self.session.execute(Explain(statement)).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
@@ -1 +1,3 @@
 from .schemas import FacilityFilters
+from .queries import RetireBackInTimeJobQuery
+from .models import RetireBackInTimeJob, RetireBackInTimeCheckpoint
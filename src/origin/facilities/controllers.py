@@ -6,6 +6,9 @@ from origin.db import inject_session, atomic
 from origin.technologies import Technology
 from origin.meteringpoints import \
     MeteringPoint, MeteringPointTag, MeteringPointQuery
+from origin.processes import create_retire_back_in_time_job
+
+from .queries import RetireBackInTimeJobQuery
 
 from .schemas import (
     FacilityOrder,
@@ -17,6 +20,7 @@ from .schemas import (
     GetFilteringOptionsResponse,
     SetRetiringPriorityRequest,
     SetRetiringPriorityResponse,
+    RetireBackInTimeResponse,
 )
 
 
@@ -158,40 +162,49 @@ class SetRetiringPriority(Controller):
         return GetFilteringOptionsResponse(success=True)
 
 
-# class RetireBackInTime(Controller):
-#     """
-#     Starts a pipeline to retire GGOs back in time.
-#     """
-#     datahub = DataHubService()
-#
-#     @requires_login
-#     @inject_session
-#     def handle_request(self, user, session):
-#         """
-#         :param User user:
-#         :param Session session:
-#         :rtype: bool
-#         """
-#         gsrn = FacilityQuery(session) \
-#             .belongs_to(user) \
-#             .is_consumer() \
-#             .get_distinct_gsrn()
-#
-#         if gsrn:
-#             # Get first and last "begin" for all measurements of all
-#             # facilities which are retiring GGOs
-#             response = self.datahub.get_measurement_begin_range(
-#                 token=user.access_token,
-#                 request=GetBeginRangeRequest(
-#                     filters=MeasurementFilters(gsrn=gsrn),
-#                 )
-#             )
-#
-#             if response.first and response.last:
-#                 start_consume_back_in_time_pipeline(
-#                     user=user,
-#                     begin_from=response.first,
-#                     begin_to=response.last,
-#                 )
-#
-#         return True
+class RetireBackInTime(Controller):
+    """
+    Starts (or resumes) a pipeline to retire GGOs back in time.
+    The job is run by the "retire-back-in-time" worker.
+    """
+    Response = md.class_schema(RetireBackInTimeResponse)
+
+    @requires_login
+    @atomic
+    def handle_request(self, user, session):
+        """
+        :param User user:
+        :param Session session:
+        :rtype: RetireBackInTimeResponse
+        """
+        job = create_retire_back_in_time_job(user, session)
+
+        return RetireBackInTimeResponse(
+            success=True,
+            progress=job,
+        )
+
+
+class GetRetireBackInTimeProgress(Controller):
+    """
+    Returns the progress of the user's latest pipeline to
+    retire GGOs back in time (if any).
+    """
+    Response = md.class_schema(RetireBackInTimeResponse)
+
+    @requires_login
+    @inject_session
+    def handle_request(self, user, session):
+        """
+        :param User user:
+        :param Session session:
+        :rtype: RetireBackInTimeResponse
+        """
+        job = RetireBackInTimeJobQuery(session) \
+            .belongs_to(user) \
+            .get_latest()
+
+        return RetireBackInTimeResponse(
+            success=True,
+            progress=job,
+        )
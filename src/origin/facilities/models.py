@@ -0,0 +1,164 @@
+import sqlalchemy as sa
+from uuid import uuid4
+from datetime import timedelta
+from sqlalchemy.orm import relationship
+
+from origin.db import ModelBase
+
+
+class RetireBackInTimeJob(ModelBase):
+    """
+    A (resumable) job which consumes a user's stored GGOs back in time,
+    from the first to the last measured consumption of the user's
+    facilities. The period is split into chunks, each of which is
+    consumed in a separate transaction and checkpointed once completed.
+    """
+    __tablename__ = 'facilities_retire_back_in_time_job'
+
+    id = sa.Column(sa.Integer(), primary_key=True, index=True)
+    public_id = sa.Column(sa.String(), index=True, nullable=False)
+    created = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now())
+
+    # Time when all chunks were completed (if at all)
+    completed = sa.Column(sa.DateTime(timezone=True))
+
+    # Period to consume GGOs within (from included, to excluded)
+    begin_from = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    begin_to = sa.Column(sa.DateTime(timezone=True), nullable=False)
+
+    # Relationships
+    user_subject = sa.Column(sa.String(), sa.ForeignKey('user.subject'), index=True, nullable=False)
+    user = relationship('User', foreign_keys=[user_subject])
+    checkpoints = relationship('RetireBackInTimeCheckpoint', back_populates='job', uselist=True, order_by='asc(RetireBackInTimeCheckpoint.begin_from)')
+
+    @property
+    def completed_checkpoints(self):
+        """
+        :rtype: list[RetireBackInTimeCheckpoint]
+        """
+        return [c for c in self.checkpoints if c.completed is not None]
+
+    @property
+    def chunks_total(self):
+        """
+        :rtype: int
+        """
+        return len(self.checkpoints)
+
+    @property
+    def chunks_completed(self):
+        """
+        :rtype: int
+        """
+        return len(self.completed_checkpoints)
+
+    @property
+    def ggos_consumed(self):
+        """
+        :rtype: int
+        """
+        return sum(c.ggo_count for c in self.completed_checkpoints)
+
+    @property
+    def hours_processed(self):
+        """
+        :rtype: int
+        """
+        return sum(c.hours for c in self.completed_checkpoints)
+
+    @property
+    def elapsed_seconds(self):
+        """
+        Time spent consuming the completed chunks.
+
+        :rtype: float
+        """
+        return sum(c.elapsed_seconds for c in self.completed_checkpoints)
+
+    @property
+    def ggos_per_second(self):
+        """
+        :rtype: float
+        """
+        if self.elapsed_seconds > 0:
+            return self.ggos_consumed / self.elapsed_seconds
+        return 0.0
+
+    @property
+    def hours_per_second(self):
+        """
+        :rtype: float
+        """
+        if self.elapsed_seconds > 0:
+            return self.hours_processed / self.elapsed_seconds
+        return 0.0
+
+    def add_chunks(self, chunk_size):
+        """
+        Splits the period into chunks of the provided size,
+        and adds a checkpoint for each of them.
+
+        :param timedelta chunk_size:
+        """
+        begin = self.begin_from
+
+        while begin < self.begin_to:
+            end = min(begin + chunk_size, self.begin_to)
+            self.checkpoints.append(RetireBackInTimeCheckpoint(
+                user_subject=self.user_subject,
+                begin_from=begin,
+                begin_to=end,
+            ))
+            begin = end
+
+
+class RetireBackInTimeCheckpoint(ModelBase):
+    """
+    A single chunk of a RetireBackInTimeJob. The chunk has been consumed
+    once completed is set.
+    """
+    __tablename__ = 'facilities_retire_back_in_time_checkpoint'
+    __table_args__ = (
+        sa.UniqueConstraint('job_id', 'begin_from'),
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True, index=True)
+    job_id = sa.Column(sa.Integer(), sa.ForeignKey('facilities_retire_back_in_time_job.id', ondelete='CASCADE'), index=True, nullable=False)
+    job = relationship('RetireBackInTimeJob', foreign_keys=[job_id], back_populates='checkpoints')
+    user_subject = sa.Column(sa.String(), sa.ForeignKey('user.subject'), index=True, nullable=False)
+
+    # Period to consume GGOs within (from included, to excluded)
+    begin_from = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    begin_to = sa.Column(sa.DateTime(timezone=True), nullable=False)
+
+    # Time when consuming the chunk started and completed
+    started = sa.Column(sa.DateTime(timezone=True))
+    completed = sa.Column(sa.DateTime(timezone=True), index=True)
+
+    # Number of GGOs consumed
+    ggo_count = sa.Column(sa.Integer(), nullable=False, default=0)
+
+    @property
+    def hours(self):
+        """
+        :rtype: int
+        """
+        return (self.begin_to - self.begin_from) // timedelta(hours=1)
+
+    @property
+    def elapsed_seconds(self):
+        """
+        :rtype: float
+        """
+        if self.started and self.completed:
+            return (self.completed - self.started).total_seconds()
+        return 0.0
+
+
+# ----------------------------------------------------------------------------
+
+
+@sa.event.listens_for(RetireBackInTimeJob, 'before_insert')
+def on_before_creating_task(mapper, connect, job):
+    if not job.public_id:
+        job.public_id = str(uuid4())
@@ -0,0 +1,50 @@
+from origin.db import SqlQuery
+
+from .models import RetireBackInTimeJob
+
+
+class RetireBackInTimeJobQuery(SqlQuery):
+    """
+    Abstraction around querying RetireBackInTimeJob objects from
+    the database, supporting cascade calls to combine filters.
+    """
+    def _get_base_query(self):
+        return self.session.query(RetireBackInTimeJob)
+
+    def has_id(self, job_id):
+        """
+        :param int job_id:
+        :rtype: RetireBackInTimeJobQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            RetireBackInTimeJob.id == job_id,
+        ))
+
+    def belongs_to(self, user):
+        """
+        :param origin.auth.User user:
+        :rtype: RetireBackInTimeJobQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            RetireBackInTimeJob.user_subject == user.subject,
+        ))
+
+    def is_completed(self, value=True):
+        """
+        :param bool value:
+        :rtype: RetireBackInTimeJobQuery
+        """
+        if value:
+            f = RetireBackInTimeJob.completed.isnot(None)
+        else:
+            f = RetireBackInTimeJob.completed.is_(None)
+
+        return self.__class__(self.session, self.query.filter(f))
+
+    def get_latest(self):
+        """
+        :rtype: RetireBackInTimeJob
+        """
+        return self.query \
+            .order_by(RetireBackInTimeJob.id.desc()) \
+            .first()
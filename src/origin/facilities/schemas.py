@@ -1,6 +1,7 @@
 import marshmallow
 from enum import Enum
 from typing import List, Union
+from datetime import datetime
 from marshmallow_dataclass import NewType
 from dataclasses import dataclass, field
 
@@ -122,3 +123,26 @@ class SetRetiringPriorityRequest:
 @dataclass
 class SetRetiringPriorityResponse:
     success: bool
+
+
+# -- RetireBackInTime request and response -----------------------------------
+
+
+@dataclass
+class RetireBackInTimeProgress:
+    public_id: str = field(metadata=dict(data_key='id'))
+    begin_from: datetime = field(metadata=dict(data_key='beginFrom'))
+    begin_to: datetime = field(metadata=dict(data_key='beginTo'))
+    completed: datetime
+    chunks_total: int = field(metadata=dict(data_key='chunksTotal'))
+    chunks_completed: int = field(metadata=dict(data_key='chunksCompleted'))
+    ggos_consumed: int = field(metadata=dict(data_key='ggosConsumed'))
+    hours_processed: int = field(metadata=dict(data_key='hoursProcessed'))
+    ggos_per_second: float = field(metadata=dict(data_key='ggosPerSecond'))
+    hours_per_second: float = field(metadata=dict(data_key='hoursPerSecond'))
+
+
+@dataclass
+class RetireBackInTimeResponse:
+    success: bool
+    progress: RetireBackInTimeProgress = None
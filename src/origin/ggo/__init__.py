@@ -1,11 +1,19 @@
 from .schemas import MappedGgo, GgoCategory
-from .queries import GgoQuery, TransactionQuery
+from .queries import GgoQuery, GgoAggregateQuery, TransactionQuery, GgoDistributions
 from .composer import GgoComposer
+from .cache import SummaryCache, summary_cache
+from .rollups import rebuild_rollups
 from .models import (
     Ggo,
     Batch,
+    BatchState,
     Transaction,
     SplitTransaction,
     SplitTarget,
+    Transfer,
     RetireTransaction,
+    PendingConsumption,
+    SummaryVersion,
+    RollupDirection,
+    GgoRollup,
 )
@@ -0,0 +1,180 @@
+import time
+import threading
+import sqlalchemy as sa
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+
+from origin.config import GGO_SUMMARY_CACHE_ROWS, GGO_SUMMARY_CACHE_TTL
+
+from .models import Ggo, SummaryVersion
+
+
+class SummaryCache(object):
+    """
+    Caches the results of GGO summaries (see GgoSummary) of a subject,
+    keyed by the subject and the summary's SQL statement (including its
+    parameters), which covers its filters, resolution, grouping, and
+    UTC offset.
+
+    Cached results are valid until either their TTL expires, or the
+    subject's SummaryVersion changes, which happens when a database
+    transaction which issues or changes any of the subject's GGOs (ie.
+    when a Batch commits or rolls back) commits, no matter which process
+    it happens in. Looking up the version costs a single primary key
+    lookup, as opposed to aggregating the subject's GGOs.
+
+    Memory is bounded by the total number of rows cached; the least
+    recently used results are evicted first.
+    """
+
+    def __init__(self, max_rows, ttl):
+        """
+        :param int max_rows: Maximum total number of rows to cache
+        :param int ttl: Seconds to cache results for
+        """
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self.rows = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session, subject, query):
+        """
+        Returns the results of the provided query, either from the cache,
+        or by executing it (and caching the results).
+
+        :param sqlalchemy.orm.Session session:
+        :param str subject:
+        :param sqlalchemy.orm.Query query:
+        :rtype: list[tuple]
+        """
+        if self.max_rows <= 0:
+            return [tuple(row) for row in query]
+
+        compiled = query.statement.compile(dialect=session.get_bind().dialect)
+        key = (subject, str(compiled), repr(sorted(compiled.params.items())))
+
+        # The version is looked up before executing the query, so results
+        # are never cached as newer than the GGOs they were computed from
+        version = self.get_version(session, subject)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_version, expires, results = entry
+                if entry_version == version and expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return results
+                self.pop(key)
+
+        results = [tuple(row) for row in query]
+
+        if len(results) <= self.max_rows:
+            with self.lock:
+                self.pop(key)
+                self.entries[key] = (
+                    version, time.monotonic() + self.ttl, results)
+                self.rows += len(results)
+
+                while self.rows > self.max_rows:
+                    self.pop(next(iter(self.entries)))
+
+        return results
+
+    def pop(self, key):
+        """
+        Removes an entry (if it exists). Must be invoked holding the lock.
+
+        :param tuple key:
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.rows -= len(entry[2])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.rows = 0
+
+    @staticmethod
+    def get_version(session, subject):
+        """
+        :param sqlalchemy.orm.Session session:
+        :param str subject:
+        :rtype: int
+        """
+        version = session \
+            .query(SummaryVersion.version) \
+            .filter(SummaryVersion.subject == subject) \
+            .scalar()
+
+        return version if version is not None else 0
+
+    @staticmethod
+    def increment_versions(session, subjects):
+        """
+        Increments the SummaryVersion of each of the provided subjects.
+
+        :param sqlalchemy.orm.Session session:
+        :param collections.abc.Iterable[str] subjects:
+        """
+        subjects = sorted(set(subjects))
+
+        if not subjects:
+            return
+
+        # Sorted, so concurrent transactions lock versions in the same order
+        statement = insert(SummaryVersion.__table__) \
+            .values([{'subject': s, 'version': 1} for s in subjects])
+
+        statement = statement.on_conflict_do_update(
+            index_elements=['subject'],
+            set_={'version': SummaryVersion.__table__.c.version + 1},
+        )
+
+        session.execute(statement)
+
+
+summary_cache = SummaryCache(GGO_SUMMARY_CACHE_ROWS, GGO_SUMMARY_CACHE_TTL)
+
+
+# -- Events ------------------------------------------------------------------
+
+
+SESSION_KEY = 'ggo_summary_subjects'
+
+
+@sa.event.listens_for(Session, 'after_flush')
+def on_after_flush(session, flush_context):
+    """
+    Collects the subjects of GGOs inserted, updated, or deleted.
+    """
+    subjects = set(
+        obj.subject
+        for objects in (session.new, session.dirty, session.deleted)
+        for obj in objects
+        if isinstance(obj, Ggo)
+    )
+
+    if subjects:
+        session.info.setdefault(SESSION_KEY, set()).update(subjects)
+
+
+@sa.event.listens_for(Session, 'before_commit')
+def on_before_commit(session):
+    """
+    Increments the SummaryVersion of the subjects collected, as part of
+    the transaction, so it happens if (and only if) the GGOs change.
+    """
+    session.flush()
+
+    subjects = session.info.pop(SESSION_KEY, None)
+
+    if subjects:
+        SummaryCache.increment_versions(session, subjects)
+
+
+@sa.event.listens_for(Session, 'after_rollback')
+def on_after_rollback(session):
+    session.info.pop(SESSION_KEY, None)
@@ -0,0 +1,73 @@
+from click import echo, Abort
+from cloup import group, command, option, IntRange
+
+from origin.db import atomic, make_session
+
+from .rollups import rebuild_rollups
+from .plans import check_query_plans
+
+
+# -- Commands ----------------------------------------------------------------
+
+
+@command()
+@atomic
+def rebuild_ggo_rollups(session):
+    """
+    Rebuild GGO rollups (used by summaries) from scratch
+    """
+    count = rebuild_rollups(session)
+    echo(f'Rebuilt {count} rollups')
+
+
+@command()
+@option(
+    '--owners',
+    type=IntRange(min=1),
+    required=True,
+    default=200,
+    help='Number of users to seed GGOs for',
+)
+@option(
+    '--hours',
+    type=IntRange(min=24 * 8),
+    required=True,
+    default=24 * 180,
+    help='Number of hours (back from now) to seed GGOs for, per user',
+)
+def check_ggo_query_plans(owners, hours):
+    """
+    Check that GGO queries use the indexes intended for them.
+
+    Seeds GGOs, runs EXPLAIN on the queries, and fails if any of them
+    scans the GGO table differently than expected. Everything is rolled
+    back afterwards, so nothing is written to the database.
+    """
+    session = make_session()
+    try:
+        checks = check_query_plans(session, owners, hours)
+    finally:
+        session.rollback()
+        session.close()
+
+    for check in checks:
+        echo(f'{check.name:<32} {check.used or "(sequential scan)":<32} '
+             f'{"OK" if check.passed else f"FAILED, expected {check.expected}"}')
+
+    if not all(check.passed for check in checks):
+        raise Abort()
+
+
+# -- Group -------------------------------------------------------------------
+
+
+@group()
+def ggo_group() -> None:
+    """
+    Manage GGOs
+    """
+    pass
+
+
+ggo_group.add_command(rebuild_ggo_rollups, 'rebuild-rollups')
+ggo_group.add_command(check_ggo_query_plans, 'check-query-plans')
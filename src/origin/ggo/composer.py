@@ -1,8 +1,8 @@
 from origin.auth import User
-from origin.measurements import Measurement, MeasurementQuery
+from origin.measurements import \
+    Measurement, MeasurementQuery, lock_retire_accounting
 from origin.meteringpoints import MeteringPoint, MeteringPointType
 
-from .queries import GgoQuery
 from .models import Ggo, Batch, SplitTransaction, RetireTransaction
 
 
@@ -52,6 +52,14 @@ class GgoComposer(object):
             self.ggo = ggo
             self.measurement = measurement
 
+    class RetireLocked(Exception):
+        """
+        Raised when trying to retire while another transaction is
+        retiring to the same consumption (see lock_retire_accounting())
+        """
+        def __init__(self, begin):
+            self.begin = begin
+
     def __init__(self, ggo, session):
         """
         :param Ggo ggo: The GGO to transfer/retire
@@ -184,13 +192,13 @@ class GgoComposer(object):
                 retire_transactions.append(RetireTransaction.build(
                     ggo=ggo_to_retire,
                     meteringpoint=meteringpoint,
-                    measurement_id=measurement.id,
+                    measurement=measurement,
                 ))
             else:
                 retire_transactions.append(RetireTransaction.build(
                     ggo=self.ggo,
                     meteringpoint=meteringpoint,
-                    measurement_id=measurement.id,
+                    measurement=measurement,
                 ))
 
         # -- Setup Batch -----------------------------------------------------
@@ -224,14 +232,24 @@ class GgoComposer(object):
         """
         Get the already retired amount for a specific measurement.
 
+        The retire accounting of the GGO's owner at the measurement's
+        begin is locked until the transaction ends, so the amount can not
+        be retired to concurrently. Fails rather than waiting if another
+        transaction holds the lock.
+
         :param Measurement measurement:
         :rtype: int
         """
-        return GgoQuery(self.session) \
-            .belongs_to(self.ggo.user) \
-            .is_retired(True) \
-            .is_retired_to_measurement(measurement) \
-            .get_total_amount()
+        locked = lock_retire_accounting(
+            self.session, [(self.ggo.subject, measurement.begin)], nowait=True)
+
+        if not locked:
+            raise self.RetireLocked(measurement.begin)
+
+        return self.session \
+            .query(Measurement.retired_amount) \
+            .filter(Measurement.id == measurement.id) \
+            .scalar()
 
     def get_consumption(self, gsrn, begin):
         """
@@ -248,3 +266,39 @@ class GgoComposer(object):
             .has_gsrn(gsrn) \
             .begins_at(begin) \
             .one_or_none()
+
+
+class PrefetchedGgoComposer(GgoComposer):
+    """
+    A GgoComposer which looks up consumption measurements, and the amounts
+    already retired to them, in prefetched dicts rather than querying them
+    for each retire (see ComposeGgoBulk).
+    """
+
+    def __init__(self, ggo, session, measurements, retired_amounts):
+        """
+        :param Ggo ggo: The GGO to transfer/retire
+        :param sqlalchemy.orm.Session session:
+        :param dict[(str, datetime.datetime), Measurement] measurements:
+            Consumption measurements by (gsrn, begin)
+        :param dict[int, int] retired_amounts:
+            Amounts retired by measurement ID
+        """
+        super(PrefetchedGgoComposer, self).__init__(ggo, session)
+        self.measurements = measurements
+        self.retired_amounts = retired_amounts
+
+    def get_retired_amount(self, measurement):
+        """
+        :param Measurement measurement:
+        :rtype: int
+        """
+        return self.retired_amounts[measurement.id]
+
+    def get_consumption(self, gsrn, begin):
+        """
+        :param str gsrn:
+        :param datetime.datetime begin:
+        :rtype: Measurement
+        """
+        return self.measurements.get((gsrn, begin))
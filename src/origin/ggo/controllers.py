@@ -1,16 +1,22 @@
 import marshmallow_dataclass as md
+import sqlalchemy as sa
 
 from origin.auth import requires_login, UserQuery
-from origin.db import inject_session, atomic
-from origin.http import Controller, BadRequest
+from origin.config import SUBMIT_BATCHES_TO_LEDGER
+from origin.db import inject_session, atomic, is_lock_not_available
+from origin.http import Controller, BadRequest, Conflict
 from origin.meteringpoints import MeteringPointQuery
+from origin.measurements import MeasurementQuery, lock_retire_accounting
+from origin.common.export import export_response
+from origin.common.pagination import paginate, get_total
 
 from .models import Ggo
 from .queries import GgoQuery
-from .composer import GgoComposer
-from .schemas import GetGgoListRequest, GetGgoListResponse, \
+from .composer import GgoComposer, PrefetchedGgoComposer
+from .schemas import GetGgoListRequest, GetGgoListResponse, ExportGgoListRequest, \
     GetGgoSummaryRequest, GetGgoSummaryResponse, GetTransferSummaryRequest, \
-    GetTransferSummaryResponse, ComposeGgoRequest, ComposeGgoResponse
+    GetTransferSummaryResponse, ComposeGgoRequest, ComposeGgoResponse, \
+    ComposeGgoBulkRequest, ComposeGgoBulkResponse, ComposeGgoBulkResult
 
 
 class GetGgoList(Controller):
@@ -36,20 +42,57 @@ class GetGgoList(Controller):
             .belongs_to(user) \
             .apply_filters(request.filters)
 
-        results = query \
-            .order_by(GgoQuery.begin.asc()) \
-            .offset(request.offset)
-
-        if request.limit:
-            results = results.limit(request.limit)
+        try:
+            results, next_cursor = paginate(
+                query=query,
+                columns=[Ggo.begin, Ggo.id],
+                limit=request.limit,
+                cursor=request.cursor,
+                offset=request.offset,
+            )
+        except ValueError as e:
+            raise BadRequest(str(e))
 
         return GetGgoListResponse(
             success=True,
-            total=query.count(),
-            results=results.all(),
+            total=get_total(query, request.total),
+            results=results,
+            next_cursor=next_cursor,
         )
 
 
+class ExportGgoList(Controller):
+    """
+    Exports the GGOs which belongs to the account as NDJSON or CSV, filtered
+    like /ggo. The export is streamed from the database as it is written
+    to the client, so it is not limited in size.
+    """
+    Request = md.class_schema(ExportGgoListRequest)
+
+    @requires_login
+    def handle_request(self, request, user):
+        """
+        :param ExportGgoListRequest request:
+        :param origin.auth.User user:
+        :rtype: flask.Response
+        """
+        return export_response(
+            lambda session: self.get_query(request, user, session),
+            request.format, 'ggos')
+
+    def get_query(self, request, user, session):
+        """
+        :param ExportGgoListRequest request:
+        :param origin.auth.User user:
+        :param sqlalchemy.orm.Session session:
+        :rtype: sqlalchemy.orm.Query
+        """
+        return GgoQuery(session) \
+            .belongs_to(user) \
+            .apply_filters(request.filters) \
+            .get_export_query()
+
+
 class GetGgoSummary(Controller):
     """
     Returns a summary of the account's GGOs, or a subset hereof.
@@ -74,7 +117,8 @@ class GetGgoSummary(Controller):
             .apply_filters(request.filters)
 
         summary = query.get_summary(
-            request.resolution, request.grouping, request.utc_offset)
+            request.resolution, request.grouping, request.utc_offset,
+            subject=user.subject)
 
         if request.fill and request.filters.begin_range:
             summary.fill(request.filters.begin_range)
@@ -253,7 +297,8 @@ class GetTransferSummary(Controller):
             query = query.sent_or_received_by_user(user)
 
         summary = query.get_summary(
-            request.resolution, request.grouping, request.utc_offset)
+            request.resolution, request.grouping, request.utc_offset,
+            subject=user.subject)
 
         if request.fill and request.filters.begin_range:
             summary.fill(request.filters.begin_range)
@@ -336,6 +381,11 @@ class ComposeGgo(Controller):
     at the time invoking this endpoint. This will result in the parent GGO
     being stored and available to the user's account again, thus also cancelling
     transfers and retires.
+
+    The GGO is locked while it is being composed. If it is already locked
+    by a concurrent request (or is being consumed), or if another
+    transaction is retiring to the same consumption, the request fails
+    immediately with HTTP status 409 (Conflict), and can be retried.
     """
     Request = md.class_schema(ComposeGgoRequest)
     Response = md.class_schema(ComposeGgoResponse)
@@ -374,48 +424,43 @@ class ComposeGgo(Controller):
         composer = self.get_composer(ggo, session)
 
         for transfer in transfers:
-            self.add_transfer(composer, transfer, session)
+            target_user = self.get_user(transfer.account, session)
+            self.add_transfer(composer, transfer, target_user)
 
         for retire in retires:
-            self.add_retire(user, composer, retire, session)
+            meteringpoint = self.get_metering_point(user, retire.gsrn, session)
+            self.add_retire(composer, retire, meteringpoint)
 
-        try:
-            batch, recipients = composer.build_batch()
-        except composer.Empty:
-            raise BadRequest('Nothing to transfer/retire')
-        except composer.AmountUnavailable:
-            raise BadRequest('Requested amount exceeds available amount')
-
-        batch.on_commit()
+        batch, recipients = self.build_batch(composer)
 
         session.add(batch)
 
         return batch, recipients
 
-    def add_transfer(self, composer, request, session):
+    def add_transfer(self, composer, request, target_user):
         """
         :param GgoComposer composer:
         :param TransferRequest request:
-        :param sqlalchemy.orm.Session session:
+        :param User target_user: The user to transfer to, if it exists
         """
-        target_user = self.get_user(request.account, session)
-
         if target_user is None:
             raise BadRequest(f'Account unavailable ({request.account})')
+        if request.amount > composer.ggo.amount:
+            raise BadRequest('Requested amount exceeds available amount')
 
         composer.add_transfer(target_user, request.amount, request.reference)
 
-    def add_retire(self, user, composer, request, session):
+    def add_retire(self, composer, request, meteringpoint):
         """
-        :param User user:
         :param GgoComposer composer:
         :param RetireRequest request:
-        :param sqlalchemy.orm.Session session:
+        :param MeteringPoint meteringpoint: The MeteringPoint to retire
+            to, if it exists
         """
-        meteringpoint = self.get_metering_point(user, request.gsrn, session)
-
         if meteringpoint is None:
             raise BadRequest(f'MeteringPoint unavailable (GSRN: {request.gsrn})')
+        if request.amount > composer.ggo.amount:
+            raise BadRequest('Requested amount exceeds available amount')
 
         try:
             composer.add_retire(meteringpoint, request.amount)
@@ -431,6 +476,29 @@ class ComposeGgo(Controller):
                 f'Can only retire up to {e.allowed_amount} '
                 f'(you tried to retire {e.amount})'
             ))
+        except composer.RetireLocked as e:
+            raise Conflict((
+                f'Consumption at {e.begin} is being retired to by '
+                f'another request, please try again'
+            ))
+
+    def build_batch(self, composer):
+        """
+        :param GgoComposer composer:
+        :rtype: (Batch, list[User])
+        """
+        try:
+            batch, recipients = composer.build_batch()
+        except composer.Empty:
+            raise BadRequest('Nothing to transfer/retire')
+        except composer.AmountUnavailable:
+            raise BadRequest('Requested amount exceeds available amount')
+
+        # Otherwise, the batch is completed by the ledger submitter
+        if not SUBMIT_BATCHES_TO_LEDGER:
+            batch.on_commit()
+
+        return batch, recipients
 
     def get_ggo(self, user, ggo_id, session):
         """
@@ -439,11 +507,20 @@ class ComposeGgo(Controller):
         :param sqlalchemy.orm.Session session:
         :rtype: Ggo
         """
-        ggo = GgoQuery(session) \
-            .belongs_to(user) \
-            .has_public_id(ggo_id) \
-            .is_tradable() \
-            .one_or_none()
+        try:
+            ggo = GgoQuery(session) \
+                .belongs_to(user) \
+                .has_public_id(ggo_id) \
+                .is_tradable() \
+                .for_update(nowait=True) \
+                .one_or_none()
+        except sa.exc.OperationalError as e:
+            if is_lock_not_available(e):
+                raise Conflict((
+                    f'GGO is being transferred or retired by another '
+                    f'request, please try again: {ggo_id}'
+                ))
+            raise
 
         if not ggo:
             raise BadRequest('GGO not found or is unavailable: %s' % ggo_id)
@@ -481,6 +558,253 @@ class ComposeGgo(Controller):
         return GgoComposer(*args, **kwargs)
 
 
+class ComposeGgoBulk(ComposeGgo):
+    """
+    Composes many GGOs at once (ie. a day's worth of hourly GGOs) in a
+    single transaction. Each item is composed the same way as ComposeGgo
+    composes a single GGO, but GGOs, accounts, MeteringPoints, and
+    consumption measurements are looked up for all items at once, rather
+    than for each item (and each transfer and retire) one at a time.
+
+    Items succeed or fail independently of each other, and the result of
+    each item is returned in the order they were requested. The returned
+    value of "success" is only true if all items succeeded.
+
+    GGOs locked by concurrent requests (or being consumed) are skipped,
+    failing only their items. Likewise, if a GGO is repeated within the
+    request, only the first of its items is composed. If another
+    transaction is retiring to the same consumption as any of the items,
+    the request fails immediately with HTTP status 409 (Conflict), and
+    can be retried.
+    """
+    Request = md.class_schema(ComposeGgoBulkRequest)
+    Response = md.class_schema(ComposeGgoBulkResponse)
+
+    @requires_login
+    def handle_request(self, request, user):
+        """
+        :param ComposeGgoBulkRequest request:
+        :param origin.auth.User user:
+        :rtype: ComposeGgoBulkResponse
+        """
+        results = self.compose_all(
+            user=user,
+            items=request.items,
+        )
+
+        return ComposeGgoBulkResponse(
+            success=all(r.success for r in results),
+            results=results,
+        )
+
+    @atomic
+    def compose_all(self, user, items, session):
+        """
+        :param User user:
+        :param list[ComposeGgoBulkItem] items:
+        :param sqlalchemy.orm.Session session:
+        :rtype: list[ComposeGgoBulkResult]
+        """
+        ggos, locked = self.get_ggos(
+            user, [item.id for item in items], session)
+
+        users = self.get_users(
+            {t.account for item in items for t in item.transfers}, session)
+
+        meteringpoints = self.get_metering_points(
+            user, {r.gsrn for item in items for r in item.retires}, session)
+
+        begins = {ggos[item.id].begin for item in items
+                  if item.retires and item.id in ggos}
+
+        self.lock_retire_accounting(user, begins, session)
+
+        measurements, retired_amounts = self.get_consumption(
+            list(meteringpoints), begins, session)
+
+        results = []
+        composed = set()
+
+        for item in items:
+            try:
+                self.compose_item(
+                    item, ggos, locked, composed, users, meteringpoints,
+                    measurements, retired_amounts, session)
+            except (BadRequest, Conflict) as e:
+                results.append(ComposeGgoBulkResult(
+                    id=item.id, success=False, message=e.description))
+            else:
+                results.append(ComposeGgoBulkResult(
+                    id=item.id, success=True))
+
+        return results
+
+    def compose_item(self, item, ggos, locked, composed, users,
+                     meteringpoints, measurements, retired_amounts, session):
+        """
+        :param ComposeGgoBulkItem item:
+        :param dict[str, Ggo] ggos: GGOs by public ID
+        :param set[str] locked: Public IDs of GGOs locked by others
+        :param set[str] composed: Public IDs of GGOs composed by previous
+            items, updated when this item succeeds
+        :param dict[str, User] users: Users by subject
+        :param dict[str, MeteringPoint] meteringpoints: By GSRN
+        :param dict[(str, datetime.datetime), Measurement] measurements:
+        :param dict[int, int] retired_amounts: By measurement ID
+        :param sqlalchemy.orm.Session session:
+        """
+        ggo = ggos.get(item.id)
+
+        if item.id in locked:
+            raise Conflict((
+                f'GGO is being transferred or retired by another '
+                f'request, please try again: {item.id}'
+            ))
+
+        if ggo is None or not ggo.is_tradable():
+            raise BadRequest('GGO not found or is unavailable: %s' % item.id)
+
+        # The GGO remains stored until its batch begins, so an ID repeated
+        # within the request is not caught by is_tradable() above
+        if item.id in composed:
+            raise BadRequest((
+                f'GGO is composed by a previous item in the '
+                f'same request: {item.id}'
+            ))
+
+        composer = PrefetchedGgoComposer(
+            ggo, session, measurements, retired_amounts)
+
+        for transfer in item.transfers:
+            self.add_transfer(composer, transfer, users.get(transfer.account))
+
+        for retire in item.retires:
+            self.add_retire(composer, retire, meteringpoints.get(retire.gsrn))
+
+        batch, recipients = self.build_batch(composer)
+
+        session.add(batch)
+
+        for measurement, meteringpoint, amount in composer.retires:
+            retired_amounts[measurement.id] += amount
+
+        composed.add(item.id)
+
+    def get_ggos(self, user, ggo_ids, session):
+        """
+        Returns the tradable GGOs with the provided public IDs, by public
+        ID, along with the public IDs of those which are locked by
+        concurrent transactions, and therefore skipped.
+
+        The rows of the returned GGOs are locked until the
+        transaction ends.
+
+        :param User user:
+        :param list[str] ggo_ids:
+        :param sqlalchemy.orm.Session session:
+        :rtype: (dict[str, Ggo], set[str])
+        """
+        query = GgoQuery(session) \
+            .belongs_to(user) \
+            .has_any_public_id(ggo_ids) \
+            .is_tradable()
+
+        ggos = {ggo.public_id: ggo
+                for ggo in query.for_update(skip_locked=True).all()}
+
+        if len(ggos) == len(set(ggo_ids)):
+            return ggos, set()
+
+        # Tradable GGOs which were skipped are locked by others
+        locked = query \
+            .filter(Ggo.public_id.notin_(list(ggos))) \
+            .with_entities(Ggo.public_id) \
+            .all()
+
+        return ggos, {public_id for public_id, in locked}
+
+    def get_users(self, subjects, session):
+        """
+        :param set[str] subjects:
+        :param sqlalchemy.orm.Session session:
+        :rtype: dict[str, User]
+        """
+        if not subjects:
+            return {}
+
+        users = UserQuery(session) \
+            .is_active() \
+            .has_any_subject(list(subjects)) \
+            .all()
+
+        return {u.subject: u for u in users}
+
+    def get_metering_points(self, user, gsrn, session):
+        """
+        :param User user:
+        :param set[str] gsrn:
+        :param sqlalchemy.orm.Session session:
+        :rtype: dict[str, MeteringPoint]
+        """
+        if not gsrn:
+            return {}
+
+        meteringpoints = MeteringPointQuery(session) \
+            .belongs_to(user) \
+            .has_any_gsrn(list(gsrn)) \
+            .is_consumption() \
+            .all()
+
+        return {mp.gsrn: mp for mp in meteringpoints}
+
+    def lock_retire_accounting(self, user, begins, session):
+        """
+        Locks the user's retire accounting at the provided begins until
+        the transaction ends, so the consumption can not be retired to
+        concurrently. Fails rather than waiting if another transaction
+        holds any of the locks.
+
+        :param User user:
+        :param set[datetime.datetime] begins:
+        :param sqlalchemy.orm.Session session:
+        """
+        keys = [(user.subject, begin) for begin in begins]
+
+        if not lock_retire_accounting(session, keys, nowait=True):
+            raise Conflict((
+                'Consumption is being retired to by another request, '
+                'please try again'
+            ))
+
+    def get_consumption(self, gsrn, begins, session):
+        """
+        Returns the consumption measurements of the provided GSRN numbers
+        at the provided begins, by (gsrn, begin), along with the amounts
+        already retired to them (Measurement.retired_amount), by
+        measurement ID.
+
+        The retire accounting of the begins must have been locked
+        beforehand (see lock_retire_accounting()).
+
+        :param list[str] gsrn:
+        :param set[datetime.datetime] begins:
+        :param sqlalchemy.orm.Session session:
+        :rtype: (dict[(str, datetime.datetime), Measurement], dict[int, int])
+        """
+        if not gsrn or not begins:
+            return {}, {}
+
+        measurements = MeasurementQuery(session) \
+            .has_any_gsrn(gsrn) \
+            .begins_at_any(list(begins)) \
+            .all()
+
+        return (
+            {(m.gsrn, m.begin): m for m in measurements},
+            {m.id: m.retired_amount for m in measurements},
+        )
+
+
 # class OnGgoIssuedWebhook(Controller):
 #     """
 #     Invoked by DataHubService when new GGO(s) have been issued
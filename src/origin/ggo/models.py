@@ -2,7 +2,7 @@ from enum import Enum
 from uuid import uuid4
 
 import sqlalchemy as sa
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 
 from sqlalchemy import func
 from sqlalchemy.orm import relationship, declared_attr
@@ -23,6 +23,28 @@ class Ggo(ModelBase):
     __tablename__ = 'ggo'
     __table_args__ = (
         sa.UniqueConstraint('measurement_id'),
+
+        # Composite and partial indexes matching the predicates GgoQuery
+        # combines (see GgoQuery.is_tradable(), in_category() etc.).
+        # Postgres only uses a partial index if it can prove its predicate
+        # from the query, which it can't for "stored IS TRUE" => "stored",
+        # so predicates are written the way GgoQuery filters them.
+        sa.Index('ix_ggo_subject_begin', 'subject', 'begin'),
+        sa.Index(
+            'ix_ggo_stored_subject_begin', 'subject', 'begin',
+            postgresql_include=['amount', 'expire_time'],
+            postgresql_where=sa.text('stored IS TRUE'),
+        ),
+        sa.Index(
+            'ix_ggo_retired_measurement', 'retire_measurement_id',
+            postgresql_include=['amount'],
+            postgresql_where=sa.text('retired IS TRUE'),
+        ),
+        sa.Index(
+            'ix_ggo_retired_gsrn_begin', 'retire_gsrn', 'begin',
+            postgresql_include=['amount'],
+            postgresql_where=sa.text('retired IS TRUE'),
+        ),
     )
 
     id = sa.Column(sa.Integer(), primary_key=True, index=True)
@@ -210,12 +232,20 @@ class Batch(ModelBase):
 
         - Invoke on_submitted() once the batch has been submitted to the ledger
 
+        - Invoke on_polled() each time the ledger has been polled for the
+          batch's status, while the batch is still being processed
+
         - Invoke on_commit() once/if the batch has been completed on the ledger
 
         - Invoke on_rollback() once/if the batch has been declined on the ledger
 
     """
     __tablename__ = 'ledger_batch'
+    __table_args__ = (
+        # Batches to submit, and submitted batches due to be polled
+        # (see origin.ledger.submitter)
+        sa.Index('ix_ledger_batch_state_next_poll', 'state', 'next_poll'),
+    )
 
     id = sa.Column(sa.Integer(), primary_key=True, index=True)
     created = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now())
@@ -235,6 +265,9 @@ class Batch(ModelBase):
     # How many times the ledger has been polled, asking for batch status
     poll_count = sa.Column(sa.Integer(), nullable=False, default=0)
 
+    # Time when the ledger should next be polled for the batch's status
+    next_poll = sa.Column(sa.DateTime(timezone=True), nullable=True)
+
     def add_transaction(self, transaction):
         """
         :param Transaction transaction:
@@ -255,13 +288,23 @@ class Batch(ModelBase):
         for transaction in self.transactions:
             transaction.on_begin()
 
-    def on_submitted(self, handle):
+    def on_submitted(self, handle, poll_delay=0):
         """
         :param str handle:
+        :param float poll_delay: Seconds to wait before polling the ledger
         """
         self.state = BatchState.SUBMITTED
         self.handle = handle
         self.submitted = func.now()
+        self.poll_count = 0
+        self.next_poll = func.now() + timedelta(seconds=poll_delay)
+
+    def on_polled(self, poll_delay):
+        """
+        :param float poll_delay: Seconds to wait before polling the ledger
+        """
+        self.poll_count += 1
+        self.next_poll = func.now() + timedelta(seconds=poll_delay)
 
     def on_commit(self):
         self.state = BatchState.COMPLETED
@@ -366,21 +409,38 @@ class SplitTransaction(Transaction):
         for target in self.targets:
             target.ggo.stored = True
 
+        self.add_transfers()
+
     def on_commit(self):
         self.parent_ggo.stored = False
 
         for target in self.targets:
             target.ggo.stored = True
 
+        self.add_transfers()
+
     def on_rollback(self):
         self.parent_ggo.stored = True
 
         session = Session.object_session(self)
 
+        # Deleting the targets also deletes their Transfers
         for target in self.targets:
             session.delete(target)
             session.delete(target.ggo)
 
+    def add_transfers(self):
+        """
+        Records a Transfer for each target owned by another subject than
+        the parent GGO, unless already recorded. Transfers are recorded
+        when the transaction begins (as opposed to when it's committed),
+        as pending transfers count towards agreements too.
+        """
+        for target in self.targets:
+            if target.transfer is None \
+                    and target.ggo.subject != self.parent_ggo.subject:
+                target.transfer = Transfer.build(self, target)
+
 
 class SplitTarget(ModelBase):
     """
@@ -406,6 +466,79 @@ class SplitTarget(ModelBase):
     # Client reference, like Agreement ID etc.
     reference = sa.Column(sa.String(), index=True)
 
+    # The Transfer of the target GGO, if it's transferred to another subject
+    transfer = relationship('Transfer', back_populates='split_target', uselist=False, cascade='all, delete-orphan')
+
+
+class Transfer(ModelBase):
+    """
+    A GGO transferred from one subject to another, ie. a SplitTarget owned
+    by another subject than the parent GGO of its SplitTransaction.
+
+    Transfers denormalize the properties of the target GGOs, so the amount
+    transferred (ie. per agreement) can be aggregated from a single table
+    rather than joining GGOs, split targets, transactions, and parent GGOs
+    (see TransactionQuery and origin.ggo.transfers).
+
+    Transfers are append-only: They are inserted by SplitTransaction when
+    it begins (or commits), and deleted along with their SplitTarget if
+    the batch is rolled back. Transfers do not reflect the state of the
+    target GGO (ie. whether it has since been retired).
+    """
+    __tablename__ = 'transfer'
+    __table_args__ = (
+        sa.UniqueConstraint('split_target_id'),
+        sa.Index(
+            'ix_transfer_sender_reference_begin', 'sender', 'reference', 'begin',
+            postgresql_include=['amount'],
+        ),
+        sa.Index(
+            'ix_transfer_recipient_begin', 'recipient', 'begin',
+            postgresql_include=['amount'],
+        ),
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True, index=True)
+
+    batch_id = sa.Column(sa.Integer(), sa.ForeignKey('ledger_batch.id'), index=True, nullable=False)
+    batch = relationship('Batch', foreign_keys=[batch_id])
+
+    split_target_id = sa.Column(sa.Integer(), sa.ForeignKey('ledger_split_target.id'), nullable=False)
+    split_target = relationship('SplitTarget', foreign_keys=[split_target_id], back_populates='transfer')
+
+    sender = sa.Column(sa.String(), sa.ForeignKey('user.subject'), nullable=False)
+    recipient = sa.Column(sa.String(), sa.ForeignKey('user.subject'), nullable=False)
+
+    # Client reference, like Agreement ID etc. (see SplitTarget)
+    reference = sa.Column(sa.String())
+
+    # Properties of the transferred GGO
+    begin = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    sector = sa.Column(sa.String(), nullable=False)
+    tech_code = sa.Column(sa.String())
+    fuel_code = sa.Column(sa.String())
+    amount = sa.Column(sa.Integer(), nullable=False)
+
+    @staticmethod
+    def build(transaction, target):
+        """
+        :param SplitTransaction transaction:
+        :param SplitTarget target:
+        :rtype: Transfer
+        """
+        return Transfer(
+            batch=transaction.batch,
+            split_target=target,
+            sender=transaction.parent_ggo.subject,
+            recipient=target.ggo.subject,
+            reference=target.reference,
+            begin=target.ggo.begin,
+            sector=target.ggo.sector,
+            tech_code=target.ggo.tech_code,
+            fuel_code=target.ggo.fuel_code,
+            amount=target.ggo.amount,
+        )
+
 
 class RetireTransaction(Transaction):
     """
@@ -433,36 +566,127 @@ class RetireTransaction(Transaction):
     # measurement_address = sa.Column(sa.String())
 
     @staticmethod
-    def build(ggo, meteringpoint, measurement_id):
+    def build(ggo, meteringpoint, measurement):
         """
-        Retires the provided GGO to the measurement at the provided address.
-        The provided meteringpoint
+        Retires the provided GGO to the provided measurement of the
+        provided meteringpoint.
 
         :param Ggo ggo:
         :param MeteringPoint meteringpoint:
-        :param int measurement_id:
+        :param Measurement measurement:
         :rtype: RetireTransaction
         """
         ggo.retire_gsrn = meteringpoint.gsrn
-        ggo.retire_measurement_id = measurement_id
+        ggo.retire_measurement_id = measurement.id
 
         return RetireTransaction(
             parent_ggo=ggo,
             begin=ggo.begin,
             meteringpoint=meteringpoint,
-            measurement_id=measurement_id,
+            measurement=measurement,
         )
 
     def on_begin(self):
-        self.parent_ggo.stored = False
-        self.parent_ggo.retired = True
+        self.retire()
 
     def on_commit(self):
-        self.parent_ggo.stored = False
-        self.parent_ggo.retired = True
+        self.retire()
 
     def on_rollback(self):
+        if self.parent_ggo.retired:
+            self.measurement.add_retired_amount(-self.parent_ggo.amount)
+
         self.parent_ggo.stored = True  # TODO test this
         self.parent_ggo.retired = False
         self.parent_ggo.retire_gsrn = None  # TODO test this
-        self.parent_ggo.measurement_id = None  # TODO test this
+        self.parent_ggo.retire_measurement_id = None
+
+    def retire(self):
+        """
+        Retires the parent GGO, and counts its amount as retired to the
+        measurement, unless already retired (ie. by on_begin()).
+        """
+        if not self.parent_ggo.retired:
+            self.measurement.add_retired_amount(self.parent_ggo.amount)
+
+        self.parent_ggo.stored = False
+        self.parent_ggo.retired = True
+
+
+class PendingConsumption(ModelBase):
+    """
+    A key (subject and begin) of stored GGOs pending consumption, when
+    consumption is deferred (see CONSUME_GGOS_DEFERRED). The same key
+    may be pending several times (enqueued by different transactions),
+    as keys are appended without waiting for workers consuming them.
+    All entries of a key are deleted once all GGOs of the owner at the
+    begin have been consumed.
+    """
+    __tablename__ = 'ggo_pending_consumption'
+    __table_args__ = (
+        sa.Index('ix_ggo_pending_consumption_subject_begin', 'subject', 'begin'),
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True, index=True)
+    created = sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now())
+    subject = sa.Column(sa.String(), sa.ForeignKey('user.subject'), nullable=False)
+    begin = sa.Column(sa.DateTime(timezone=True), nullable=False)
+
+
+class SummaryVersion(ModelBase):
+    """
+    A version number of a subject's GGOs, incremented by each database
+    transaction which issues, stores, retires, or otherwise changes any
+    of the subject's GGOs. Cached GGO summaries are only valid as long
+    as the version they were computed at (see SummaryCache).
+    """
+    __tablename__ = 'ggo_summary_version'
+
+    subject = sa.Column(sa.String(), sa.ForeignKey('user.subject'), primary_key=True)
+    version = sa.Column(sa.Integer(), nullable=False, default=1)
+
+
+class RollupDirection(Enum):
+    """
+    What GGOs a GgoRollup row counts, relative to its subject
+    """
+    # GGOs owned by the subject
+    OWNED = 'OWNED'
+    # GGOs transferred to the subject by another subject
+    INBOUND = 'INBOUND'
+    # GGOs transferred by the subject to another subject
+    OUTBOUND = 'OUTBOUND'
+
+
+class GgoRollup(ModelBase):
+    """
+    The total amount of GGOs per subject, (UTC) day of begin, direction,
+    sector, technology, state (issued, stored, and retired), and (UTC)
+    day of expiry. Rollups are maintained incrementally as GGOs are
+    issued, transferred, retired etc. (see origin.ggo.rollups), and
+    allows GgoSummary to summarize days rather than hours.
+
+    A transferred GGO is counted as OWNED and INBOUND for the recipient,
+    and as OUTBOUND for the sender. Technology codes are empty strings
+    (rather than NULL) for GGOs without them.
+    """
+    __tablename__ = 'ggo_rollup'
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'subject', 'day', 'direction', 'sector', 'tech_code',
+            'fuel_code', 'issued', 'stored', 'retired', 'expire_day',
+        ),
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True, index=True)
+    subject = sa.Column(sa.String(), sa.ForeignKey('user.subject'), nullable=False)
+    day = sa.Column(sa.Date(), nullable=False)
+    direction = sa.Column(sa.Enum(RollupDirection), nullable=False)
+    sector = sa.Column(sa.String(), nullable=False)
+    tech_code = sa.Column(sa.String(), nullable=False)
+    fuel_code = sa.Column(sa.String(), nullable=False)
+    issued = sa.Column(sa.Boolean(), nullable=False)
+    stored = sa.Column(sa.Boolean(), nullable=False)
+    retired = sa.Column(sa.Boolean(), nullable=False)
+    expire_day = sa.Column(sa.Date(), nullable=False)
+    amount = sa.Column(sa.BigInteger(), nullable=False)
@@ -0,0 +1,251 @@
+"""
+Query plan regression checks for the composite and partial GGO indexes
+(see Ggo.__table_args__). Postgres only uses a partial index if it can
+prove the index's predicate from the query, so a seemingly harmless
+change to how GgoQuery filters can silently stop using an index.
+
+The checks seed a database of realistic size, run EXPLAIN on the queries
+GgoQuery builds, and compare the index used to scan the GGO table to the
+index expected. Everything is done in a single transaction which is
+rolled back afterwards, so nothing is written to the database.
+"""
+import sqlalchemy as sa
+from uuid import uuid4
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+
+from origin.db import Explain
+from origin.auth import User
+from origin.common import DateTimeRange
+from origin.measurements import Measurement
+from origin.meteringpoints import MeteringPoint, MeteringPointType
+
+from .models import Ggo
+from .queries import GgoQuery, GgoAggregateQuery
+from .schemas import GgoCategory
+
+
+# GGOs expire this long after they begin, when seeded
+SEED_EXPIRE_TIME = timedelta(days=90)
+
+
+@dataclass
+class PlanCheck:
+    """
+    The index expected, and the index used, to scan the GGO table
+    when executing a query.
+    """
+    name: str
+    expected: str
+    used: str
+
+    @property
+    def passed(self):
+        """
+        :rtype: bool
+        """
+        return self.used == self.expected
+
+
+def check_query_plans(session, owners, hours):
+    """
+    Seeds GGOs for "owners" users, one per hour for the past "hours"
+    hours, and checks the index used by each of the queries GgoQuery
+    builds for the indexed access patterns.
+
+    Rolling back the session afterwards discards the seeded data.
+
+    :param sqlalchemy.orm.Session session:
+    :param int owners: Number of users to seed GGOs for
+    :param int hours: Number of hours to seed GGOs for
+    :rtype: list[PlanCheck]
+    """
+    users, consumption = seed_ggos(session, owners, hours)
+
+    user = users[0]
+    gsrn = consumption[0].gsrn
+    now = datetime.now(tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+    begin = now - timedelta(days=7)
+    week = DateTimeRange(begin=begin, end=now)
+
+    measurement = session.query(Measurement) \
+        .filter(Measurement.gsrn == gsrn) \
+        .filter(Measurement.begin == begin) \
+        .one()
+
+    checks = (
+        ('is_tradable()',
+         GgoQuery(session)
+            .belongs_to(user)
+            .begins_at(begin)
+            .is_tradable(),
+         'ix_ggo_stored_subject_begin'),
+
+        ('is_retired_to_measurement()',
+         GgoAggregateQuery(session)
+            .is_retired_to_measurement(measurement),
+         'ix_ggo_retired_measurement'),
+
+        ('begins_within()',
+         GgoQuery(session)
+            .belongs_to(user)
+            .begins_within(week),
+         'ix_ggo_subject_begin'),
+
+        ('in_category(STORED)',
+         GgoQuery(session)
+            .belongs_to(user)
+            .begins_within(week)
+            .in_category(GgoCategory.STORED),
+         'ix_ggo_stored_subject_begin'),
+
+        ('in_category(EXPIRED)',
+         GgoQuery(session)
+            .belongs_to(user)
+            .begins_within(week)
+            .in_category(GgoCategory.EXPIRED),
+         'ix_ggo_stored_subject_begin'),
+
+        ('in_category(RETIRED) to GSRN',
+         GgoQuery(session)
+            .is_retired_to_gsrn(gsrn)
+            .begins_within(week)
+            .in_category(GgoCategory.RETIRED),
+         'ix_ggo_retired_gsrn_begin'),
+    )
+
+    return [
+        PlanCheck(
+            name=name,
+            expected=expected,
+            used=get_index_used(session, query, Ggo.__tablename__),
+        )
+        for name, query, expected in checks
+    ]
+
+
+def seed_ggos(session, owners, hours):
+    """
+    Seeds a consumption and a production MeteringPoint for each of
+    "owners" new users, with a consumption measurement and an issued GGO
+    for each of the past "hours" hours. Six in ten GGOs are retired to
+    the consumption, three in ten have been transferred, and the rest
+    are stored. GGOs expire SEED_EXPIRE_TIME after they begin.
+
+    Measurements and GGOs are inserted using a statement each, and the
+    tables are analyzed afterwards, so the planner knows their sizes.
+
+    :param sqlalchemy.orm.Session session:
+    :param int owners:
+    :param int hours:
+    :rtype: (list[User], list[MeteringPoint])
+    :returns: The users seeded, and their consumption MeteringPoints
+    """
+    tag = str(uuid4())
+    users = []
+    consumption = []
+
+    for i in range(owners):
+        user = User(
+            subject=f'{tag}-{i}',
+            email=f'{tag}-{i}@plans.local',
+            password='',
+            name=f'Plan check {i}',
+            company='Plan check',
+        )
+
+        consumption.append(MeteringPoint(
+            user=user,
+            gsrn=f'{tag}-c-{i}',
+            type=MeteringPointType.CONSUMPTION,
+            sector='DK1',
+            retiring_priority=0,
+        ))
+
+        session.add(MeteringPoint(
+            user=user,
+            gsrn=f'{tag}-p-{i}',
+            type=MeteringPointType.PRODUCTION,
+            sector='DK1',
+            tech_code='T010101',
+            fuel_code='F01010101',
+        ))
+
+        users.append(user)
+
+    session.add_all(consumption)
+    session.flush()
+
+    now = datetime.now(tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    session.execute(sa.text(
+        'INSERT INTO measurement (gsrn, begin, "end", amount, retired_amount) '
+        'SELECT mp.gsrn, '
+        '       :first + h * interval \'1 hour\', '
+        '       :first + (h + 1) * interval \'1 hour\', '
+        '       1000, 0 '
+        'FROM meteringpoint mp, generate_series(0, :hours - 1) AS h '
+        'WHERE mp.gsrn LIKE :consumption'
+    ), {
+        'first': now - timedelta(hours=hours - 1),
+        'hours': hours,
+        'consumption': f'{tag}-c-%',
+    })
+
+    session.execute(sa.text(
+        'INSERT INTO ggo (public_id, issue_time, expire_time, begin, "end", '
+        '                 amount, sector, subject, tech_code, fuel_code, '
+        '                 issue_gsrn, issued, stored, retired, '
+        '                 retire_gsrn, retire_measurement_id) '
+        'SELECT md5(m.id::text || :tag), m.begin, m.begin + :expire, '
+        '       m.begin, m."end", m.amount, \'DK1\', mp.subject, '
+        '       \'T010101\', \'F01010101\', '
+        '       replace(m.gsrn, :consumption, :production), TRUE, '
+        '       m.id % 10 = 9, m.id % 10 < 6, '
+        '       CASE WHEN m.id % 10 < 6 THEN m.gsrn END, '
+        '       CASE WHEN m.id % 10 < 6 THEN m.id END '
+        'FROM measurement m '
+        'JOIN meteringpoint mp ON mp.gsrn = m.gsrn '
+        'WHERE m.gsrn LIKE :consumption || \'%\''
+    ), {
+        'tag': tag,
+        'expire': SEED_EXPIRE_TIME,
+        'consumption': f'{tag}-c-',
+        'production': f'{tag}-p-',
+    })
+
+    session.execute(sa.text('ANALYZE measurement'))
+    session.execute(sa.text('ANALYZE ggo'))
+
+    return users, consumption
+
+
+def get_index_used(session, query, table):
+    """
+    Returns the name of the index which the query plan of the provided
+    query scans the table with, or None if the table is scanned
+    sequentially (or not at all). Indexes combined using a bitmap are
+    returned separated by " + ".
+
+    :param sqlalchemy.orm.Session session:
+    :param GgoQuery query:
+    :param str table:
+    :rtype: str | None
+    """
+    plan = session.execute(Explain(query.statement)).scalar()
+    indexes = []
+
+    def walk(node, bitmap=False):
+        if node.get('Relation Name') == table:
+            if 'Index Name' in node:
+                indexes.append(node['Index Name'])
+            bitmap = node['Node Type'] == 'Bitmap Heap Scan'
+        elif bitmap and 'Index Name' in node:
+            indexes.append(node['Index Name'])
+
+        for child in node.get('Plans', []):
+            walk(child, bitmap)
+
+    walk(plan[0]['Plan'])
+
+    return ' + '.join(indexes) or None
@@ -1,7 +1,4 @@
 import sqlalchemy as sa
-from functools import lru_cache
-from itertools import groupby
-from dateutil.relativedelta import relativedelta
 from sqlalchemy import func, text, bindparam
 from sqlalchemy.orm import joinedload, aliased
 from datetime import datetime, timezone
@@ -10,10 +7,14 @@ from origin.db import SqlQuery
 from origin.measurements.models import Measurement
 from origin.meteringpoints import MeteringPoint
 from origin.config import UNKNOWN_TECHNOLOGY_LABEL
+from origin.common.summary import ColumnarSummary
 from origin.technologies import Technology
 
-from .models import Ggo, SplitTarget, SplitTransaction
-from .schemas import SummaryResolution, SummaryGroup, GgoCategory
+from .cache import summary_cache
+from .models import Ggo, SplitTarget, SplitTransaction, Transfer
+from .rollups import get_rollup_source, get_distribution_source
+from .transfers import get_transfer_query, get_transfer_columns, get_transfer_source
+from .schemas import SummaryResolution, GgoCategory
 
 
 class GgoQuery(SqlQuery):
@@ -65,11 +66,11 @@ class GgoQuery(SqlQuery):
         # if filters.address:
         #     q = q.filter(Ggo.address.in_(filters.address))
         if filters.sector:
-            q = q.filter(MeteringPoint.sector.in_(filters.sector))
+            q = q.filter(Ggo.sector.in_(filters.sector))
         if filters.tech_code:
-            q = q.filter(MeteringPoint.tech_code.in_(filters.tech_code))
+            q = q.filter(Ggo.tech_code.in_(filters.tech_code))
         if filters.fuel_code:
-            q = q.filter(MeteringPoint.fuel_code.in_(filters.fuel_code))
+            q = q.filter(Ggo.fuel_code.in_(filters.fuel_code))
         if filters.issue_gsrn:
             q = q.filter(Ggo.issue_gsrn.in_(filters.issue_gsrn))
         if filters.retire_gsrn:
@@ -128,6 +129,17 @@ class GgoQuery(SqlQuery):
             Ggo.public_id == public_id,
         ))
 
+    def has_any_public_id(self, public_ids):
+        """
+        Only include GGOs with any of the provided public_ids.
+
+        :param list[str] public_ids:
+        :rtype: GgoQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            Ggo.public_id.in_(public_ids),
+        ))
+
     def belongs_to(self, user):
         """
         Only include GGOs which belong to the user identified by
@@ -140,6 +152,18 @@ class GgoQuery(SqlQuery):
             Ggo.subject == user.subject,
         ))
 
+    def belongs_to_any(self, subjects):
+        """
+        Only include GGOs which belong to any of the users identified by
+        the provided subjects.
+
+        :param list[str] subjects:
+        :rtype: GgoQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            Ggo.subject.in_(subjects),
+        ))
+
     def begins_at(self, begin):
         """
         Only include GGOs which begins at the provided datetime.
@@ -151,6 +175,32 @@ class GgoQuery(SqlQuery):
             Ggo.begin == begin.astimezone(timezone.utc),
         ))
 
+    def begins_at_any(self, begins):
+        """
+        Only include GGOs which begins at any of the provided datetimes.
+
+        :param list[datetime] begins:
+        :rtype: GgoQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            Ggo.begin.in_([b.astimezone(timezone.utc) for b in begins]),
+        ))
+
+    def has_any_owner_sector_begin(self, keys):
+        """
+        Only include GGOs which match any of the provided
+        (subject, sector, begin) combinations.
+
+        :param list[(str, str, datetime)] keys:
+        :rtype: GgoQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            sa.tuple_(Ggo.subject, Ggo.sector, Ggo.begin).in_([
+                (subject, sector, begin.astimezone(timezone.utc))
+                for subject, sector, begin in keys
+            ]),
+        ))
+
     def begins_within(self, begin_range):
         """
         Only include GGOs which begins within the provided datetime
@@ -230,6 +280,20 @@ class GgoQuery(SqlQuery):
             Ggo.retire_measurement_id == measurement.id,
         ))
 
+    def is_retired_to_any_measurement(self, measurement_ids):
+        """
+        Only include GGOs which have been retired to any of the
+        measurements identified by the provided IDs.
+
+        :param list[int] measurement_ids:
+        :rtype: GgoQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            Ggo.retired.is_(True),
+            Ggo.retire_gsrn.isnot(None),
+            Ggo.retire_measurement_id.in_(measurement_ids),
+        ))
+
     def is_retired_to_gsrn(self, gsrn):
         """
         Only include GGOs which have been retired to a GSRN number.
@@ -304,6 +368,22 @@ class GgoQuery(SqlQuery):
             .is_expired(False) \
             .is_retired(False)
 
+    def for_update(self, nowait=False, skip_locked=False):
+        """
+        Locks the rows of the GGOs (but not of joined tables) until the
+        transaction ends, so they can not be transferred, retired, or
+        consumed concurrently.
+
+        :param bool nowait: Fail rather than wait for rows locked by others
+        :param bool skip_locked: Exclude rows locked by others
+        :rtype: GgoQuery
+        """
+        return self.__class__(self.session, self.query.with_for_update(
+            of=Ggo,
+            nowait=nowait,
+            skip_locked=skip_locked,
+        ))
+
     def is_retirable(self):
         """
         Only include GGOs which are currently retireable.
@@ -328,10 +408,36 @@ class GgoQuery(SqlQuery):
 
         :rtype: int
         """
-        total_amount = self.session.query(
-            func.sum(self.query.subquery().c.amount)).scalar()
+        total_amount = self.query \
+            .enable_eagerloads(False) \
+            .with_entities(func.sum(Ggo.amount)) \
+            .scalar()
+
         return total_amount if total_amount is not None else 0
 
+    def get_total_amount_by(self, *columns):
+        """
+        Returns the total amount of the result set grouped by the provided
+        columns, as a dict of {(value1, value2, ...): amount}.
+
+        Usage example::
+
+            amounts = GgoQuery(session) \
+                .is_stored() \
+                .get_total_amount_by(Ggo.subject, Ggo.begin)
+
+            amount = amounts.get((user.subject, begin), 0)
+
+        :param sa.Column columns:
+        :rtype: dict[tuple, int]
+        """
+        q = self.query \
+            .enable_eagerloads(False) \
+            .with_entities(*columns, func.sum(Ggo.amount)) \
+            .group_by(*columns)
+
+        return {tuple(row[:-1]): row[-1] for row in q}
+
     def get_distinct_begins(self):
         """
         Returns a list of all distinct begins in the result set.
@@ -341,17 +447,99 @@ class GgoQuery(SqlQuery):
         return [row[0] for row in self.session.query(
             self.query.subquery().c.begin.distinct())]
 
-    def get_summary(self, resolution, grouping, utc_offset=0):
+    def get_summary(self, resolution, grouping, utc_offset=0, subject=None):
         """
         Returns a summary of the result set.
 
+        Provide the subject whose GGOs the result set is limited to
+        (ie. using belongs_to() or received_by_user() etc.) to cache
+        the summary's results (see SummaryCache).
+
         :param SummaryResolution resolution:
         :param list[str] grouping:
         :param int utc_offset:
+        :param str subject:
         :rtype: GgoSummary
         """
         return GgoSummary(
-            self.session, self, resolution, grouping, utc_offset)
+            self.session, self, resolution, grouping, utc_offset, subject)
+
+    def get_export_query(self):
+        """
+        Returns the result set as rows of columns (see get_export_columns())
+        ordered by begin, for exporting (see export_response()).
+
+        :rtype: sa.orm.Query
+        """
+        return self.query \
+            .enable_eagerloads(False) \
+            .with_entities(*self.get_export_columns()) \
+            .outerjoin(Technology, sa.and_(
+                Technology.tech_code == Ggo.tech_code,
+                Technology.fuel_code == Ggo.fuel_code,
+            )) \
+            .order_by(Ggo.begin.asc(), Ggo.id.asc())
+
+    def get_export_columns(self):
+        """
+        :rtype: list[sa.sql.ColumnElement]
+        """
+        return [
+            Ggo.public_id.label('id'),
+            Ggo.sector.label('sector'),
+            Ggo.begin.label('begin'),
+            Ggo.end.label('end'),
+            Ggo.amount.label('amount'),
+            Technology.technology.label('technology'),
+            Ggo.tech_code.label('technologyCode'),
+            Ggo.fuel_code.label('fuelCode'),
+            Ggo.issue_gsrn.label('issueGsrn'),
+            Ggo.retire_gsrn.label('retireGsrn'),
+            Ggo.issued.label('issued'),
+            Ggo.stored.label('stored'),
+            Ggo.retired.label('retired'),
+            Ggo.expire_time.label('expireTime'),
+            Ggo.emissions.label('emissions'),
+        ]
+
+
+class GgoAggregateQuery(GgoQuery):
+    """
+    The same as GgoQuery, except it neither joins Measurement and
+    MeteringPoint nor eagerly loads any relationships, unless a filter
+    requires it. Use it for aggregating, like get_total_amount(), which
+    then compiles to::
+
+        SELECT sum(ggo.amount) FROM ggo WHERE ...
+
+    Usage example::
+
+        amount = GgoAggregateQuery(session) \
+            .belongs_to(user) \
+            .begins_at(begin) \
+            .is_stored() \
+            .get_total_amount()
+    """
+
+    def _get_base_query(self):
+        return self.session.query(Ggo) \
+            .enable_eagerloads(False)
+
+    def has_gsrn(self, gsrn):
+        """
+        Only include GGOs which were issued to the MeteringPoint
+        identified with the provided GSRN number.
+
+        :param str gsrn:
+        :rtype: GgoAggregateQuery
+        """
+        measurement_ids = self.session \
+            .query(Measurement.id) \
+            .filter(Measurement.gsrn == gsrn)
+
+        return self.__class__(self.session, self.query.filter(
+            Ggo.measurement_id.in_(measurement_ids),
+        ))
 
 
 class TransactionQuery(GgoQuery):
@@ -400,6 +588,18 @@ class TransactionQuery(GgoQuery):
             self.parent_ggo.subject == user.subject,
         ))
 
+    def sent_by_any_user(self, subjects):
+        """
+        Only include transfers sent by any of the users identified by
+        the provided subjects.
+
+        :param list[str] subjects:
+        :rtype: TransactionQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            self.parent_ggo.subject.in_(subjects),
+        ))
+
     def received_by_user(self, user):
         """
         TODO
@@ -441,15 +641,65 @@ class TransactionQuery(GgoQuery):
             SplitTarget.reference.in_(references),
         ))
 
+    def get_total_amount(self):
+        """
+        Returns the total amount of the result set, read from Transfers
+        where possible (see get_transfer_query()).
 
-class GgoSummary(object):
+        :rtype: int
+        """
+        transfers = get_transfer_query(self, self.parent_ggo)
+
+        if transfers is None:
+            return super(TransactionQuery, self).get_total_amount()
+
+        total_amount = transfers \
+            .with_entities(func.sum(Transfer.amount)) \
+            .scalar()
+
+        return total_amount if total_amount is not None else 0
+
+    def get_total_amount_by(self, *columns):
+        """
+        Returns the total amount of the result set grouped by the provided
+        columns, read from Transfers where possible (see GgoQuery and
+        get_transfer_query()).
+
+        :param sa.Column columns:
+        :rtype: dict[tuple, int]
+        """
+        transfers = get_transfer_query(self, self.parent_ggo)
+        transfer_columns = get_transfer_columns(self.parent_ggo, columns)
+
+        if transfers is None or transfer_columns is None:
+            return super(TransactionQuery, self).get_total_amount_by(*columns)
+
+        q = transfers \
+            .with_entities(*transfer_columns, func.sum(Transfer.amount)) \
+            .group_by(*transfer_columns)
+
+        return {tuple(row[:-1]): row[-1] for row in q}
+
+    def get_export_columns(self):
+        """
+        :rtype: list[sa.sql.ColumnElement]
+        """
+        return super(TransactionQuery, self).get_export_columns() + [
+            SplitTarget.reference.label('reference'),
+            self.parent_ggo.subject.label('sender'),
+            Ggo.subject.label('recipient'),
+        ]
+
+
+class GgoSummary(ColumnarSummary):
     """
     Implements a summary/aggregation of GGOs.
 
     Provided a GgoQuery, this class compiles together a list of
     SummaryGroups, where each group is defined by the "grouping" parameter.
     The aggregated data is based on the result set of the query provided.
-    It essentially works by wrapping a SQL "GROUP BY" statement.
+    It essentially works by wrapping a SQL "GROUP BY" statement, which is
+    pivoted into one row per group in SQL (see ColumnarSummary).
 
     The parameter "resolution" defined the returned data resolution.
     Call .fill() before accessing .labels or .groups to fill gaps in data.
@@ -463,99 +713,102 @@ class GgoSummary(object):
         'fuelCode',
     )
 
-    RESOLUTIONS_POSTGRES = {
-        SummaryResolution.hour: 'YYYY-MM-DD HH24:00',
-        SummaryResolution.day: 'YYYY-MM-DD',
-        SummaryResolution.month: 'YYYY-MM',
-        SummaryResolution.year: 'YYYY',
-    }
-
-    RESOLUTIONS_PYTHON = {
-        SummaryResolution.hour: '%Y-%m-%d %H:00',
-        SummaryResolution.day: '%Y-%m-%d',
-        SummaryResolution.month: '%Y-%m',
-        SummaryResolution.year: '%Y',
-    }
-
-    LABEL_STEP = {
-        SummaryResolution.hour: relativedelta(hours=1),
-        SummaryResolution.day: relativedelta(days=1),
-        SummaryResolution.month: relativedelta(months=1),
-        SummaryResolution.year: relativedelta(years=1),
-        SummaryResolution.all: None,
-    }
-
-    ALL_TIME_LABEL = 'All-time'
-
-    def __init__(self, session, query, resolution, grouping, utc_offset=0):
+    def __init__(self, session, query, resolution, grouping, utc_offset=0,
+                 subject=None):
         """
         :param sa.orm.Session session:
         :param GgoQuery query:
         :param SummaryResolution resolution:
         :param list[str] grouping:
         :param int utc_offset:
+        :param str subject: The subject to cache results for, if any
         """
         self.session = session
         self.query = query
         self.resolution = resolution
         self.grouping = grouping
         self.utc_offset = utc_offset
+        self.subject = subject
         self.fill_range = None
+        self._raw_results = None
 
     def fill(self, fill_range):
         """
         :param DateTimeRange fill_range:
         """
         self.fill_range = fill_range
+        self._pivoted_results = None
 
     @property
-    def labels(self):
+    def raw_results(self):
         """
-        :rtype list[str]:
+        :rtype: list[tuple]
         """
-        if self.resolution == SummaryResolution.all:
-            return [self.ALL_TIME_LABEL]
-        if self.fill_range is None:
-            return sorted(set(label for label, *g, amount in self.raw_results))
-        else:
-            format = self.RESOLUTIONS_PYTHON[self.resolution]
-            step = self.LABEL_STEP[self.resolution]
-            begin = self.fill_range.begin
-            labels = []
+        if self._raw_results is None:
+            self._raw_results = self.get_results(self.get_query())
+        return self._raw_results
 
-            while begin <= self.fill_range.end:
-                labels.append(begin.strftime(format))
-                begin += step
+    def can_use_rollups(self):
+        """
+        Rollups are per (UTC) day, so they can only be used when labels
+        span whole days.
 
-            return labels
+        :rtype: bool
+        """
+        if self.resolution == SummaryResolution.hour or 'begin' in self.grouping:
+            return False
+        elif self.resolution == SummaryResolution.all:
+            return True
+        else:
+            return (self.utc_offset or 0) % 24 == 0
 
-    @property
-    def groups(self):
+    def get_source(self):
         """
-        :rtype list[SummaryGroup]:
+        Returns the GGOs to summarize as a subquery, read from rollups
+        where possible (see get_rollup_source()), and otherwise from
+        Transfers when summarizing transfers (see get_transfer_source()).
         """
-        groups = []
+        if self.can_use_rollups():
+            if isinstance(self.query, TransactionQuery):
+                source = get_rollup_source(self.query, TransactionQuery.parent_ggo)
+            else:
+                source = get_rollup_source(self.query)
 
-        for group, results in groupby(self.raw_results, lambda x: x[1:-1]):
-            items = {label: amount for label, *g, amount in results}
-            groups.append(SummaryGroup(
-                group=group,
-                values=[items.get(label, None) for label in self.labels],
-            ))
+            if source is not None:
+                return source
 
-        return groups
+        if isinstance(self.query, TransactionQuery):
+            source = get_transfer_source(self.query, TransactionQuery.parent_ggo)
 
-    @property
-    @lru_cache()
-    def raw_results(self):
+            if source is not None:
+                return source
+
+        return self.query.subquery()
+
+    def get_results(self, query):
         """
-        TODO
+        Executes a query, or looks up its results in the cache if a
+        subject is provided.
+
+        :param sqlalchemy.orm.Query query:
+        :rtype: list[tuple]
+        """
+        if self.subject is not None:
+            return summary_cache.get(self.session, self.subject, query)
+        else:
+            return query.all()
+
+    def get_query(self):
+        """
+        Returns the summary query with the columns (label, *group, amount).
+
+        :rtype: sqlalchemy.orm.Query
         """
         select = []
         groups = []
         orders = []
 
-        s = self.query.subquery()
+        s = self.get_source()
 
         q = self.session.query(
                 s,
@@ -613,5 +866,99 @@ class GgoSummary(object):
         return self.session \
             .query(*select) \
             .group_by(*groups) \
-            .order_by(*orders) \
-            .all()
+            .order_by(*orders)
+
+
+class GgoDistributions(object):
+    """
+    Implements the distribution (by technology) of a user's issued,
+    stored, retired, and expired GGOs, and the GGOs transferred to and
+    from the user, which begin within a period of time.
+
+    All distributions are computed by a single statement which reads
+    the GGOs once (see get_distribution_source()), and aggregates each
+    distribution using "FILTER (WHERE ...)".
+    """
+
+    DISTRIBUTIONS = (
+        'issued',
+        'stored',
+        'retired',
+        'expired',
+        'inbound',
+        'outbound',
+    )
+
+    def __init__(self, session, user, begin_range):
+        """
+        :param sa.orm.Session session:
+        :param origin.auth.User user:
+        :param DateTimeRange begin_range:
+        """
+        self.session = session
+        self.user = user
+        self.begin_range = begin_range
+        self._raw_results = None
+
+    def get(self, distribution):
+        """
+        Returns the amount per technology of a distribution, ordered by
+        technology, only including technologies with any GGOs.
+
+        :param str distribution: One of DISTRIBUTIONS
+        :rtype: list[(str, int)]
+        """
+        i = self.DISTRIBUTIONS.index(distribution) + 1
+
+        return [(row[0], row[i])
+                for row in self.raw_results
+                if row[i] is not None]
+
+    @property
+    def raw_results(self):
+        """
+        :rtype: list[tuple]
+        """
+        if self._raw_results is None:
+            self._raw_results = self.get_raw_results()
+        return self._raw_results
+
+    def get_raw_results(self):
+        """
+        Executes the distribution query, or looks up its results in the
+        cache.
+
+        :rtype: list[tuple]
+        """
+        s = get_distribution_source(
+            subject=self.user.subject,
+            begin_from=self.begin_range.begin.astimezone(timezone.utc),
+            begin_to=self.begin_range.end.astimezone(timezone.utc),
+        )
+
+        technology = func.coalesce(
+            Technology.technology, UNKNOWN_TECHNOLOGY_LABEL)
+
+        filters = {
+            'issued': sa.and_(s.c.owned, s.c.issued),
+            'stored': sa.and_(s.c.owned, s.c.stored, sa.not_(s.c.expired)),
+            'retired': sa.and_(s.c.owned, s.c.retired),
+            'expired': sa.and_(s.c.owned, s.c.stored, s.c.expired),
+            'inbound': s.c.inbound,
+            'outbound': s.c.outbound,
+        }
+
+        q = self.session \
+            .query(technology, *(
+                func.sum(s.c.amount).filter(filters[d]).cast(sa.BigInteger())
+                for d in self.DISTRIBUTIONS
+            )) \
+            .select_from(s) \
+            .outerjoin(Technology, sa.and_(
+                Technology.tech_code == s.c.tech_code,
+                Technology.fuel_code == s.c.fuel_code,
+            )) \
+            .group_by(technology) \
+            .order_by(technology)
+
+        return summary_cache.get(self.session, self.user.subject, q)
@@ -0,0 +1,690 @@
+import sqlalchemy as sa
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import True_, False_
+from sqlalchemy.dialects.postgresql import insert
+
+from .models import Ggo, GgoRollup, RollupDirection
+
+
+# Columns which identify a rollup, in the order of its unique constraint
+KEY_COLUMNS = (
+    'subject',
+    'day',
+    'direction',
+    'sector',
+    'tech_code',
+    'fuel_code',
+    'issued',
+    'stored',
+    'retired',
+    'expire_day',
+)
+
+# Attributes of a GGO which determine the rollups it's counted in
+ROLLUP_ATTRIBUTES = (
+    'subject',
+    'parent_id',
+    'begin',
+    'sector',
+    'tech_code',
+    'fuel_code',
+    'issued',
+    'stored',
+    'retired',
+    'expire_time',
+    'amount',
+)
+
+# Columns of GgoRollup (and Ggo) which GgoQuery may filter on using
+# equality (or IN), and still be able to read from rollups
+FILTER_COLUMNS = ('sector', 'tech_code', 'fuel_code')
+
+# State flags of GgoRollup (and Ggo)
+FLAG_COLUMNS = ('issued', 'stored', 'retired')
+
+
+def get_day(dt):
+    """
+    :param datetime dt:
+    :rtype: date
+    """
+    return dt.astimezone(timezone.utc).date()
+
+
+def get_midnight(day):
+    """
+    :param date day:
+    :rtype: datetime
+    """
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def sql_day(column):
+    """
+    Returns the (UTC) day of a timestamp column as an SQL expression.
+    """
+    return sa.cast(func.timezone('UTC', column), sa.Date)
+
+
+# -- Maintaining rollups -----------------------------------------------------
+
+
+def get_rollup_keys(values, sender):
+    """
+    Returns the keys (see KEY_COLUMNS) of the rollups a GGO is counted in.
+
+    :param dict values: The GGO's ROLLUP_ATTRIBUTES
+    :param str sender: The subject the GGO was transferred from (if any)
+    :rtype: list[tuple]
+    """
+    day = get_day(values['begin'])
+    rest = (
+        values['sector'],
+        values['tech_code'] or '',
+        values['fuel_code'] or '',
+        values['issued'],
+        values['stored'],
+        values['retired'],
+        get_day(values['expire_time']),
+    )
+
+    keys = [(values['subject'], day, RollupDirection.OWNED.name) + rest]
+
+    if sender is not None and sender != values['subject']:
+        keys.append((values['subject'], day, RollupDirection.INBOUND.name) + rest)
+        keys.append((sender, day, RollupDirection.OUTBOUND.name) + rest)
+
+    return keys
+
+
+def get_rollup_values(ggo, committed):
+    """
+    Returns the ROLLUP_ATTRIBUTES of a GGO, either as committed to the
+    database (before flushing), or as currently set on the object.
+
+    :param Ggo ggo:
+    :param bool committed:
+    :rtype: dict
+    """
+    state = sa.inspect(ggo)
+    values = {}
+
+    for attr in ROLLUP_ATTRIBUTES:
+        history = state.attrs[attr].load_history()
+
+        if committed:
+            value = history.deleted or history.unchanged
+        else:
+            value = history.added or history.unchanged
+
+        values[attr] = value[0] if value else None
+
+    return values
+
+
+def get_subjects(session, ggo_ids):
+    """
+    Returns the subjects of the provided GGOs, looking up those
+    not present in the session with a single query.
+
+    :param sqlalchemy.orm.Session session:
+    :param collections.abc.Iterable[int] ggo_ids:
+    :rtype: dict[int, str]
+    """
+    subjects = {}
+    missing = []
+
+    for ggo_id in ggo_ids:
+        ggo = session.identity_map.get(sa.orm.util.identity_key(Ggo, ggo_id))
+        if ggo is not None:
+            subjects[ggo_id] = ggo.subject
+        else:
+            missing.append(ggo_id)
+
+    if missing:
+        subjects.update(session
+                        .query(Ggo.id, Ggo.subject)
+                        .filter(Ggo.id.in_(missing)))
+
+    return subjects
+
+
+def apply_rollup_deltas(session, deltas):
+    """
+    Adds the provided amounts to the rollups, creating them as necessary.
+
+    :param sqlalchemy.orm.Session session:
+    :param dict[tuple, int] deltas: {key: amount}
+    """
+    # Sorted, so concurrent transactions lock rollups in the same order
+    rows = [dict(zip(KEY_COLUMNS, key), amount=amount)
+            for key, amount in sorted(deltas.items())
+            if amount != 0]
+
+    if not rows:
+        return
+
+    statement = insert(GgoRollup.__table__).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=KEY_COLUMNS,
+        set_={'amount': GgoRollup.__table__.c.amount + statement.excluded.amount},
+    )
+
+    session.execute(statement)
+
+
+def rebuild_rollups(session):
+    """
+    Rebuilds all rollups from the GGOs in the database. Changes to rollups
+    (by other transactions) are blocked until the session's transaction
+    ends, while reading them is not.
+
+    :param sqlalchemy.orm.Session session:
+    :rtype: int
+    :returns: The number of rollups
+    """
+    table = GgoRollup.__table__
+    parent = aliased(Ggo, name='parent')
+
+    session.execute(sa.text('LOCK TABLE ggo_rollup IN EXCLUSIVE MODE'))
+    session.execute(table.delete())
+
+    for direction, subject, transferred in ((RollupDirection.OWNED, Ggo.subject, False),
+                                            (RollupDirection.INBOUND, Ggo.subject, True),
+                                            (RollupDirection.OUTBOUND, parent.subject, True)):
+        columns = (
+            subject,
+            sql_day(Ggo.begin),
+            Ggo.sector,
+            func.coalesce(Ggo.tech_code, ''),
+            func.coalesce(Ggo.fuel_code, ''),
+            Ggo.issued,
+            Ggo.stored,
+            Ggo.retired,
+            sql_day(Ggo.expire_time),
+        )
+
+        select = sa.select(
+            *columns[:2],
+            sa.cast(sa.literal(direction.name), table.c.direction.type),
+            *columns[2:],
+            func.sum(Ggo.amount),
+        ).group_by(*columns)
+
+        if transferred:
+            select = select \
+                .join(parent, parent.id == Ggo.parent_id) \
+                .where(parent.subject != Ggo.subject)
+
+        session.execute(table.insert().from_select(
+            KEY_COLUMNS + ('amount',), select))
+
+    return session.query(GgoRollup).count()
+
+
+# -- Reading rollups ---------------------------------------------------------
+
+
+class RollupFilter(object):
+    """
+    The filters of a GgoQuery (or TransactionQuery), if all of them can be
+    applied to GgoRollups. Recognizes the filters applied by belongs_to(),
+    begins_within(), in_category(), received_by_user(), sent_by_user()
+    etc., and filtering on sector and technology.
+    """
+
+    def __init__(self, parent=None):
+        """
+        :param parent: The aliased parent Ggo of a TransactionQuery
+        """
+        self.parent = parent
+        self.transferred = False
+        self.subjects = None
+        self.senders = None
+        self.sender_or_recipient = None
+        self.begin_from = None
+        self.begin_to = None
+        self.expired = None
+        self.flags = {}
+        self.columns = {}
+
+    @classmethod
+    def from_query(cls, query, parent=None):
+        """
+        :param origin.ggo.GgoQuery query:
+        :param parent: The aliased parent Ggo of a TransactionQuery
+        :rtype: RollupFilter | None
+        """
+        f = cls(parent)
+
+        for clause in cls.flatten(query.query.whereclause):
+            if not f.add(clause):
+                return None
+
+        if f.get_directions():
+            return f
+        return None
+
+    @classmethod
+    def flatten(cls, clause):
+        """
+        Yields the clauses of an AND expression.
+        """
+        if clause is None:
+            return
+        elif isinstance(clause, sa.sql.elements.BooleanClauseList) \
+                and clause.operator is operators.and_:
+            for c in clause.clauses:
+                yield from cls.flatten(c)
+        else:
+            yield clause
+
+    def is_column(self, expr, name, parent=False):
+        table = sa.inspect(self.parent).selectable \
+            if parent else Ggo.__table__
+
+        return isinstance(expr, sa.Column) \
+            and expr.table is table \
+            and expr.key == name
+
+    def get_value(self, expr, operator):
+        """
+        Returns the value(s) of an "=" or "IN" bound parameter as a list.
+        """
+        if not isinstance(expr, sa.sql.elements.BindParameter):
+            return None
+        elif operator is operators.eq:
+            return [expr.effective_value]
+        elif operator is operators.in_op:
+            return list(expr.effective_value)
+        return None
+
+    def add(self, clause):
+        """
+        :rtype: bool
+        :returns: Whether the clause can be applied to rollups
+        """
+        if isinstance(clause, sa.sql.elements.Grouping):
+            return self.add_sender_or_recipient(clause.element)
+        elif not isinstance(clause, sa.sql.elements.BinaryExpression):
+            return False
+
+        left, op, right = clause.left, clause.operator, clause.right
+
+        if self.parent is not None and self.is_column(left, 'subject', parent=True):
+            self.senders = self.get_value(right, op)
+            return self.senders is not None
+
+        elif self.is_column(left, 'subject'):
+            if self.parent is not None and op is operators.ne \
+                    and self.is_column(right, 'subject', parent=True):
+                self.transferred = True
+                return True
+
+            self.subjects = self.get_value(right, op)
+            return self.subjects is not None
+
+        elif self.is_column(left, 'begin') \
+                and isinstance(right, sa.sql.elements.BindParameter):
+            if op is operators.ge and self.begin_from is None:
+                self.begin_from = right.effective_value
+                return True
+            elif op is operators.le and self.begin_to is None:
+                self.begin_to = right.effective_value
+                return True
+
+        elif self.is_column(left, 'expire_time') \
+                and isinstance(right, sa.sql.functions.now):
+            if op is operators.gt:
+                self.expired = False
+                return True
+            elif op is operators.le:
+                self.expired = True
+                return True
+
+        elif op is operators.is_ and isinstance(right, (True_, False_)):
+            for name in FLAG_COLUMNS:
+                if self.is_column(left, name):
+                    self.flags[name] = isinstance(right, True_)
+                    return True
+
+        else:
+            for name in FILTER_COLUMNS:
+                if self.is_column(left, name) and name not in self.columns:
+                    self.columns[name] = self.get_value(right, op)
+                    return self.columns[name] is not None
+
+        return False
+
+    def add_sender_or_recipient(self, clause):
+        """
+        Recognizes TransactionQuery.sent_or_received_by_user().
+        """
+        if self.parent is None \
+                or not isinstance(clause, sa.sql.elements.BooleanClauseList) \
+                or clause.operator is not operators.or_ \
+                or len(clause.clauses) != 2:
+            return False
+
+        sent, received = clause.clauses
+
+        if isinstance(sent, sa.sql.elements.BinaryExpression) \
+                and isinstance(received, sa.sql.elements.BinaryExpression) \
+                and self.is_column(sent.left, 'subject', parent=True) \
+                and self.is_column(received.left, 'subject'):
+            senders = self.get_value(sent.right, sent.operator)
+            recipients = self.get_value(received.right, received.operator)
+            if senders is not None and senders == recipients:
+                self.sender_or_recipient = senders
+                return True
+
+        return False
+
+    def get_directions(self):
+        """
+        Returns the subjects to read rollups for, per direction.
+
+        :rtype: list[(RollupDirection, list[str])]
+        """
+        if self.parent is None:
+            if self.subjects:
+                return [(RollupDirection.OWNED, self.subjects)]
+        elif not self.transferred:
+            pass
+        elif self.subjects and not self.senders and not self.sender_or_recipient:
+            return [(RollupDirection.INBOUND, self.subjects)]
+        elif self.senders and not self.subjects and not self.sender_or_recipient:
+            return [(RollupDirection.OUTBOUND, self.senders)]
+        elif self.sender_or_recipient and not self.subjects and not self.senders:
+            return [(RollupDirection.INBOUND, self.sender_or_recipient),
+                    (RollupDirection.OUTBOUND, self.sender_or_recipient)]
+
+        return []
+
+
+def get_rollup_source(query, parent=None):
+    """
+    Returns a subquery of the GGOs in the result set of the provided query
+    with the columns begin, sector, tech_code, fuel_code, and amount,
+    reading whole days from rollups (with begin at midnight UTC), and
+    the rest (partial days, and GGOs which expire today when filtering on
+    expiry) from the query itself. Returns None if the query has filters
+    which can not be applied to rollups.
+
+    :param origin.ggo.GgoQuery query:
+    :param parent: The aliased parent Ggo of a TransactionQuery
+    :rtype: sqlalchemy.sql.Subquery | None
+    """
+    f = RollupFilter.from_query(query, parent)
+
+    if f is None:
+        return None
+
+    # Rollups are read for days "first_day <= day < last_day", where
+    # GGOs are included no matter what hour they begin at
+    first_day = last_day = None
+
+    if f.begin_from is not None:
+        first_day = get_day(f.begin_from)
+        if get_midnight(first_day) < f.begin_from:
+            first_day += timedelta(days=1)
+
+    if f.begin_to is not None:
+        last_day = get_day(f.begin_to)
+
+    if first_day is not None and last_day is not None \
+            and first_day >= last_day:
+        return None
+
+    today = sql_day(func.now())
+    conditions = [sa.or_(*(
+        sa.and_(GgoRollup.direction == direction, GgoRollup.subject.in_(subjects))
+        for direction, subjects in f.get_directions()
+    ))]
+
+    # Rollups of GGOs which have since changed (ie. been retired) are
+    # left with a zero amount, while the GGOs are no longer in the query
+    conditions.append(GgoRollup.amount != 0)
+
+    # The remaining GGOs are read in disjoint parts (as opposed to a
+    # single OR-condition) so each part can use indexes on "begin"
+    remainder = []
+    days = []
+
+    if first_day is not None:
+        conditions.append(GgoRollup.day >= first_day)
+        remainder.append([Ggo.begin < get_midnight(first_day)])
+        days.append(Ggo.begin >= get_midnight(first_day))
+
+    if last_day is not None:
+        conditions.append(GgoRollup.day < last_day)
+        remainder.append([Ggo.begin >= get_midnight(last_day)])
+        days.append(Ggo.begin < get_midnight(last_day))
+
+    for name, value in f.flags.items():
+        conditions.append(getattr(GgoRollup, name).is_(value))
+
+    for name, values in f.columns.items():
+        conditions.append(getattr(GgoRollup, name).in_(values))
+
+    if f.expired is not None:
+        today_begin = func.timezone('UTC', func.date_trunc(
+            'day', func.timezone('UTC', func.now())))
+
+        # Rollups tell whether any of the GGOs expire today, in which
+        # case (only) they are read from the query itself
+        remainder.append(days + [
+            sa.exists().where(*conditions, GgoRollup.expire_day == today),
+            Ggo.expire_time >= today_begin,
+            Ggo.expire_time < today_begin + timedelta(days=1),
+        ])
+
+        if f.expired:
+            conditions.append(GgoRollup.expire_day < today)
+        else:
+            conditions.append(GgoRollup.expire_day > today)
+
+    rollups = sa.select(
+        func.timezone('UTC', sa.cast(GgoRollup.day, sa.DateTime())).label('begin'),
+        GgoRollup.sector.label('sector'),
+        func.nullif(GgoRollup.tech_code, '').label('tech_code'),
+        func.nullif(GgoRollup.fuel_code, '').label('fuel_code'),
+        GgoRollup.amount.label('amount'),
+    ).where(*conditions)
+
+    parts = [rollups]
+
+    for filters in remainder:
+        parts.append(query
+                     .filter(*filters)
+                     .query
+                     .enable_eagerloads(False)
+                     .with_entities(
+                         Ggo.begin.label('begin'),
+                         Ggo.sector.label('sector'),
+                         Ggo.tech_code.label('tech_code'),
+                         Ggo.fuel_code.label('fuel_code'),
+                         Ggo.amount.label('amount'),
+                     ).statement)
+
+    return sa.union_all(*parts).subquery()
+
+
+def get_distribution_source(subject, begin_from, begin_to):
+    """
+    Returns a subquery of all GGOs owned by, transferred to, or transferred
+    from the subject, which begin within the provided range (both included),
+    with the boolean columns owned, inbound, outbound, issued, stored,
+    retired, and expired, and the columns tech_code, fuel_code, and amount.
+
+    Whole days are read from rollups, and the rest (partial days, and GGOs
+    which expire today) from GGOs, all in a single statement.
+
+    :param str subject:
+    :param datetime begin_from:
+    :param datetime begin_to:
+    :rtype: sqlalchemy.sql.Subquery
+    """
+    parent = aliased(Ggo, name='parent')
+    today = sql_day(func.now())
+    today_begin = func.timezone('UTC', func.date_trunc(
+        'day', func.timezone('UTC', func.now())))
+
+    first_day = get_day(begin_from)
+    if get_midnight(first_day) < begin_from:
+        first_day += timedelta(days=1)
+
+    last_day = get_day(begin_to)
+
+    def get_ggos(*conditions):
+        """
+        GGOs owned by (or transferred to) the subject,
+        and GGOs transferred from the subject.
+        """
+        transferred = sa.and_(parent.id.isnot(None), parent.subject != Ggo.subject)
+
+        yield sa.select(
+            sa.true().label('owned'),
+            transferred.label('inbound'),
+            sa.false().label('outbound'),
+            Ggo.issued, Ggo.stored, Ggo.retired,
+            (Ggo.expire_time <= func.now()).label('expired'),
+            Ggo.tech_code, Ggo.fuel_code, Ggo.amount,
+        ).select_from(Ggo) \
+            .outerjoin(parent, parent.id == Ggo.parent_id) \
+            .where(Ggo.subject == subject, *conditions)
+
+        yield sa.select(
+            sa.false().label('owned'),
+            sa.false().label('inbound'),
+            sa.true().label('outbound'),
+            Ggo.issued, Ggo.stored, Ggo.retired,
+            (Ggo.expire_time <= func.now()).label('expired'),
+            Ggo.tech_code, Ggo.fuel_code, Ggo.amount,
+        ).select_from(Ggo) \
+            .join(parent, parent.id == Ggo.parent_id) \
+            .where(parent.subject == subject, Ggo.subject != subject, *conditions)
+
+    if first_day >= last_day:
+        return sa.union_all(*get_ggos(
+            Ggo.begin >= begin_from,
+            Ggo.begin <= begin_to,
+        )).subquery()
+
+    conditions = [
+        GgoRollup.subject == subject,
+        GgoRollup.day >= first_day,
+        GgoRollup.day < last_day,
+        GgoRollup.amount != 0,
+    ]
+
+    rollups = sa.select(
+        (GgoRollup.direction == RollupDirection.OWNED).label('owned'),
+        (GgoRollup.direction == RollupDirection.INBOUND).label('inbound'),
+        (GgoRollup.direction == RollupDirection.OUTBOUND).label('outbound'),
+        GgoRollup.issued, GgoRollup.stored, GgoRollup.retired,
+        (GgoRollup.expire_day < today).label('expired'),
+        func.nullif(GgoRollup.tech_code, '').label('tech_code'),
+        func.nullif(GgoRollup.fuel_code, '').label('fuel_code'),
+        GgoRollup.amount,
+    ).where(*conditions, GgoRollup.expire_day != today)
+
+    return sa.union_all(
+        rollups,
+        *get_ggos(
+            Ggo.begin >= begin_from,
+            Ggo.begin < get_midnight(first_day),
+        ),
+        *get_ggos(
+            Ggo.begin >= get_midnight(last_day),
+            Ggo.begin <= begin_to,
+        ),
+        *get_ggos(
+            sa.exists().where(*conditions, GgoRollup.expire_day == today),
+            Ggo.begin >= get_midnight(first_day),
+            Ggo.begin < get_midnight(last_day),
+            Ggo.expire_time >= today_begin,
+            Ggo.expire_time < today_begin + timedelta(days=1),
+        ),
+    ).subquery()
+
+
+# -- Events ------------------------------------------------------------------
+
+
+SESSION_KEY = 'ggo_rollup_deltas'
+
+
+@sa.event.listens_for(Session, 'after_flush')
+def on_after_flush(session, flush_context):
+    """
+    Collects the changes to rollups caused by GGOs inserted, updated,
+    or deleted (ie. by issuing GGOs, and by Batch.on_begin(),
+    on_commit(), and on_rollback()).
+    """
+    changes = []
+
+    for ggo in session.new:
+        if isinstance(ggo, Ggo):
+            changes.append((None, get_rollup_values(ggo, committed=False)))
+
+    for ggo in session.dirty:
+        if isinstance(ggo, Ggo):
+            old = get_rollup_values(ggo, committed=True)
+            new = get_rollup_values(ggo, committed=False)
+            if old != new:
+                changes.append((old, new))
+
+    for ggo in session.deleted:
+        if isinstance(ggo, Ggo):
+            changes.append((get_rollup_values(ggo, committed=True), None))
+
+    if not changes:
+        return
+
+    senders = get_subjects(session, set(
+        values['parent_id']
+        for change in changes
+        for values in change
+        if values is not None and values['parent_id'] is not None
+    ))
+
+    deltas = session.info.setdefault(SESSION_KEY, {})
+
+    for old, new in changes:
+        for values, sign in ((old, -1), (new, 1)):
+            if values is not None:
+                sender = senders.get(values['parent_id'])
+                for key in get_rollup_keys(values, sender):
+                    deltas[key] = deltas.get(key, 0) + sign * values['amount']
+
+
+@sa.event.listens_for(Session, 'before_commit')
+def on_before_commit(session):
+    """
+    Applies the changes to rollups collected, as part of the transaction.
+    """
+    session.flush()
+
+    deltas = session.info.pop(SESSION_KEY, None)
+
+    if deltas:
+        apply_rollup_deltas(session, deltas)
+
+
+@sa.event.listens_for(Session, 'after_rollback')
+def on_after_rollback(session):
+    session.info.pop(SESSION_KEY, None)
+
+
+def on_set(target, value, oldvalue, initiator):
+    pass
+
+
+# Loads the previous value when setting any of these attributes on a GGO
+# (if not already loaded), so the rollups it was counted in are known
+for attr in ROLLUP_ATTRIBUTES:
+    sa.event.listen(getattr(Ggo, attr), 'set', on_set, active_history=True)
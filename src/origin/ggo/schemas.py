@@ -5,7 +5,9 @@ from dataclasses import dataclass, field
 from marshmallow import validates_schema, ValidationError, validate, post_load
 
 from origin.auth import subject_exists
-from origin.common import DateTimeRange, SummaryResolution, SummaryGroup
+from origin.config import COMPOSE_BULK_MAX_ITEMS
+from origin.common import DateTimeRange, SummaryResolution, SummaryGroup, \
+    ExportFormat, TotalCount
 from origin.technologies import MappedTechnology
 
 
@@ -197,12 +199,27 @@ class GetGgoListRequest:
     limit: int = field(default=None)
     order: List[str] = field(default_factory=list)
 
+    # The "nextCursor" of the previous page, if any
+    cursor: str = field(default=None)
+
+    total: TotalCount = field(default=TotalCount.EXACT, metadata=dict(by_value=True))
+
 
 @dataclass
 class GetGgoListResponse:
     success: bool
-    total: int
+    total: int = field(default=None)
     results: List[MappedGgo] = field(default_factory=list)
+    next_cursor: str = field(default=None, metadata=dict(data_key='nextCursor'))
+
+
+# -- ExportGgoList request ---------------------------------------------------
+
+
+@dataclass
+class ExportGgoListRequest:
+    filters: GgoFilters
+    format: ExportFormat = field(default=ExportFormat.NDJSON, metadata=dict(by_value=True))
 
 
 # -- GetGgoSummary request and response --------------------------------------
@@ -329,6 +346,46 @@ class ComposeGgoResponse:
     message: str = field(default=None)
 
 
+# -- ComposeGgoBulk request and response -------------------------------------
+
+
+@dataclass
+class BulkTransferRequest:
+    """
+    The same as TransferRequest, except the account is resolved when
+    composing (for all items at once) rather than validated beforehand.
+    """
+    amount: int = field(metadata=dict(validate=validate.Range(min=1)))
+    reference: str
+    account: str
+
+
+@dataclass
+class ComposeGgoBulkItem:
+    id: str
+    transfers: List[BulkTransferRequest] = field(default_factory=list)
+    retires: List[RetireRequest] = field(default_factory=list)
+
+
+@dataclass
+class ComposeGgoBulkRequest:
+    items: List[ComposeGgoBulkItem] = field(metadata=dict(
+        validate=validate.Length(min=1, max=COMPOSE_BULK_MAX_ITEMS)))
+
+
+@dataclass
+class ComposeGgoBulkResult:
+    id: str
+    success: bool
+    message: str = field(default=None)
+
+
+@dataclass
+class ComposeGgoBulkResponse:
+    success: bool
+    results: List[ComposeGgoBulkResult] = field(default_factory=list)
+
+
 # -- GetTransferredAmount request and response -------------------------------
 
 
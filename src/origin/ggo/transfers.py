@@ -0,0 +1,194 @@
+import sqlalchemy as sa
+from sqlalchemy.sql import operators
+
+from .models import Ggo, SplitTarget, Transfer
+from .rollups import RollupFilter
+
+
+# Columns of Ggo which have the same value on its Transfer
+GGO_COLUMNS = {
+    'subject': Transfer.recipient,
+    'begin': Transfer.begin,
+    'sector': Transfer.sector,
+    'tech_code': Transfer.tech_code,
+    'fuel_code': Transfer.fuel_code,
+    'amount': Transfer.amount,
+}
+
+# Operators which can be applied as-is to the columns of Transfer
+COMPARISONS = (
+    operators.eq,
+    operators.ne,
+    operators.lt,
+    operators.le,
+    operators.gt,
+    operators.ge,
+)
+
+
+class TransferFilter(object):
+    """
+    The filters of a TransactionQuery translated to Transfers, if all of
+    them can be. Recognizes the filters applied by sent_by_user(),
+    received_by_user(), has_reference(), begins_at(), begins_within() etc.,
+    and filtering on sector and technology, but not on the state of the
+    GGOs (ie. in_category()), which Transfers do not reflect.
+    """
+
+    def __init__(self, parent):
+        """
+        :param parent: The aliased parent Ggo of a TransactionQuery
+        """
+        self.parent = parent
+        self.transferred = False
+        self.conditions = []
+
+    @classmethod
+    def from_query(cls, query, parent):
+        """
+        :param origin.ggo.TransactionQuery query:
+        :param parent: The aliased parent Ggo of a TransactionQuery
+        :rtype: TransferFilter | None
+        """
+        f = cls(parent)
+
+        for clause in RollupFilter.flatten(query.query.whereclause):
+            if not f.add(clause):
+                return None
+
+        if f.transferred:
+            return f
+        return None
+
+    def get_column(self, expr):
+        """
+        Returns the column of Transfer which has the same value as the
+        provided column of a TransactionQuery, if any.
+
+        :param sa.Column expr:
+        :rtype: sa.orm.attributes.InstrumentedAttribute | None
+        """
+        if not isinstance(expr, sa.Column):
+            return None
+        elif expr.table is sa.inspect(self.parent).selectable:
+            return Transfer.sender if expr.key == 'subject' else None
+        elif expr.table is SplitTarget.__table__:
+            return Transfer.reference if expr.key == 'reference' else None
+        elif expr.table is Ggo.__table__:
+            return GGO_COLUMNS.get(expr.key)
+        return None
+
+    def add(self, clause):
+        """
+        :rtype: bool
+        :returns: Whether the clause can be applied to Transfers
+        """
+        if isinstance(clause, sa.sql.elements.BinaryExpression) \
+                and clause.operator is operators.ne \
+                and self.get_column(clause.left) is Transfer.recipient \
+                and self.get_column(clause.right) is Transfer.sender:
+            self.transferred = True
+            return True
+
+        condition = self.translate(clause)
+
+        if condition is not None:
+            self.conditions.append(condition)
+            return True
+
+        return False
+
+    def translate(self, clause):
+        """
+        Returns the clause as a condition on Transfer, or None if it
+        can not be translated.
+
+        :param sa.sql.ClauseElement clause:
+        :rtype: sa.sql.ColumnElement | None
+        """
+        if isinstance(clause, sa.sql.elements.Grouping):
+            return self.translate(clause.element)
+
+        elif isinstance(clause, sa.sql.elements.BooleanClauseList):
+            conditions = [self.translate(c) for c in clause.clauses]
+            if any(c is None for c in conditions):
+                return None
+            elif clause.operator is operators.or_:
+                return sa.or_(*conditions)
+            elif clause.operator is operators.and_:
+                return sa.and_(*conditions)
+
+        elif isinstance(clause, sa.sql.elements.BinaryExpression) \
+                and isinstance(clause.right, sa.sql.elements.BindParameter):
+            column = self.get_column(clause.left)
+            value = clause.right.effective_value
+
+            if column is None:
+                return None
+            elif clause.operator is operators.in_op:
+                return column.in_(list(value))
+            elif clause.operator in COMPARISONS:
+                return clause.operator(column, value)
+
+        return None
+
+
+def get_transfer_columns(parent, columns):
+    """
+    Returns the columns of Transfer which have the same values as the
+    provided columns of a TransactionQuery, or None if any of them
+    can not be read from Transfers.
+
+    :param parent: The aliased parent Ggo of a TransactionQuery
+    :param list[sa.orm.attributes.InstrumentedAttribute] columns:
+    :rtype: list[sa.orm.attributes.InstrumentedAttribute] | None
+    """
+    f = TransferFilter(parent)
+    transfer_columns = [f.get_column(c.expression) for c in columns]
+
+    if any(c is None for c in transfer_columns):
+        return None
+    return transfer_columns
+
+
+def get_transfer_query(query, parent):
+    """
+    Returns a query of the Transfers of the GGOs in the result set of the
+    provided TransactionQuery, or None if the query has filters which can
+    not be applied to Transfers.
+
+    :param origin.ggo.TransactionQuery query:
+    :param parent: The aliased parent Ggo of a TransactionQuery
+    :rtype: sa.orm.Query | None
+    """
+    f = TransferFilter.from_query(query, parent)
+
+    if f is None:
+        return None
+
+    return query.session.query(Transfer).filter(*f.conditions)
+
+
+def get_transfer_source(query, parent):
+    """
+    Returns a subquery of the GGOs in the result set of the provided
+    TransactionQuery with the columns begin, sector, tech_code, fuel_code,
+    and amount, read from Transfers, or None if the query has filters
+    which can not be applied to Transfers.
+
+    :param origin.ggo.TransactionQuery query:
+    :param parent: The aliased parent Ggo of a TransactionQuery
+    :rtype: sqlalchemy.sql.Subquery | None
+    """
+    transfers = get_transfer_query(query, parent)
+
+    if transfers is None:
+        return None
+
+    return transfers.with_entities(
+        Transfer.begin.label('begin'),
+        Transfer.sector.label('sector'),
+        Transfer.tech_code.label('tech_code'),
+        Transfer.fuel_code.label('fuel_code'),
+        Transfer.amount.label('amount'),
+    ).subquery()
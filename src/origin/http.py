@@ -1,7 +1,7 @@
 import json
 from flask import request, redirect, Response
 from marshmallow import ValidationError
-from werkzeug.exceptions import HTTPException, BadRequest, Unauthorized
+from werkzeug.exceptions import HTTPException, BadRequest, Unauthorized, Conflict
 
 
 class Controller(object):
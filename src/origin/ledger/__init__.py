@@ -0,0 +1,9 @@
+from .service import (
+    LedgerService,
+    LedgerBatchStatus,
+    LedgerServiceError,
+    LedgerServiceConnectionError,
+)
+from .fake import FakeLedgerService
+from .submitter import \
+    submit_pending_batches, poll_submitted_batches, run_ledger_submitter
@@ -0,0 +1,93 @@
+from click import echo, Abort
+from cloup import group, command, option, IntRange, FloatRange
+
+from .fake import FakeLedgerService
+from .submitter import run_ledger_submitter
+
+
+# -- Commands ----------------------------------------------------------------
+
+
+@command()
+@option(
+    '--fake',
+    is_flag=True,
+    default=False,
+    help='Submit to a ledger kept in memory (for testing)',
+)
+@option(
+    '--latency',
+    type=FloatRange(min=0),
+    default=0,
+    help='Seconds per round trip to the fake ledger',
+)
+@option(
+    '--processing-time',
+    type=FloatRange(min=0),
+    default=0,
+    help='Seconds before the fake ledger processes a batch',
+)
+@option(
+    '--decline-rate',
+    type=FloatRange(min=0, max=1),
+    default=0,
+    help='Probability of the fake ledger declining a batch',
+)
+@option(
+    '--poll-interval',
+    type=IntRange(min=1),
+    required=True,
+    default=1,
+    help='Seconds to wait when nothing is pending or due to be polled',
+)
+@option(
+    '--once',
+    is_flag=True,
+    default=False,
+    help='Exit once no batches are pending or submitted',
+)
+def submit_batches(fake, latency, processing_time, decline_rate,
+                   poll_interval, once):
+    """
+    Submit pending batches to the ledger, and complete or roll them back
+    once processed (when SUBMIT_BATCHES_TO_LEDGER is enabled).
+
+    Batches are submitted, and polled, many at a time. Multiple
+    submitters can run at once.
+    """
+    if not fake:
+        echo('No ledger client is available, use --fake to submit '
+             'to a ledger kept in memory')
+        raise Abort()
+
+    ledger = FakeLedgerService(
+        latency=latency,
+        processing_time=processing_time,
+        decline_rate=decline_rate,
+    )
+
+    try:
+        run_ledger_submitter(
+            ledger=ledger,
+            poll_interval=poll_interval,
+            once=once,
+            on_progress=lambda submitted, completed, rolled_back: echo(
+                f'Submitted {submitted}, completed {completed}, and '
+                f'rolled back {rolled_back} batch(es)'),
+        )
+    finally:
+        echo(f'{ledger.round_trips} round trip(s) to the ledger')
+
+
+# -- Group -------------------------------------------------------------------
+
+
+@group()
+def ledger_group() -> None:
+    """
+    Manage submission of batches to the ledger
+    """
+    pass
+
+
+ledger_group.add_command(submit_batches, 'submit')
@@ -0,0 +1,179 @@
+import time
+import random
+import threading
+from uuid import uuid4
+from dataclasses import dataclass, field
+
+from .service import LedgerService, LedgerBatchStatus
+
+
+@dataclass
+class FakeLedgerBatch:
+    """
+    A batch submitted to the FakeLedgerService
+    """
+    handle: str
+
+    # IDs of the GGOs which the batch spends (transfers or retires),
+    # and creates (by splitting)
+    inputs: set
+    outputs: set
+
+    # Time (time.monotonic()) when the batch can be processed
+    ready: float
+
+    status: LedgerBatchStatus = field(default=LedgerBatchStatus.PENDING)
+
+
+class FakeLedgerService(LedgerService):
+    """
+    A ledger kept in memory, which allows running the whole submission
+    pipeline offline, ie. for testing or load testing.
+
+    Each round trip takes "latency" seconds, and batches are processed
+    "processing_time" seconds after they are submitted (when polled).
+    Like the actual ledger, a batch is declined if:
+
+        - any GGO it spends was created by a declined batch, so declines
+          cascade to batches depending on the declined batch
+
+        - any GGO it spends was spent by another batch submitted before
+          it, which was not declined (double spending)
+
+    Otherwise, batches are declined at random with probability
+    "decline_rate", or completed.
+    """
+
+    def __init__(self, latency=0, processing_time=0, decline_rate=0,
+                 seed=None):
+        """
+        :param float latency: Seconds per round trip
+        :param float processing_time: Seconds before batches are processed
+        :param float decline_rate: Probability of declining a batch
+        :param int seed: Seed for declining batches at random
+        """
+        self.latency = latency
+        self.processing_time = processing_time
+        self.decline_rate = decline_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        # {handle: FakeLedgerBatch}
+        self.batches = {}
+
+        # {batch_id: handle}
+        self.handles = {}
+
+        # {ggo_id: handle} of the batch which created the GGO
+        self.created = {}
+
+        # {ggo_id: [handle]} of the batches which spend the GGO,
+        # in the order they were submitted
+        self.spent = {}
+
+        # Number of round trips, for reporting
+        self.round_trips = 0
+
+    def submit_batches(self, batches):
+        """
+        :param list[origin.ggo.Batch] batches:
+        :rtype: list[str]
+        """
+        self.round_trip()
+
+        with self.lock:
+            return [self.submit_batch(batch) for batch in batches]
+
+    def submit_batch(self, batch):
+        """
+        :param origin.ggo.Batch batch:
+        :rtype: str
+        """
+        if batch.id in self.handles:
+            return self.handles[batch.id]
+
+        outputs = set(
+            target.ggo_id
+            for transaction in batch.transactions
+            for target in getattr(transaction, 'targets', ())
+        )
+
+        inputs = set(
+            transaction.parent_ggo_id
+            for transaction in batch.transactions
+        ) - outputs
+
+        handle = str(uuid4())
+
+        self.handles[batch.id] = handle
+        self.batches[handle] = FakeLedgerBatch(
+            handle=handle,
+            inputs=inputs,
+            outputs=outputs,
+            ready=time.monotonic() + self.processing_time,
+        )
+
+        for ggo_id in outputs:
+            self.created[ggo_id] = handle
+        for ggo_id in inputs:
+            self.spent.setdefault(ggo_id, []).append(handle)
+
+        return handle
+
+    def get_batch_statuses(self, handles):
+        """
+        :param list[str] handles:
+        :rtype: dict[str, LedgerBatchStatus]
+        """
+        self.round_trip()
+
+        with self.lock:
+            return {handle: self.process(handle) for handle in handles}
+
+    def process(self, handle):
+        """
+        Processes the batch with the provided handle (and the batches it
+        depends on) if it is ready, and returns its status.
+
+        :param str handle:
+        :rtype: LedgerBatchStatus
+        """
+        batch = self.batches.get(handle)
+
+        if batch is None:
+            return LedgerBatchStatus.UNKNOWN
+        if batch.status is not LedgerBatchStatus.PENDING:
+            return batch.status
+        if time.monotonic() < batch.ready:
+            return LedgerBatchStatus.PENDING
+
+        # Batches which created the GGOs, or spent them before this batch
+        dependencies = [self.created[ggo_id] for ggo_id in batch.inputs
+                        if ggo_id in self.created]
+
+        spent_before = [h for ggo_id in batch.inputs
+                        for h in self.spent[ggo_id][:self.spent[ggo_id].index(handle)]]
+
+        statuses = [self.process(h) for h in dependencies]
+        spent_statuses = [self.process(h) for h in spent_before]
+
+        if LedgerBatchStatus.DECLINED in statuses \
+                or LedgerBatchStatus.COMPLETED in spent_statuses:
+            batch.status = LedgerBatchStatus.DECLINED
+        elif LedgerBatchStatus.PENDING in statuses + spent_statuses:
+            return LedgerBatchStatus.PENDING
+        elif self.random.random() < self.decline_rate:
+            batch.status = LedgerBatchStatus.DECLINED
+        else:
+            batch.status = LedgerBatchStatus.COMPLETED
+
+        return batch.status
+
+    def round_trip(self):
+        """
+        Simulates the latency of a round trip to the ledger.
+        """
+        self.round_trips += 1
+
+        if self.latency:
+            time.sleep(self.latency)
@@ -0,0 +1,60 @@
+from enum import Enum
+
+
+class LedgerBatchStatus(Enum):
+    """
+    Statuses of a batch on the ledger
+    """
+    # The batch is still being processed
+    PENDING = 'PENDING'
+    # The batch was processed successfully
+    COMPLETED = 'COMPLETED'
+    # The batch failed to be processed
+    DECLINED = 'DECLINED'
+    # The ledger does not know the handle (yet)
+    UNKNOWN = 'UNKNOWN'
+
+
+class LedgerServiceConnectionError(Exception):
+    """
+    Raised when invoking the ledger results in a connection error
+    """
+    pass
+
+
+class LedgerServiceError(Exception):
+    """
+    Raised when the ledger fails to process a request
+    """
+    pass
+
+
+class LedgerService(object):
+    """
+    Interface for submitting batches to the ledger, and enquiring about
+    their statuses. Both operations handle many batches in a single round
+    trip, as batches are submitted and polled in bulk (see
+    origin.ledger.submitter).
+    """
+    def submit_batches(self, batches):
+        """
+        Submits the provided batches to the ledger in the order provided,
+        and returns their handles in the same order.
+
+        Submitting the same batch (ID) more than once must return the
+        same handle, as a batch may be submitted again if the database
+        transaction fails after it was submitted.
+
+        :param list[origin.ggo.Batch] batches:
+        :rtype: list[str]
+        """
+        raise NotImplementedError
+
+    def get_batch_statuses(self, handles):
+        """
+        Returns the statuses of the batches with the provided handles.
+
+        :param list[str] handles:
+        :rtype: dict[str, LedgerBatchStatus]
+        """
+        raise NotImplementedError
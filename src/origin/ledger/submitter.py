@@ -0,0 +1,343 @@
+import time
+import logging
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from origin.db import make_session
+from origin.config import \
+    LEDGER_SUBMIT_BATCH_SIZE, LEDGER_POLL_BATCH_SIZE, \
+    LEDGER_POLL_INTERVAL, LEDGER_POLL_MAX_INTERVAL
+from origin.ggo import \
+    Batch, BatchState, Transaction, SplitTransaction, SplitTarget, \
+    RetireTransaction
+
+from .service import LedgerBatchStatus
+
+
+logger = logging.getLogger(__name__)
+
+
+def submit_pending_batches(session, ledger, limit=LEDGER_SUBMIT_BATCH_SIZE):
+    """
+    Claims up to "limit" PENDING batches, submits them to the ledger in
+    a single round trip (in the order they were created), and marks them
+    SUBMITTED. Batches claimed by other transactions are skipped, so
+    multiple submitters can run at once.
+
+    :param sqlalchemy.orm.Session session:
+    :param origin.ledger.LedgerService ledger:
+    :param int limit: Maximum number of batches to submit
+    :rtype: int
+    :returns: The number of batches submitted
+    """
+    batches = session.query(Batch) \
+        .filter(Batch.state == BatchState.PENDING) \
+        .order_by(Batch.id.asc()) \
+        .with_for_update(skip_locked=True) \
+        .limit(limit) \
+        .all()
+
+    if not batches:
+        return 0
+
+    load_transactions(session, batches)
+
+    handles = ledger.submit_batches(batches)
+
+    for batch, handle in zip(batches, handles):
+        batch.on_submitted(handle, poll_delay=get_poll_delay(0))
+
+    return len(batches)
+
+
+def poll_submitted_batches(session, ledger, limit=LEDGER_POLL_BATCH_SIZE):
+    """
+    Claims up to "limit" SUBMITTED batches which are due to be polled,
+    polls the ledger for their statuses in a single round trip, and
+    completes or rolls back the batches which the ledger has processed,
+    in bulk. Batches still being processed are polled again after a
+    delay, which doubles every time they are polled (see get_poll_delay()).
+
+    Batches claimed by other transactions are skipped, so multiple
+    submitters can run at once.
+
+    :param sqlalchemy.orm.Session session:
+    :param origin.ledger.LedgerService ledger:
+    :param int limit: Maximum number of batches to poll
+    :rtype: (int, int, int)
+    :returns: The number of batches completed, rolled back (including
+        batches depending on them), and still being processed (including
+        declined batches which can not be rolled back yet)
+    """
+    batches = session.query(Batch) \
+        .filter(Batch.state == BatchState.SUBMITTED) \
+        .filter(Batch.next_poll <= func.now()) \
+        .order_by(Batch.next_poll.asc()) \
+        .with_for_update(skip_locked=True) \
+        .limit(limit) \
+        .all()
+
+    if not batches:
+        return 0, 0, 0
+
+    statuses = ledger.get_batch_statuses([b.handle for b in batches])
+
+    completed = []
+    declined = []
+    pending = []
+
+    for batch in batches:
+        status = statuses.get(batch.handle, LedgerBatchStatus.UNKNOWN)
+
+        if status is LedgerBatchStatus.COMPLETED:
+            completed.append(batch)
+        elif status is LedgerBatchStatus.DECLINED:
+            declined.append(batch)
+        else:
+            pending.append(batch)
+
+    complete_batches(session, completed)
+    rolled_back, deferred = rollback_batches(session, declined)
+    pending.extend(deferred)
+
+    for batch in pending:
+        batch.on_polled(get_poll_delay(batch.poll_count + 1))
+
+    return len(completed), len(rolled_back), len(pending)
+
+
+def get_poll_delay(poll_count):
+    """
+    Returns the number of seconds to wait before polling the ledger for
+    the status of a batch, which has been polled "poll_count" times.
+
+    :param int poll_count:
+    :rtype: float
+    """
+    return min(LEDGER_POLL_INTERVAL * 2 ** poll_count, LEDGER_POLL_MAX_INTERVAL)
+
+
+def complete_batches(session, batches):
+    """
+    Invokes on_commit() on the provided batches, loading their
+    transactions (and what they affect) using a handful of queries.
+
+    :param sqlalchemy.orm.Session session:
+    :param list[Batch] batches:
+    """
+    load_transactions(session, batches)
+
+    for batch in batches:
+        batch.on_commit()
+
+
+def rollback_batches(session, batches):
+    """
+    Invokes on_rollback() on the provided (declined) batches, and on any
+    batches which spend GGOs created by them (recursively), as they can
+    not be completed either. Dependent batches are rolled back before the
+    batches they depend on, as rolling back deletes the GGOs they spend.
+
+    A batch is deferred, rather than rolled back, if any of its dependent
+    batches are locked by other transactions, or have been submitted to
+    the ledger (except those declined along with it). The ledger decides
+    the outcome of submitted batches, so they are rolled back once the
+    ledger has declined them, after which deferred batches are rolled
+    back when polled again.
+
+    :param sqlalchemy.orm.Session session:
+    :param list[Batch] batches:
+    :rtype: (list[Batch], list[Batch])
+    :returns: All batches rolled back, including dependent batches,
+        and the batches deferred
+    """
+    declined = set(b.id for b in batches)
+    rolled_back = []
+    deferred = []
+
+    for batch in batches:
+        # May have been rolled back as a dependent of a previous batch
+        if batch.state is BatchState.DECLINED:
+            continue
+
+        levels = get_dependent_levels(session, batch, declined)
+
+        if levels is None:
+            deferred.append(batch)
+            continue
+
+        for level in reversed(levels):
+            load_transactions(session, level)
+
+            for dependent in level:
+                dependent.on_rollback()
+
+            session.flush()
+            rolled_back.extend(level)
+
+    return rolled_back, deferred
+
+
+def get_dependent_levels(session, batch, declined):
+    """
+    Returns the provided batch followed by its dependent batches, level
+    by level (see get_dependent_batches()), or None if any of them are
+    locked by other transactions, or have been submitted to the ledger
+    and are not among the provided declined batches.
+
+    The batches are locked until the transaction ends.
+
+    :param sqlalchemy.orm.Session session:
+    :param Batch batch:
+    :param set[int] declined: IDs of batches declined by the ledger
+    :rtype: list[list[Batch]] | None
+    """
+    levels = []
+    seen = set()
+    batches = [batch]
+
+    while batches:
+        levels.append(batches)
+        seen.update(b.id for b in batches)
+        batches = get_dependent_batches(session, batches, seen)
+
+        if batches is None or any(b.state is BatchState.SUBMITTED
+                                  and b.id not in declined
+                                  for b in batches):
+            return None
+
+    return levels
+
+
+def get_dependent_batches(session, batches, exclude):
+    """
+    Returns the batches (except those declined or excluded) which have
+    transactions spending GGOs created by the provided batches, ie. GGOs
+    transferred to another user who has since transferred or retired them.
+
+    The batches are locked until the transaction ends. Returns None if
+    any of them are locked by other transactions (ie. another submitter),
+    rather than waiting for them.
+
+    :param sqlalchemy.orm.Session session:
+    :param list[Batch] batches:
+    :param set[int] exclude: IDs of batches to exclude
+    :rtype: list[Batch] | None
+    """
+    created = session.query(SplitTarget.ggo_id) \
+        .join(SplitTransaction, SplitTransaction.id == SplitTarget.transaction_id) \
+        .filter(SplitTransaction.batch_id.in_([b.id for b in batches]))
+
+    dependent = session.query(Transaction.batch_id) \
+        .filter(Transaction.parent_ggo_id.in_(created))
+
+    query = session.query(Batch) \
+        .filter(Batch.id.in_(dependent)) \
+        .filter(Batch.id.notin_(exclude)) \
+        .filter(Batch.state != BatchState.DECLINED)
+
+    count = query.count()
+
+    locked = query \
+        .order_by(Batch.id.asc()) \
+        .with_for_update(skip_locked=True) \
+        .all()
+
+    if len(locked) < count:
+        return None
+
+    return locked
+
+
+def load_transactions(session, batches):
+    """
+    Loads the transactions of the provided batches, along with everything
+    their lifecycle hooks affect, using a query per relationship rather
+    than per transaction.
+
+    :param sqlalchemy.orm.Session session:
+    :param list[Batch] batches:
+    """
+    if not batches:
+        return
+
+    batch_ids = [b.id for b in batches]
+
+    session.query(Batch) \
+        .filter(Batch.id.in_(batch_ids)) \
+        .options(selectinload(Batch.transactions)) \
+        .all()
+
+    # Transactions share a table, so queries on a subclass must
+    # filter on its polymorphic identity
+    session.query(SplitTransaction) \
+        .filter(SplitTransaction.type == 'split') \
+        .filter(SplitTransaction.batch_id.in_(batch_ids)) \
+        .options(
+            selectinload(SplitTransaction.parent_ggo),
+            selectinload(SplitTransaction.targets).selectinload(SplitTarget.ggo),
+            selectinload(SplitTransaction.targets).selectinload(SplitTarget.transfer),
+        ) \
+        .all()
+
+    session.query(RetireTransaction) \
+        .filter(RetireTransaction.type == 'retire') \
+        .filter(RetireTransaction.batch_id.in_(batch_ids)) \
+        .options(
+            selectinload(RetireTransaction.parent_ggo),
+            selectinload(RetireTransaction.measurement),
+        ) \
+        .all()
+
+
+def run_ledger_submitter(ledger, poll_interval=1, once=False,
+                         on_progress=None):
+    """
+    Submits pending batches to the ledger, and polls the ledger for the
+    statuses of submitted batches, each in a separate transaction.
+    Waits "poll_interval" seconds whenever there is nothing to submit
+    and no batches are due to be polled, or returns if "once" is True
+    and no batches are pending or submitted.
+
+    :param origin.ledger.LedgerService ledger:
+    :param float poll_interval: Seconds to wait when there is nothing to do
+    :param bool once: Whether to return once no batches are
+        pending or submitted
+    :param collections.abc.Callable[[int, int, int], None] on_progress:
+        Invoked with the number of batches submitted, completed,
+        and rolled back after each round
+    """
+    while True:
+        session = make_session()
+        try:
+            submitted = submit_pending_batches(session, ledger)
+            session.commit()
+            completed, rolled_back, pending = \
+                poll_submitted_batches(session, ledger)
+            session.commit()
+            idle = not (submitted or completed or rolled_back)
+            done = idle and not has_unfinished_batches(session)
+        except:
+            session.rollback()
+            logger.exception('Failed to submit batches to the ledger')
+            raise
+        finally:
+            session.close()
+
+        if not idle and on_progress is not None:
+            on_progress(submitted, completed, rolled_back)
+
+        if done and once:
+            return
+        if idle:
+            time.sleep(poll_interval)
+
+
+def has_unfinished_batches(session):
+    """
+    :param sqlalchemy.orm.Session session:
+    :rtype: bool
+    """
+    return session.query(Batch.id) \
+        .filter(Batch.state.in_([BatchState.PENDING, BatchState.SUBMITTED])) \
+        .first() is not None
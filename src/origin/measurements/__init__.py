@@ -1,3 +1,5 @@
-from .models import Measurement
+from .models import Measurement, MeasurementPeriod, MeasurementRollup, MeasurementStats
 from .schemas import MappedMeasurement
 from .queries import MeasurementQuery
+from .rollups import rebuild_rollups
+from .locks import lock_retire_accounting
@@ -8,8 +8,12 @@ from cloup.constraints import RequireExactly
 
 from origin.db import atomic
 from origin.config import GGO_ISSUE_INTERVAL
-from origin.processes import create_measurement
-from origin.meteringpoints import MeteringPointQuery
+from origin.processes import create_measurement, handle_ggos_received, \
+    get_ggos_awaiting_consumption
+from origin.meteringpoints import MeteringPointQuery, MeteringPointType
+
+from .rollups import rebuild_rollups
+from .counters import get_retired_amount_errors, fix_retired_amounts
 
 
 @command()
@@ -51,6 +55,8 @@ def import_measurements(session, path, url):
         raise RuntimeError('Should NOT have happened')
 
     meteringpoints = {}
+    ggos = []
+    consumption = []
 
     def __get_meteringpoint(gsrn):
         if gsrn not in meteringpoints:
@@ -69,14 +75,23 @@ def import_measurements(session, path, url):
         amount = int(m['amount'])
         mp = __get_meteringpoint(m['gsrn'])
 
-        create_measurement(
+        ggo = create_measurement(
             meteringpoint=mp,
             begin=begin,
             end=end,
             amount=amount,
             session=session,
+            consume=False,
         )
 
+        if ggo is not None:
+            ggos.append(ggo)
+        elif mp.type is MeteringPointType.CONSUMPTION:
+            consumption.append((mp, begin))
+
+    ggos.extend(get_ggos_awaiting_consumption(consumption, session))
+    handle_ggos_received(ggos, session)
+
 
 @command()
 @option(
@@ -133,18 +148,64 @@ def generate_measurements(gsrn, from_, to_, min_, max_, session):
 
     begin = from_.astimezone(timezone.utc)
     end = to_.astimezone(timezone.utc)
+    ggos = []
+    consumption = []
 
     while begin < end:
-        create_measurement(
+        ggo = create_measurement(
             meteringpoint=mp,
             begin=begin,
             end=(begin + GGO_ISSUE_INTERVAL),
             amount=random.randint(min_, max_),
             session=session,
+            consume=False,
         )
 
+        if ggo is not None:
+            ggos.append(ggo)
+        elif mp.type is MeteringPointType.CONSUMPTION:
+            consumption.append((mp, begin))
+
         begin += GGO_ISSUE_INTERVAL
 
+    ggos.extend(get_ggos_awaiting_consumption(consumption, session))
+    handle_ggos_received(ggos, session)
+
+
+@command()
+@atomic
+def rebuild_measurement_rollups(session):
+    """
+    Rebuild measurement rollups and stats (used by summaries) from scratch
+    """
+    count = rebuild_rollups(session)
+    echo(f'Rebuilt {count} rollups')
+
+
+@command()
+@option(
+    '--fix',
+    is_flag=True,
+    default=False,
+    help='Correct the counters which are inconsistent',
+)
+@atomic
+def check_retired_amounts(fix, session):
+    """
+    Check the retired amount of measurements against the GGOs retired
+    to them, and optionally correct them
+    """
+    errors = get_retired_amount_errors(session)
+
+    for id, counted, actual in errors:
+        echo(f'Measurement {id}: counted {counted}, retired {actual}')
+
+    if errors and fix:
+        fix_retired_amounts(session, errors)
+        echo(f'Fixed {len(errors)} measurement(s)')
+    else:
+        echo(f'Found {len(errors)} inconsistent measurement(s)')
+
 
 # -- Group -------------------------------------------------------------------
 
@@ -159,3 +220,5 @@ def measurements_group() -> None:
 
 measurements_group.add_command(import_measurements, 'import')
 measurements_group.add_command(generate_measurements, 'generate')
+measurements_group.add_command(rebuild_measurement_rollups, 'rebuild-rollups')
+measurements_group.add_command(check_retired_amounts, 'check-retired-amounts')
@@ -1,8 +1,10 @@
 import marshmallow_dataclass as md
 
-from origin.http import Controller
+from origin.http import Controller, BadRequest
 from origin.db import inject_session
 from origin.auth import requires_login
+from origin.common.export import export_response
+from origin.common.pagination import paginate, get_total
 
 from .queries import MeasurementQuery
 from .models import Measurement, MeteringPointType
@@ -11,6 +13,7 @@ from .schemas import (
     GetMeasurementRequest,
     GetMeasurementListRequest,
     GetMeasurementListResponse,
+    ExportMeasurementListRequest,
     GetBeginRangeRequest,
     GetBeginRangeResponse,
     GetMeasurementSummaryRequest,
@@ -78,17 +81,23 @@ class GetMeasurementList(Controller):
         if request.filters:
             query = query.apply_filters(request.filters)
 
-        results = query \
-            .order_by(self.get_order_by(request)) \
-            .offset(request.offset)
-
-        if request.limit:
-            results = results.limit(request.limit)
+        try:
+            results, next_cursor = paginate(
+                query=query,
+                columns=[self.get_order_by(request), Measurement.id],
+                limit=request.limit,
+                cursor=request.cursor,
+                descending=request.sort == 'desc',
+                offset=request.offset,
+            )
+        except ValueError as e:
+            raise BadRequest(str(e))
 
         return GetMeasurementListResponse(
             success=True,
-            total=query.count(),
-            measurements=results.all(),
+            total=get_total(query, request.total),
+            measurements=results,
+            next_cursor=next_cursor,
         )
 
     def get_order_by(self, request):
@@ -96,18 +105,46 @@ class GetMeasurementList(Controller):
         :param GetMeasurementListRequest request:
         """
         if request.order == 'begin':
-            field = Measurement.begin
+            return Measurement.begin
         elif request.order == 'amount':
-            field = Measurement.amount
+            return Measurement.amount
         else:
             raise RuntimeError('Should NOT have happened')
 
-        if request.sort == 'asc':
-            return field.asc()
-        elif request.sort == 'desc':
-            return field.desc()
-        else:
-            raise RuntimeError('Should NOT have happened')
+
+class ExportMeasurementList(Controller):
+    """
+    Exports the measurements of the user's MeteringPoints as NDJSON or CSV,
+    filtered like /measurements. The export is streamed from the database
+    as it is written to the client, so it is not limited in size.
+    """
+    Request = md.class_schema(ExportMeasurementListRequest)
+
+    @requires_login
+    def handle_request(self, request, user):
+        """
+        :param ExportMeasurementListRequest request:
+        :param origin.auth.User user:
+        :rtype: flask.Response
+        """
+        return export_response(
+            lambda session: self.get_query(request, user, session),
+            request.format, 'measurements')
+
+    def get_query(self, request, user, session):
+        """
+        :param ExportMeasurementListRequest request:
+        :param origin.auth.User user:
+        :param sqlalchemy.orm.Session session:
+        :rtype: sqlalchemy.orm.Query
+        """
+        query = MeasurementQuery(session) \
+            .belongs_to(user)
+
+        if request.filters:
+            query = query.apply_filters(request.filters)
+
+        return query.get_export_query()
 
 
 class GetBeginRange(Controller):
@@ -0,0 +1,49 @@
+from sqlalchemy import func
+
+from origin.ggo.models import Ggo
+
+from .models import Measurement
+
+
+def get_retired_amount_errors(session):
+    """
+    Recomputes the amount retired to each measurement from GGOs, and
+    returns the measurements whose retired_amount counter differs, as a
+    list of (measurement ID, counted amount, actual amount).
+
+    :param sqlalchemy.orm.Session session:
+    :rtype: list[(int, int, int)]
+    """
+    retired = session \
+        .query(
+            Ggo.retire_measurement_id.label('measurement_id'),
+            func.sum(Ggo.amount).label('amount'),
+        ) \
+        .filter(Ggo.retired.is_(True)) \
+        .filter(Ggo.retire_measurement_id.isnot(None)) \
+        .group_by(Ggo.retire_measurement_id) \
+        .subquery()
+
+    actual = func.coalesce(retired.c.amount, 0)
+
+    q = session \
+        .query(Measurement.id, Measurement.retired_amount, actual) \
+        .outerjoin(retired, retired.c.measurement_id == Measurement.id) \
+        .filter(Measurement.retired_amount != actual) \
+        .order_by(Measurement.id)
+
+    return [tuple(row) for row in q]
+
+
+def fix_retired_amounts(session, errors):
+    """
+    Sets the retired_amount counters of the provided measurements to
+    their actual amounts (see get_retired_amount_errors()).
+
+    :param sqlalchemy.orm.Session session:
+    :param list[(int, int, int)] errors:
+    """
+    session.bulk_update_mappings(Measurement, [
+        {'id': id, 'retired_amount': actual}
+        for id, counted, actual in errors
+    ])
@@ -0,0 +1,73 @@
+import zlib
+import sqlalchemy as sa
+from datetime import timezone
+
+
+def get_retire_lock_key(subject, begin):
+    """
+    Returns the two 32-bit integers which identify the advisory lock on
+    the retire accounting of a subject at a specific begin (see
+    lock_retire_accounting()). Collisions are harmless; they only cause
+    unrelated keys to wait for each other.
+
+    :param str subject:
+    :param datetime.datetime begin:
+    :rtype: (int, int)
+    """
+    if begin.tzinfo is None:
+        begin = begin.replace(tzinfo=timezone.utc)
+
+    crc = zlib.crc32(subject.encode())
+    hours = int(begin.timestamp()) // 3600
+
+    return crc - (1 << 32) if crc >= (1 << 31) else crc, hours
+
+
+def lock_retire_accounting(session, keys, nowait=False):
+    """
+    Takes transaction-level advisory locks on the retire accounting
+    (consumption minus what has been retired to it) of the provided
+    (subject, begin) pairs, which are released when the transaction ends.
+
+    Anything which reads retired amounts to decide how much to retire
+    must hold the lock of the measurement owner's (subject, begin)
+    beforehand, so concurrent transactions can not retire the same
+    consumption twice. Unlike locking rows (ie. of the user), different
+    subjects or begins never wait for each other.
+
+    Locks are taken in a fixed order within each call, so transactions
+    which lock all the keys they need in a single call, before reading
+    any retired amounts, can not deadlock each other. Transactions which
+    lock keys in several calls can, in which case PostgreSQL aborts one
+    of them with a deadlock error.
+
+    :param sqlalchemy.orm.Session session:
+    :param collections.abc.Iterable[(str, datetime.datetime)] keys:
+    :param bool nowait: Fail rather than wait for locks held by others
+    :rtype: bool
+    :returns: Whether all locks were acquired (always true unless nowait)
+    """
+    lock_keys = sorted(set(get_retire_lock_key(*key) for key in keys))
+
+    if not lock_keys:
+        return True
+
+    params = {
+        'k1': [k1 for k1, k2 in lock_keys],
+        'k2': [k2 for k1, k2 in lock_keys],
+    }
+
+    if nowait:
+        return session.execute(sa.text(
+            'SELECT bool_and(pg_try_advisory_xact_lock(k1, k2)) '
+            'FROM unnest(CAST(:k1 AS integer[]), CAST(:k2 AS integer[])) '
+            'AS t(k1, k2)'
+        ), params).scalar()
+
+    session.execute(sa.text(
+        'SELECT pg_advisory_xact_lock(k1, k2) '
+        'FROM unnest(CAST(:k1 AS integer[]), CAST(:k2 AS integer[])) '
+        'AS t(k1, k2)'
+    ), params).fetchall()
+
+    return True
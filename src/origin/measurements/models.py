@@ -1,8 +1,10 @@
 import sqlalchemy as sa
+from enum import Enum
 from datetime import datetime
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
 
-from origin.db import ModelBase
+from origin.db import ModelBase, Session
 from origin.meteringpoints import MeteringPointType
 
 
@@ -32,8 +34,22 @@ class Measurement(ModelBase):
     end: datetime = sa.Column(sa.DateTime(timezone=True), nullable=False)
     amount = sa.Column(sa.Integer(), nullable=False)
 
+    # The total amount of GGOs retired to this measurement, maintained by
+    # RetireTransaction (see add_retired_amount())
+    retired_amount = sa.Column(sa.Integer(), nullable=False, default=0, server_default='0')
+
     meteringpoint = relationship('MeteringPoint', foreign_keys=[gsrn], lazy='joined')
 
+    @hybrid_property
+    def remaining_amount(self):
+        """
+        Returns the measured amount which GGOs have not yet been
+        retired to.
+
+        :rtype: int
+        """
+        return self.amount - self.retired_amount
+
     def __str__(self):
         return 'Measurement<%s>' % ', '.join((
             f'gsrn={self.gsrn}',
@@ -41,6 +57,23 @@ class Measurement(ModelBase):
             f'amount={self.amount}',
         ))
 
+    def add_retired_amount(self, amount):
+        """
+        Adds (or subtracts, if negative) to the amount retired to this
+        measurement. The counter is updated in the database immediately,
+        which locks the measurement's row until the transaction ends, so
+        concurrent retires to the same measurement are serialized.
+
+        :param int amount:
+        """
+        Session.object_session(self) \
+            .query(Measurement) \
+            .filter(Measurement.id == self.id) \
+            .update(
+                {Measurement.retired_amount: Measurement.retired_amount + amount},
+                synchronize_session='evaluate',
+            )
+
     @property
     def sub(self):
         """
@@ -98,3 +131,44 @@ class Measurement(ModelBase):
         :rtype: bool
         """
         return self.meteringpoint.type is MeteringPointType.PRODUCTION
+
+
+class MeasurementPeriod(Enum):
+    DAY = 'DAY'
+    MONTH = 'MONTH'
+
+
+class MeasurementRollup(ModelBase):
+    """
+    The total (and peak) amount measured by a MeteringPoint per day or
+    month (in UTC). Rollups are maintained as measurements are created
+    (see origin.measurements.rollups), and allows summaries to aggregate
+    days or months rather than hours.
+    """
+    __tablename__ = 'measurement_rollup'
+    __table_args__ = (
+        sa.UniqueConstraint('gsrn', 'period', 'begin'),
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True, index=True)
+    gsrn = sa.Column(sa.String(), sa.ForeignKey('meteringpoint.gsrn'), nullable=False)
+    period = sa.Column(sa.Enum(MeasurementPeriod), nullable=False)
+    begin = sa.Column(sa.Date(), nullable=False)
+    amount = sa.Column(sa.BigInteger(), nullable=False)
+    peak = sa.Column(sa.Integer(), nullable=False)
+
+
+class MeasurementStats(ModelBase):
+    """
+    Statistics of all measurements of a MeteringPoint, maintained as
+    measurements are created (see origin.measurements.rollups).
+    """
+    __tablename__ = 'measurement_stats'
+
+    gsrn = sa.Column(sa.String(), sa.ForeignKey('meteringpoint.gsrn'), primary_key=True)
+    first_begin = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    last_begin = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    count = sa.Column(sa.Integer(), nullable=False)
+    amount = sa.Column(sa.BigInteger(), nullable=False)
+    peak_amount = sa.Column(sa.Integer(), nullable=False)
+    peak_begin = sa.Column(sa.DateTime(timezone=True), nullable=False)
@@ -1,17 +1,17 @@
 import sqlalchemy as sa
 from sqlalchemy import func, bindparam, text
 from datetime import datetime, timezone
-from itertools import groupby
 from functools import lru_cache
 from sqlalchemy.orm import joinedload
 
 from origin.db import SqlQuery
-from origin.ggo.models import Ggo
-from origin.common import LabelRange
+from origin.common.summary import ColumnarSummary
 from origin.meteringpoints import MeteringPoint, MeteringPointType
 
 from .models import Measurement
-from .schemas import MeasurementFilters, SummaryResolution, SummaryGroup
+from .rollups import MeasurementFilter, get_rollup_source, \
+    get_peak_measurement, get_begin_range, get_count
+from .schemas import MeasurementFilters, SummaryResolution
 
 
 class MeasurementQuery(SqlQuery):
@@ -50,7 +50,7 @@ class MeasurementQuery(SqlQuery):
         :param MeasurementFilters filters:
         :rtype: MeasurementQuery
         """
-        q = self.q
+        q = self.query
 
         if filters.gsrn:
             q = q.filter(Measurement.gsrn.in_(filters.gsrn))
@@ -89,6 +89,18 @@ class MeasurementQuery(SqlQuery):
             Measurement.begin == begin.astimezone(timezone.utc),
         ))
 
+    def begins_at_any(self, begins):
+        """
+        Only include measurements which begins at any of the
+        provided datetimes.
+
+        :param list[datetime] begins:
+        :rtype: MeasurementQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            Measurement.begin.in_([b.astimezone(timezone.utc) for b in begins]),
+        ))
+
     def begins_within(self, begin_range):
         """
         Only include measurements which begins within the provided datetime
@@ -165,6 +177,36 @@ class MeasurementQuery(SqlQuery):
         """
         return self.is_type(MeteringPointType.CONSUMPTION)
 
+    def get_with_retired_amount(self):
+        """
+        Returns all Measurements in the result set along with the total
+        amount of GGOs retired to each of them.
+
+        :rtype: list[(Measurement, int)]
+        """
+        return self.query \
+            .add_columns(Measurement.retired_amount) \
+            .all()
+
+    def get_hourly_retired_amount(self):
+        """
+        Returns the total measured amount and the total amount of GGOs
+        retired to the Measurements in the result set, per begin (ordered
+        by begin), using a single aggregated query.
+
+        :rtype: list[(datetime, int, int)]
+        """
+        return self.query \
+            .enable_eagerloads(False) \
+            .with_entities(
+                Measurement.begin,
+                func.sum(Measurement.amount),
+                func.sum(Measurement.retired_amount),
+            ) \
+            .group_by(Measurement.begin) \
+            .order_by(Measurement.begin.asc()) \
+            .all()
+
     def get_distinct_begins(self):
         """
         Returns a list of all distinct Measurement.begin in the result set.
@@ -174,12 +216,46 @@ class MeasurementQuery(SqlQuery):
         return [row[0] for row in self.session.query(
             self.query.subquery().c.begin.distinct())]
 
+    def get_count(self):
+        """
+        Returns the number of measurements in the result set, counted
+        from MeasurementStats if not filtering on begin.
+
+        :rtype: int
+        """
+        f = MeasurementFilter.from_query(self)
+
+        if f is not None and not f.has_begin:
+            return get_count(self, f)
+
+        return self.query.count()
+
+    def get_estimated_count(self):
+        """
+        Returns the number of measurements in the result set, counted
+        from MeasurementStats if not filtering on begin, otherwise the
+        query planner's estimate.
+
+        :rtype: int
+        """
+        f = MeasurementFilter.from_query(self)
+
+        if f is not None and not f.has_begin:
+            return get_count(self, f)
+
+        return super(MeasurementQuery, self).get_estimated_count()
+
     def get_first_measured_begin(self):
         """
         Returns the first Measurement.begin in the result set.
 
         :rtype: datetime
         """
+        f = MeasurementFilter.from_query(self)
+
+        if f is not None and not f.has_begin:
+            return get_begin_range(self, f)[0]
+
         return self.session.query(
             func.min(self.query.subquery().c.begin)).scalar()
 
@@ -189,9 +265,30 @@ class MeasurementQuery(SqlQuery):
 
         :rtype: datetime
         """
+        f = MeasurementFilter.from_query(self)
+
+        if f is not None and not f.has_begin:
+            return get_begin_range(self, f)[1]
+
         return self.session.query(
             func.max(self.query.subquery().c.begin)).scalar()
 
+    def get_peak_measurement(self):
+        """
+        Returns the Measurement with the highest amount in the result set.
+
+        :rtype: Measurement | None
+        """
+        f = MeasurementFilter.from_query(self)
+
+        if f is not None:
+            return get_peak_measurement(self, f)
+
+        return self.query \
+            .order_by(Measurement.amount.desc()) \
+            .limit(1) \
+            .one_or_none()
+
     def get_summary(self, resolution, grouping, utc_offset=0):
         """
         Returns a summary of the result set.
@@ -204,15 +301,35 @@ class MeasurementQuery(SqlQuery):
         return MeasurementSummary(
             self.session, self, resolution, grouping, utc_offset)
 
+    def get_export_query(self):
+        """
+        Returns the result set as rows of columns ordered by begin,
+        for exporting (see export_response()).
+
+        :rtype: sa.orm.Query
+        """
+        return self.query \
+            .enable_eagerloads(False) \
+            .with_entities(
+                Measurement.gsrn.label('gsrn'),
+                Measurement.begin.label('begin'),
+                Measurement.end.label('end'),
+                Measurement.amount.label('amount'),
+                MeteringPoint.sector.label('sector'),
+                MeteringPoint.type.label('type'),
+            ) \
+            .order_by(Measurement.begin.asc(), Measurement.gsrn.asc())
+
 
-class MeasurementSummary(object):
+class MeasurementSummary(ColumnarSummary):
     """
     Implements a summary/aggregation of measurements.
 
     Provided a MeasurementQuery, this class compiles together a list of
     SummaryGroups, where each group is defined by the "grouping" parameter.
     The aggregated data is based on the result set of the query provided.
-    It essentially works by wrapping a SQL "GROUP BY" statement.
+    It essentially works by wrapping a SQL "GROUP BY" statement, which is
+    pivoted into one row per group in SQL (see ColumnarSummary).
 
     The parameter "resolution" defined the returned data resolution.
     Call .fill() before accessing .labels or .groups to fill gaps in data.
@@ -224,14 +341,8 @@ class MeasurementSummary(object):
         'sector',
     )
 
-    RESOLUTIONS_POSTGRES = {
-        SummaryResolution.hour: 'YYYY-MM-DD HH24:00',
-        SummaryResolution.day: 'YYYY-MM-DD',
-        SummaryResolution.month: 'YYYY-MM',
-        SummaryResolution.year: 'YYYY',
-    }
-
-    ALL_TIME_LABEL = 'All-time'
+    # Labels exclude the end of the fill range (like LabelRange)
+    FILL_INCLUDES_END = False
 
     def __init__(self, session, query, resolution, grouping, utc_offset=0):
         """
@@ -254,51 +365,60 @@ class MeasurementSummary(object):
         :rtype: MeasurementSummary
         """
         self.fill_range = fill_range
+        self._pivoted_results = None
         return self
 
-    @property
-    def labels(self):
+    def get_source(self):
         """
-        :rtype list[str]:
-        """
-        if self.resolution == SummaryResolution.all:
-            return [self.ALL_TIME_LABEL]
-        if self.fill_range is None:
-            return sorted(set(label for label, *g, amount in self.raw_results))
-        else:
-            return list(LabelRange(
-                self.fill_range.begin,
-                self.fill_range.end,
-                self.resolution,
-            ))
+        Returns the measurements to summarize as a subquery, read from
+        rollups where possible (see get_rollup_source()). Rollups are per
+        (UTC) day and month, so they can only be used when labels span
+        whole days.
 
-    @property
-    def groups(self):
-        """
-        :rtype list[SummaryGroup]:
+        :rtype: sqlalchemy.sql.Subquery
         """
-        groups = []
+        if self.resolution == SummaryResolution.all \
+                or (self.resolution != SummaryResolution.hour
+                    and (self.utc_offset or 0) % 24 == 0):
+            # Shifting a month by whole days can move days into another
+            # month, which shifting each of its days does not
+            months = self.resolution != SummaryResolution.day \
+                and not self.utc_offset
+
+            source = get_rollup_source(self.query, months=months)
 
-        for group, results in groupby(self.raw_results, lambda x: x[1:-1]):
-            items = {label: amount for label, *g, amount in results}
-            groups.append(SummaryGroup(
-                group=group,
-                values=[items.get(label, None) for label in self.labels],
-            ))
+            if source is not None:
+                return source
 
-        return groups
+        return self.query.query \
+            .enable_eagerloads(False) \
+            .with_entities(
+                Measurement.begin.label('begin'),
+                Measurement.gsrn.label('gsrn'),
+                MeteringPoint.type.label('type'),
+                MeteringPoint.sector.label('sector'),
+                Measurement.amount.label('amount'),
+            ).subquery()
 
     @property
     @lru_cache()
     def raw_results(self):
         """
-        TODO
+        :rtype: list[tuple]
+        """
+        return self.get_results(self.get_query())
+
+    def get_query(self):
+        """
+        Returns the summary query with the columns (label, *group, amount).
+
+        :rtype: sqlalchemy.orm.Query
         """
         select = []
         groups = []
         orders = []
 
-        q = self.query.subquery()
+        q = self.get_source()
 
         # -- Resolution ------------------------------------------------------
 
@@ -333,10 +453,9 @@ class MeasurementSummary(object):
 
         # -- Query ---------------------------------------------------------------
 
-        select.append(func.sum(q.c.amount))
+        select.append(sa.cast(func.sum(q.c.amount), sa.BigInteger()))
 
         return self.session \
             .query(*select) \
             .group_by(*groups) \
-            .order_by(*orders) \
-            .all()
+            .order_by(*orders)
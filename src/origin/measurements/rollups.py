@@ -0,0 +1,564 @@
+import sqlalchemy as sa
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.dialects.postgresql import insert
+
+from origin.meteringpoints import MeteringPoint
+
+from .models import (
+    Measurement,
+    MeasurementPeriod,
+    MeasurementRollup,
+    MeasurementStats,
+)
+
+
+def get_day(dt):
+    """
+    :param datetime dt:
+    :rtype: date
+    """
+    return dt.astimezone(timezone.utc).date()
+
+
+def get_month(day):
+    """
+    :param date day:
+    :rtype: date
+    """
+    return day.replace(day=1)
+
+
+def get_next_month(day):
+    """
+    :param date day:
+    :rtype: date
+    """
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def get_midnight(day):
+    """
+    :param date day:
+    :rtype: datetime
+    """
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+# -- Maintaining rollups -----------------------------------------------------
+
+
+def apply_measurements(session, rollups, stats):
+    """
+    Adds the collected amounts to the rollups and stats, creating them
+    as necessary.
+
+    :param sqlalchemy.orm.Session session:
+    :param dict[tuple, list] rollups: {(gsrn, period, begin): [amount, peak]}
+    :param dict[str, list] stats: {gsrn: [first_begin, last_begin, count,
+        amount, peak_amount, peak_begin]}
+    """
+    # Sorted, so concurrent transactions lock rows in the same order
+    if rollups:
+        table = MeasurementRollup.__table__
+        statement = insert(table).values([
+            {'gsrn': gsrn, 'period': period, 'begin': begin,
+             'amount': amount, 'peak': peak}
+            for (gsrn, period, begin), (amount, peak) in sorted(rollups.items())
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=('gsrn', 'period', 'begin'),
+            set_={
+                'amount': table.c.amount + statement.excluded.amount,
+                'peak': func.greatest(table.c.peak, statement.excluded.peak),
+            },
+        )
+        session.execute(statement)
+
+    if stats:
+        table = MeasurementStats.__table__
+        statement = insert(table).values([
+            dict(zip(('first_begin', 'last_begin', 'count', 'amount',
+                      'peak_amount', 'peak_begin'), values), gsrn=gsrn)
+            for gsrn, values in sorted(stats.items())
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=('gsrn',),
+            set_={
+                'first_begin': func.least(table.c.first_begin, statement.excluded.first_begin),
+                'last_begin': func.greatest(table.c.last_begin, statement.excluded.last_begin),
+                'count': table.c.count + statement.excluded.count,
+                'amount': table.c.amount + statement.excluded.amount,
+                'peak_amount': func.greatest(table.c.peak_amount, statement.excluded.peak_amount),
+                'peak_begin': sa.case(
+                    (statement.excluded.peak_amount > table.c.peak_amount,
+                     statement.excluded.peak_begin),
+                    else_=table.c.peak_begin,
+                ),
+            },
+        )
+        session.execute(statement)
+
+
+def rebuild_rollups(session):
+    """
+    Rebuilds all measurement rollups and stats from the measurements in
+    the database. Changes to them (by other transactions) are blocked
+    until the session's transaction ends, while reading them is not.
+
+    :param sqlalchemy.orm.Session session:
+    :rtype: int
+    :returns: The number of rollups
+    """
+    rollups = MeasurementRollup.__table__
+    stats = MeasurementStats.__table__
+
+    session.execute(sa.text(
+        'LOCK TABLE measurement_rollup, measurement_stats IN EXCLUSIVE MODE'))
+    session.execute(rollups.delete())
+    session.execute(stats.delete())
+
+    for period, begin in ((MeasurementPeriod.DAY, 'day'),
+                          (MeasurementPeriod.MONTH, 'month')):
+        begin = sa.cast(func.date_trunc(
+            begin, func.timezone('UTC', Measurement.begin)), sa.Date)
+
+        session.execute(rollups.insert().from_select(
+            ('gsrn', 'period', 'begin', 'amount', 'peak'),
+            sa.select(
+                Measurement.gsrn,
+                sa.cast(sa.literal(period.name), rollups.c.period.type),
+                begin,
+                func.sum(Measurement.amount),
+                func.max(Measurement.amount),
+            ).group_by(Measurement.gsrn, begin),
+        ))
+
+    # The begin of the (first) peak measurement per GSRN
+    peaks = sa.select(
+        Measurement.gsrn,
+        Measurement.begin,
+    ).distinct(Measurement.gsrn) \
+        .order_by(Measurement.gsrn, Measurement.amount.desc(), Measurement.begin) \
+        .subquery()
+
+    totals = sa.select(
+        Measurement.gsrn,
+        func.min(Measurement.begin).label('first_begin'),
+        func.max(Measurement.begin).label('last_begin'),
+        func.count().label('count'),
+        func.sum(Measurement.amount).label('amount'),
+        func.max(Measurement.amount).label('peak_amount'),
+    ).group_by(Measurement.gsrn).subquery()
+
+    session.execute(stats.insert().from_select(
+        ('gsrn', 'first_begin', 'last_begin', 'count', 'amount',
+         'peak_amount', 'peak_begin'),
+        sa.select(
+            totals.c.gsrn,
+            totals.c.first_begin,
+            totals.c.last_begin,
+            totals.c.count,
+            totals.c.amount,
+            totals.c.peak_amount,
+            peaks.c.begin,
+        ).join(peaks, peaks.c.gsrn == totals.c.gsrn),
+    ))
+
+    return session.query(MeasurementRollup).count()
+
+
+# -- Reading rollups ---------------------------------------------------------
+
+
+class MeasurementFilter(object):
+    """
+    The filters of a MeasurementQuery, if all of them can be applied to
+    MeasurementRollups and MeasurementStats. Filters on MeteringPoint
+    (ie. belongs_to(), is_type(), and sector) are applied as-is, while
+    filters on GSRN and begin are translated.
+    """
+
+    def __init__(self):
+        self.meteringpoint = []
+        self.gsrn = None
+        self.begin_from = None
+        self.begin_to = None
+
+    @classmethod
+    def from_query(cls, query):
+        """
+        :param origin.measurements.MeasurementQuery query:
+        :rtype: MeasurementFilter | None
+        """
+        f = cls()
+
+        for clause in cls.flatten(query.query.whereclause):
+            if not f.add(clause):
+                return None
+
+        return f
+
+    @classmethod
+    def flatten(cls, clause):
+        """
+        Yields the clauses of an AND expression.
+        """
+        if clause is None:
+            return
+        elif isinstance(clause, sa.sql.elements.BooleanClauseList) \
+                and clause.operator is operators.and_:
+            for c in clause.clauses:
+                yield from cls.flatten(c)
+        else:
+            yield clause
+
+    @staticmethod
+    def is_column(expr, name):
+        return isinstance(expr, sa.Column) \
+            and expr.table is Measurement.__table__ \
+            and expr.key == name
+
+    def add(self, clause):
+        """
+        :rtype: bool
+        :returns: Whether the clause can be applied to rollups
+        """
+        tables = set(
+            c.table for c in sa.sql.visitors.iterate(clause)
+            if isinstance(c, sa.Column)
+        )
+
+        if tables == {MeteringPoint.__table__}:
+            self.meteringpoint.append(clause)
+            return True
+        elif not isinstance(clause, sa.sql.elements.BinaryExpression) \
+                or not isinstance(clause.right, sa.sql.elements.BindParameter):
+            return False
+
+        op, value = clause.operator, clause.right.effective_value
+
+        if self.is_column(clause.left, 'gsrn') and self.gsrn is None:
+            if op is operators.eq:
+                self.gsrn = [value]
+                return True
+            elif op is operators.in_op:
+                self.gsrn = list(value)
+                return True
+
+        elif self.is_column(clause.left, 'begin'):
+            if op is operators.ge and self.begin_from is None:
+                self.begin_from = value
+                return True
+            elif op is operators.le and self.begin_to is None:
+                self.begin_to = value
+                return True
+
+        return False
+
+    @property
+    def has_begin(self):
+        return self.begin_from is not None or self.begin_to is not None
+
+    def get_days(self):
+        """
+        Returns the range of whole days (first_day <= day < last_day)
+        within the begin filters, either of which can be None (unbounded).
+
+        :rtype: (date, date)
+        """
+        first_day = last_day = None
+
+        if self.begin_from is not None:
+            first_day = get_day(self.begin_from)
+            if get_midnight(first_day) < self.begin_from:
+                first_day += timedelta(days=1)
+
+        if self.begin_to is not None:
+            last_day = get_day(self.begin_to)
+
+        return first_day, last_day
+
+    def get_conditions(self, model):
+        """
+        Returns the filters as applied to a model with a "gsrn" column
+        (joined with MeteringPoint).
+        """
+        conditions = list(self.meteringpoint)
+
+        if self.gsrn is not None:
+            conditions.append(model.gsrn.in_(self.gsrn))
+
+        return conditions
+
+
+def get_rollups(f, period, first, last):
+    """
+    Returns rollups of the provided period beginning within
+    "first <= begin < last" (either of which can be None).
+    """
+    conditions = f.get_conditions(MeasurementRollup)
+    conditions.append(MeasurementRollup.period == period)
+
+    if first is not None:
+        conditions.append(MeasurementRollup.begin >= first)
+    if last is not None:
+        conditions.append(MeasurementRollup.begin < last)
+
+    return sa.select(
+        func.timezone('UTC', sa.cast(MeasurementRollup.begin, sa.DateTime())).label('begin'),
+        MeasurementRollup.gsrn.label('gsrn'),
+        MeteringPoint.type.label('type'),
+        MeteringPoint.sector.label('sector'),
+        MeasurementRollup.amount.label('amount'),
+    ).join(MeteringPoint, MeteringPoint.gsrn == MeasurementRollup.gsrn) \
+        .where(*conditions)
+
+
+def get_rollup_source(query, months):
+    """
+    Returns a subquery of the measurements in the result set of the
+    provided query with the columns begin, gsrn, type, sector, and amount,
+    reading whole months (if "months" is True) and whole days from rollups
+    (with begin at midnight UTC on the first day of the period), and the
+    rest (partial days) from the query itself. Returns None if the query
+    has filters which can not be applied to rollups.
+
+    :param origin.measurements.MeasurementQuery query:
+    :param bool months: Whether to read monthly rollups
+    :rtype: sqlalchemy.sql.Subquery | None
+    """
+    f = MeasurementFilter.from_query(query)
+
+    if f is None:
+        return None
+
+    first_day, last_day = f.get_days()
+
+    if first_day is not None and last_day is not None \
+            and first_day >= last_day:
+        return None
+
+    parts = []
+
+    if not months:
+        parts.append(get_rollups(f, MeasurementPeriod.DAY, first_day, last_day))
+    else:
+        first_month = last_month = None
+
+        if first_day is not None:
+            first_month = get_month(first_day)
+            if first_month < first_day:
+                first_month = get_next_month(first_day)
+
+        if last_day is not None:
+            last_month = get_month(last_day)
+
+        if first_month is not None and last_month is not None \
+                and first_month >= last_month:
+            parts.append(get_rollups(f, MeasurementPeriod.DAY, first_day, last_day))
+        else:
+            parts.append(get_rollups(f, MeasurementPeriod.MONTH, first_month, last_month))
+            if first_day is not None and first_day < first_month:
+                parts.append(get_rollups(f, MeasurementPeriod.DAY, first_day, first_month))
+            if last_day is not None and last_month < last_day:
+                parts.append(get_rollups(f, MeasurementPeriod.DAY, last_month, last_day))
+
+    remainder = []
+
+    if first_day is not None:
+        remainder.append(Measurement.begin < get_midnight(first_day))
+    if last_day is not None:
+        remainder.append(Measurement.begin >= get_midnight(last_day))
+
+    for condition in remainder:
+        parts.append(query
+                     .filter(condition)
+                     .query
+                     .enable_eagerloads(False)
+                     .with_entities(
+                         Measurement.begin.label('begin'),
+                         Measurement.gsrn.label('gsrn'),
+                         MeteringPoint.type.label('type'),
+                         MeteringPoint.sector.label('sector'),
+                         Measurement.amount.label('amount'),
+                     ).statement)
+
+    return sa.union_all(*parts).subquery()
+
+
+def get_peak_measurement(query, f):
+    """
+    Returns the Measurement with the highest amount in the result set of
+    the provided query, finding the (UTC) day it was measured from
+    rollups, or the GSRN and begin from stats if not filtering on begin.
+
+    :param origin.measurements.MeasurementQuery query:
+    :param MeasurementFilter f:
+    :rtype: Measurement | None
+    """
+    if not f.has_begin:
+        peak = query.session \
+            .query(MeasurementStats.gsrn, MeasurementStats.peak_begin) \
+            .join(MeteringPoint, MeteringPoint.gsrn == MeasurementStats.gsrn) \
+            .filter(*f.get_conditions(MeasurementStats)) \
+            .order_by(MeasurementStats.peak_amount.desc()) \
+            .first()
+
+        if peak is None:
+            return None
+
+        return query \
+            .filter(Measurement.gsrn == peak.gsrn) \
+            .filter(Measurement.begin == peak.peak_begin) \
+            .one_or_none()
+
+    first_day, last_day = f.get_days()
+    candidates = []
+
+    if first_day is None or last_day is None or first_day < last_day:
+        conditions = f.get_conditions(MeasurementRollup)
+        conditions.append(MeasurementRollup.period == MeasurementPeriod.DAY)
+        if first_day is not None:
+            conditions.append(MeasurementRollup.begin >= first_day)
+        if last_day is not None:
+            conditions.append(MeasurementRollup.begin < last_day)
+
+        peak = query.session \
+            .query(MeasurementRollup.gsrn, MeasurementRollup.begin, MeasurementRollup.peak) \
+            .join(MeteringPoint, MeteringPoint.gsrn == MeasurementRollup.gsrn) \
+            .filter(*conditions) \
+            .order_by(MeasurementRollup.peak.desc()) \
+            .first()
+
+        if peak is not None:
+            candidates.append(query
+                              .filter(Measurement.gsrn == peak.gsrn)
+                              .filter(Measurement.begin >= get_midnight(peak.begin))
+                              .filter(Measurement.begin < get_midnight(peak.begin + timedelta(days=1)))
+                              .filter(Measurement.amount == peak.peak)
+                              .first())
+
+        remainder = []
+        if first_day is not None:
+            remainder.append(Measurement.begin < get_midnight(first_day))
+        if last_day is not None:
+            remainder.append(Measurement.begin >= get_midnight(last_day))
+    else:
+        remainder = [sa.true()]
+
+    for condition in remainder:
+        candidates.append(query
+                          .filter(condition)
+                          .order_by(Measurement.amount.desc())
+                          .first())
+
+    candidates = [m for m in candidates if m is not None]
+
+    if candidates:
+        return max(candidates, key=lambda m: m.amount)
+    return None
+
+
+def get_begin_range(query, f):
+    """
+    Returns the first and last begin of measurements in the result set
+    of the provided query from stats. Only possible if not filtering on
+    begin (see MeasurementFilter.has_begin).
+
+    :param origin.measurements.MeasurementQuery query:
+    :param MeasurementFilter f:
+    :rtype: (datetime, datetime)
+    """
+    assert not f.has_begin
+
+    return query.session \
+        .query(func.min(MeasurementStats.first_begin), func.max(MeasurementStats.last_begin)) \
+        .join(MeteringPoint, MeteringPoint.gsrn == MeasurementStats.gsrn) \
+        .filter(*f.get_conditions(MeasurementStats)) \
+        .one()
+
+
+def get_count(query, f):
+    """
+    Returns the number of measurements in the result set of the provided
+    query from stats. Only possible if not filtering on begin (see
+    MeasurementFilter.has_begin).
+
+    :param origin.measurements.MeasurementQuery query:
+    :param MeasurementFilter f:
+    :rtype: int
+    """
+    assert not f.has_begin
+
+    count = query.session \
+        .query(func.sum(MeasurementStats.count)) \
+        .join(MeteringPoint, MeteringPoint.gsrn == MeasurementStats.gsrn) \
+        .filter(*f.get_conditions(MeasurementStats)) \
+        .scalar()
+
+    return int(count or 0)
+
+
+# -- Events ------------------------------------------------------------------
+
+
+SESSION_KEY = 'measurement_rollups'
+
+
+@sa.event.listens_for(Session, 'after_flush')
+def on_after_flush(session, flush_context):
+    """
+    Collects the measurements inserted (by create_measurement(), which
+    is also used when importing measurements in bulk). Measurements are
+    never updated or deleted.
+    """
+    measurements = [obj for obj in session.new if isinstance(obj, Measurement)]
+
+    if not measurements:
+        return
+
+    rollups, stats = session.info.setdefault(SESSION_KEY, ({}, {}))
+
+    for m in measurements:
+        day = get_day(m.begin)
+
+        for key in ((m.gsrn, MeasurementPeriod.DAY.name, day),
+                    (m.gsrn, MeasurementPeriod.MONTH.name, get_month(day))):
+            rollup = rollups.setdefault(key, [0, m.amount])
+            rollup[0] += m.amount
+            rollup[1] = max(rollup[1], m.amount)
+
+        s = stats.get(m.gsrn)
+
+        if s is None:
+            stats[m.gsrn] = [m.begin, m.begin, 1, m.amount, m.amount, m.begin]
+        else:
+            s[0] = min(s[0], m.begin)
+            s[1] = max(s[1], m.begin)
+            s[2] += 1
+            s[3] += m.amount
+            if m.amount > s[4]:
+                s[4] = m.amount
+                s[5] = m.begin
+
+
+@sa.event.listens_for(Session, 'before_commit')
+def on_before_commit(session):
+    """
+    Applies the collected measurements to rollups and stats, as part of
+    the transaction.
+    """
+    session.flush()
+
+    collected = session.info.pop(SESSION_KEY, None)
+
+    if collected:
+        apply_measurements(session, *collected)
+
+
+@sa.event.listens_for(Session, 'after_rollback')
+def on_after_rollback(session):
+    session.info.pop(SESSION_KEY, None)
@@ -5,7 +5,8 @@ from marshmallow import validate, validates_schema, ValidationError, post_load
 
 from origin.validators import unique_values
 from origin.meteringpoints import MeteringPointType
-from origin.common import DateTimeRange, SummaryResolution, SummaryGroup
+from origin.common import DateTimeRange, SummaryResolution, SummaryGroup, \
+    ExportFormat, TotalCount
 
 
 @dataclass
@@ -73,6 +74,11 @@ class GetMeasurementListRequest:
     order: str = field(default='begin', metadata=dict(validate=validate.OneOf(['begin', 'amount'])))
     sort: str = field(default='asc', metadata=dict(validate=validate.OneOf(['asc', 'desc'])))
 
+    # The "nextCursor" of the previous page, if any
+    cursor: str = field(default=None)
+
+    total: TotalCount = field(default=TotalCount.EXACT, metadata=dict(by_value=True))
+
     @post_load
     def apply_time_offset(self, data, **kwargs):
         """
@@ -101,8 +107,46 @@ class GetMeasurementListRequest:
 @dataclass
 class GetMeasurementListResponse:
     success: bool
-    total: int
+    total: int = field(default=None)
     measurements: List[MappedMeasurement] = field(default_factory=list)
+    next_cursor: str = field(default=None, metadata=dict(data_key='nextCursor'))
+
+
+# -- ExportMeasurementList request -------------------------------------------
+
+
+@dataclass
+class ExportMeasurementListRequest:
+
+    # Offset from UTC in hours
+    utc_offset: int = field(metadata=dict(required=False, missing=0, data_key='utcOffset'))
+
+    filters: MeasurementFilters = field(default=None)
+    format: ExportFormat = field(default=ExportFormat.NDJSON, metadata=dict(by_value=True))
+
+    @post_load
+    def apply_time_offset(self, data, **kwargs):
+        """
+        Applies the request utcOffset to filters.begin and filters.begin_range
+        if they don't already have a UTC offset applied to them by the client.
+        """
+        tzinfo = timezone(timedelta(hours=data['utc_offset']))
+
+        if data.get('filters') is not None:
+            if data['filters'].begin and data['filters'].begin.utcoffset() is None:
+                data['filters'].begin = \
+                    data['filters'].begin.replace(tzinfo=tzinfo)
+
+            if data['filters'].begin_range:
+                if data['filters'].begin_range.begin.utcoffset() is None:
+                    data['filters'].begin_range.begin = \
+                        data['filters'].begin_range.begin.replace(tzinfo=tzinfo)
+
+                if data['filters'].begin_range.end.utcoffset() is None:
+                    data['filters'].begin_range.end = \
+                        data['filters'].begin_range.end.replace(tzinfo=tzinfo)
+
+        return data
 
 
 # -- GetBeginRange request and response --------------------------------------
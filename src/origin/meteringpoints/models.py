@@ -91,6 +91,15 @@ class MeteringPoint(ModelBase):
         """
         return self.type is MeteringPointType.CONSUMPTION
 
+    def is_eligible_to_retire(self, ggo):
+        """
+        In-memory equivalent of MeteringPointQuery.is_eligible_to_retire().
+
+        :param Ggo ggo:
+        :rtype: bool
+        """
+        return self.is_consumer() and self.sector == ggo.sector
+
     @property
     def technology_label(self):
         """
@@ -80,6 +80,18 @@ class MeteringPointQuery(SqlQuery):
             MeteringPoint.subject == user.subject,
         ))
 
+    def belongs_to_any(self, subjects):
+        """
+        Only include meteringpoints which belong to any of the users
+        identified by the provided subjects.
+
+        :param list[str] subjects:
+        :rtype: MeteringPointQuery
+        """
+        return self.__class__(self.session, self.query.filter(
+            MeteringPoint.subject.in_(subjects),
+        ))
+
     def has_public_id(self, public_id):
         """
         :param str public_id:
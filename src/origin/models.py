@@ -1,9 +1,10 @@
 from .agreements import TradeAgreement, AgreementState, AgreementDirection
 from .auth import User
-from .ggo import Ggo, Batch, Transaction, SplitTransaction, SplitTarget, RetireTransaction
-from .measurements import Measurement
+from .ggo import Ggo, Batch, Transaction, SplitTransaction, SplitTarget, Transfer, RetireTransaction, PendingConsumption, SummaryVersion, GgoRollup
+from .measurements import Measurement, MeasurementRollup, MeasurementStats
 from .meteringpoints import MeteringPoint, MeteringPointTag
 from .technologies import Technology
+from .facilities import RetireBackInTimeJob, RetireBackInTimeCheckpoint
 
 # This is a list of all database models to include when creating
 # database migrations.
@@ -18,9 +19,17 @@ VERSIONED_DB_MODELS = (
     Transaction,
     SplitTransaction,
     SplitTarget,
+    Transfer,
     RetireTransaction,
+    PendingConsumption,
+    SummaryVersion,
+    GgoRollup,
     Measurement,
+    MeasurementRollup,
+    MeasurementStats,
     MeteringPoint,
     MeteringPointTag,
     Technology,
+    RetireBackInTimeJob,
+    RetireBackInTimeCheckpoint,
 )
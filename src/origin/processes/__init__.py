@@ -1 +1,10 @@
-from .import_measurements import create_measurement
+from .import_measurements import \
+    create_measurement, get_ggos_awaiting_consumption, handle_ggos_received
+from .consume_ggos import consume_ggos_bulk, consume_stored_ggos
+from .pending import enqueue_consumption, run_consumption_worker
+from .tracing import ConsumptionTracer
+from .retire_back_in_time import (
+    create_retire_back_in_time_job,
+    run_retire_back_in_time_job,
+    run_retire_back_in_time_worker,
+)
@@ -0,0 +1,268 @@
+"""
+Benchmarks of the consumption path, run against the configured database.
+
+Each benchmark seeds the data it needs in a single transaction, which is
+rolled back afterwards, so nothing is written to the database.
+"""
+import time
+from uuid import uuid4
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+
+from origin.db import make_session
+from origin.auth import User
+from origin.config import GGO_ISSUE_INTERVAL
+from origin.common import Unit
+from origin.agreements import TradeAgreement, AgreementState
+from origin.meteringpoints import MeteringPoint, MeteringPointType
+from origin.ggo import Ggo, GgoQuery, GgoAggregateQuery
+
+from .tracing import ConsumptionTracer
+from .consume_ggos import handle_ggo_received
+from .import_measurements import create_measurement
+
+
+@dataclass
+class RemainingConsumptionResult:
+    """
+    Statements issued consuming GGOs via an agreement limited to the
+    recipient's consumption, with "facilities" recipient facilities,
+    in total and by the agreement's consumer.
+    """
+    facilities: int
+    ggos: int
+    statements: int
+    consumer_statements: int
+    seconds: float
+
+
+@dataclass
+class AggregateQueryResult:
+    """
+    Wall time spent by a consumption path lookup, using either
+    GgoQuery (before) or GgoAggregateQuery (after).
+    """
+    lookup: str
+    count: int
+    before: float
+    after: float
+
+
+@dataclass
+class Seed:
+    """
+    Data seeded by seed_limited_agreement().
+    """
+    owner: User
+    recipient: User
+    facilities: list
+    ggos: list
+
+
+def seed_limited_agreement(session, facilities, hours):
+    """
+    Seeds an owner producing a GGO every hour for the past "hours" hours,
+    and an agreement to transfer them to a recipient, limited to the
+    recipient's consumption. The recipient has "facilities" consumption
+    MeteringPoints with consumption measured every hour.
+
+    The GGOs are issued (and stored), but not consumed.
+
+    :param sqlalchemy.orm.Session session:
+    :param int facilities:
+    :param int hours:
+    :rtype: Seed
+    """
+    tag = str(uuid4())
+    end = datetime.now(tz=timezone.utc).replace(minute=0, second=0, microsecond=0)
+    begins = [end - GGO_ISSUE_INTERVAL * (i + 1) for i in reversed(range(hours))]
+
+    owner, recipient = (
+        User(
+            subject=f'{tag}-{name}',
+            email=f'{tag}-{name}@benchmark.local',
+            password='',
+            name=f'Benchmark {name}',
+            company='Benchmark',
+        )
+        for name in ('owner', 'recipient')
+    )
+
+    producer = MeteringPoint(
+        user=owner,
+        gsrn=f'{tag}-p',
+        type=MeteringPointType.PRODUCTION,
+        sector='DK1',
+        tech_code='T010101',
+        fuel_code='F01010101',
+    )
+
+    consumers = [
+        MeteringPoint(
+            user=recipient,
+            gsrn=f'{tag}-c-{i}',
+            type=MeteringPointType.CONSUMPTION,
+            sector='DK1',
+            retiring_priority=i,
+        )
+        for i in range(facilities)
+    ]
+
+    agreement = TradeAgreement(
+        user_proposed=owner,
+        user_from=owner,
+        user_to=recipient,
+        state=AgreementState.ACCEPTED,
+        date_from=(begins[0] - timedelta(days=1)).date(),
+        date_to=(end + timedelta(days=1)).date(),
+        amount=10 ** 9,
+        unit=Unit.Wh,
+        limit_to_consumption=True,
+        transfer_priority=0,
+    )
+
+    session.add_all([producer, agreement] + consumers)
+    session.flush()
+
+    ggos = []
+
+    for begin in begins:
+        for consumer in consumers:
+            create_measurement(
+                consumer, begin, begin + GGO_ISSUE_INTERVAL, 100, session,
+                consume=False)
+
+        ggos.append(create_measurement(
+            producer, begin, begin + GGO_ISSUE_INTERVAL, 100 * facilities,
+            session, consume=False))
+
+    session.flush()
+
+    return Seed(
+        owner=owner,
+        recipient=recipient,
+        facilities=consumers,
+        ggos=ggos,
+    )
+
+
+def benchmark_remaining_consumption(facilities, hours):
+    """
+    Consumes an hourly GGO for each of the past "hours" hours, one GGO
+    at a time, via an agreement limited to the recipient's consumption,
+    once for each of the provided numbers of recipient facilities. The
+    statements issued are counted by a ConsumptionTracer.
+
+    :param list[int] facilities: Numbers of recipient facilities
+    :param int hours:
+    :rtype: list[RemainingConsumptionResult]
+    """
+    results = []
+
+    for n in facilities:
+        session = make_session()
+        try:
+            seed = seed_limited_agreement(session, n, hours)
+
+            with ConsumptionTracer() as tracer:
+                started = time.perf_counter()
+                for ggo in seed.ggos:
+                    handle_ggo_received(ggo, session)
+                seconds = time.perf_counter() - started
+
+            limited = tracer.classes.get(
+                'AgreementLimitedToConsumptionConsumer')
+
+            results.append(RemainingConsumptionResult(
+                facilities=n,
+                ggos=len(seed.ggos),
+                statements=tracer.statements,
+                consumer_statements=limited.statements if limited else 0,
+                seconds=seconds,
+            ))
+        finally:
+            session.rollback()
+            session.close()
+
+    return results
+
+
+def benchmark_aggregate_queries(facilities, hours, repeat=3):
+    """
+    Times the aggregate lookups of the consumption path (see
+    ConsumptionContext) using GgoQuery, as before GgoAggregateQuery was
+    introduced, and using GgoAggregateQuery: the stored amount of the
+    owner and recipient at every hour one at a time (as looked up lazily),
+    and all of them in a single query (as prefetched). Each is done
+    "repeat" times, and the best time is reported.
+
+    The GGOs are consumed beforehand (like benchmark_remaining_consumption()
+    does), so the lookups find stored and transferred GGOs alike.
+
+    :param int facilities: Number of recipient facilities
+    :param int hours:
+    :param int repeat:
+    :rtype: list[AggregateQueryResult]
+    """
+    session = make_session()
+    try:
+        seed = seed_limited_agreement(session, facilities, hours)
+
+        for ggo in seed.ggos:
+            handle_ggo_received(ggo, session)
+
+        session.flush()
+
+        subjects = [seed.owner.subject, seed.recipient.subject]
+        begins = [ggo.begin for ggo in seed.ggos]
+
+        lookups = (
+            ('stored amount', 2 * len(begins), lambda query_class: [
+                query_class(session)
+                    .belongs_to(user)
+                    .begins_at(begin)
+                    .is_stored()
+                    .get_total_amount()
+                for user in (seed.owner, seed.recipient)
+                for begin in begins
+            ]),
+            ('stored amounts prefetched', 1, lambda query_class: (
+                query_class(session)
+                    .belongs_to_any(subjects)
+                    .begins_at_any(begins)
+                    .is_stored()
+                    .get_total_amount_by(Ggo.subject, Ggo.begin)
+            )),
+        )
+
+        return [
+            AggregateQueryResult(
+                lookup=name,
+                count=count,
+                before=time_best_of(lambda: lookup(GgoQuery), repeat),
+                after=time_best_of(lambda: lookup(GgoAggregateQuery), repeat),
+            )
+            for name, count, lookup in lookups
+        ]
+    finally:
+        session.rollback()
+        session.close()
+
+
+def time_best_of(func, repeat):
+    """
+    Returns the best wall time (in seconds) of invoking func()
+    "repeat" times.
+
+    :param collections.abc.Callable func:
+    :param int repeat:
+    :rtype: float
+    """
+    times = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    return min(times)
@@ -0,0 +1,415 @@
+import multiprocessing
+from datetime import timezone
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from click import echo, Abort
+from cloup import group, command, option, DateTime, IntRange
+
+from origin.db import make_session, inject_session
+from origin.auth import UserQuery
+from origin.ggo import Ggo, GgoQuery
+from origin.facilities import RetireBackInTimeJobQuery
+
+from .consume_ggos import consume_stored_ggos
+from .simulate import ConsumptionSimulation
+from .pending import run_consumption_worker
+from .tracing import ConsumptionTracer, TRACE_BUCKETS
+from .benchmarks import \
+    benchmark_remaining_consumption, benchmark_aggregate_queries
+from .retire_back_in_time import \
+    create_retire_back_in_time_job, run_retire_back_in_time_worker
+
+
+# -- Helpers -----------------------------------------------------------------
+
+
+def consume_partition(begin, trace=False):
+    """
+    Consumes all tradable GGOs which begins at the provided datetime in
+    a separate session and transaction. Invoked by worker processes.
+
+    :param datetime.datetime begin:
+    :param bool trace: Whether to trace consumers
+    :rtype: (int, dict, dict)
+    :returns: The number of GGOs consumed, and the ConsumerStats traced
+        per consumer class and per consumer (if traced)
+    """
+    tracer = ConsumptionTracer()
+    session = make_session()
+    try:
+        with tracer if trace else nullcontext():
+            consumed = consume_stored_ggos(begin, session)
+    except:
+        session.rollback()
+        raise
+    else:
+        session.commit()
+        return consumed, tracer.classes, tracer.consumers
+    finally:
+        session.close()
+
+
+def echo_trace(tracer):
+    """
+    Reports the stats traced per consumer class (with a histogram of
+    wall time per consumer evaluated), and the slowest consumers.
+
+    :param ConsumptionTracer tracer:
+    """
+    buckets = [f'<{b * 1000:g}ms' for b in TRACE_BUCKETS] + \
+              [f'>={TRACE_BUCKETS[-1] * 1000:g}ms']
+
+    echo('Consumers evaluated (wall time histogram):')
+    echo(f'    {"":<40} {"count":>8} {"stmts":>8} {"seconds":>9} '
+         + ' '.join(f'{b:>8}' for b in buckets))
+
+    for name, stats in sorted(tracer.classes.items()):
+        echo(f'    {name:<40} {stats.count:>8} {stats.statements:>8} '
+             f'{stats.seconds:>9.3f} '
+             + ' '.join(f'{n:>8}' for n in stats.buckets))
+
+    echo('Slowest consumers:')
+
+    for name, stats in tracer.get_slowest_consumers():
+        echo(f'    {name}: {stats.seconds:.3f}s, {stats.count} GGO(s), '
+             f'{stats.statements} statement(s), '
+             f'assigned {stats.assigned_amount} of '
+             f'{stats.desired_amount} Wh desired')
+
+
+def simulate_consumption(from_, to_, session):
+    """
+    Simulates consuming stored GGOs and reports the planned
+    retires and transfers.
+
+    :param datetime.datetime from_:
+    :param datetime.datetime to_:
+    :param sqlalchemy.orm.Session session:
+    """
+    simulation = ConsumptionSimulation(from_, to_, session)
+    allocation = simulation.run()
+
+    total_amount = sum(g.amount for ggos in simulation.ggos for g in ggos)
+    retired_amount = allocation.retired.sum(axis=(0, 1))
+    transferred_amount = allocation.transferred.sum(axis=(0, 1))
+
+    echo(f'Simulated consuming {len(simulation.ggos)} hour(s), '
+         f'{sum(map(len, simulation.ggos))} GGO(s), {total_amount} Wh')
+
+    echo('Planned retires:')
+    for facility, amount in zip(simulation.facilities, retired_amount):
+        echo(f'    {facility.gsrn} ({facility.subject}): {amount} Wh')
+
+    echo('Planned transfers:')
+    for agreement, amount in zip(simulation.agreements, transferred_amount):
+        echo(f'    {agreement.public_id} ({agreement.user_from_subject} -> '
+             f'{agreement.user_to_subject}): {amount} Wh')
+
+    echo(f'Remains stored: '
+         f'{total_amount - retired_amount.sum() - transferred_amount.sum()} Wh')
+    echo('Dry run, nothing has been written')
+
+
+# -- Commands ----------------------------------------------------------------
+
+
+@command()
+@option(
+    '--from',
+    'from_',
+    type=DateTime(formats=['%Y-%m-%d %H:%M']),
+    required=True,
+    prompt=True,
+    help='Begin from (included)',
+)
+@option(
+    '--to',
+    'to_',
+    type=DateTime(formats=['%Y-%m-%d %H:%M']),
+    required=True,
+    prompt=True,
+    help='Begin to (excluded)',
+)
+@option(
+    '--workers',
+    type=IntRange(min=1),
+    required=True,
+    default=1,
+    help='Number of worker processes',
+)
+@option(
+    '--dry-run',
+    is_flag=True,
+    default=False,
+    help='Report planned retires and transfers without writing them',
+)
+@option(
+    '--trace',
+    is_flag=True,
+    default=False,
+    help='Report time and SQL statements spent per consumer',
+)
+@inject_session
+def consume_ggos(from_, to_, workers, dry_run, trace, session):
+    """
+    Consume stored GGOs (retire and/or transfer via agreements).
+    Expired GGOs can not be consumed, and are left stored.
+
+    GGOs are partitioned by their begin, and each partition is consumed
+    in a separate transaction, distributed among the worker processes.
+
+    With --dry-run, consumption is simulated in memory and the planned
+    retires and transfers are reported instead.
+
+    With --trace, the time and SQL statements spent evaluating each
+    consumer (facility or agreement) are reported.
+    """
+    if dry_run:
+        simulate_consumption(from_, to_, session)
+        return
+
+    begins = GgoQuery(session) \
+        .is_tradable() \
+        .filter(Ggo.begin >= from_.astimezone(timezone.utc)) \
+        .filter(Ggo.begin < to_.astimezone(timezone.utc)) \
+        .get_distinct_begins()
+
+    echo(f'Consuming stored GGOs in {len(begins)} partition(s) '
+         f'using {workers} worker(s)')
+
+    failed = 0
+    tracer = ConsumptionTracer()
+
+    # Each worker process is spawned (rather than forked) to make sure
+    # it creates its own database engine and connection pool
+    context = multiprocessing.get_context('spawn')
+
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        futures = {
+            executor.submit(consume_partition, begin, trace): begin
+            for begin in sorted(begins)
+        }
+
+        for future in as_completed(futures):
+            begin = futures[future].isoformat()
+            try:
+                consumed, classes, consumers = future.result()
+            except Exception as e:
+                failed += 1
+                echo(f'{begin}: FAILED ({e.__class__.__name__}: {e})')
+            else:
+                echo(f'{begin}: consumed {consumed} GGO(s)')
+                tracer.merge(classes, consumers)
+
+    if trace:
+        echo_trace(tracer)
+
+    if failed:
+        echo(f'{failed} partition(s) failed')
+        raise Abort()
+
+
+@command()
+@option(
+    '--subject',
+    type=str,
+    required=False,
+    help='User (subject) to start (or resume) a job for before running jobs',
+)
+@option(
+    '--poll-interval',
+    type=IntRange(min=1),
+    required=True,
+    default=5,
+    help='Seconds to wait when no jobs are uncompleted',
+)
+@option(
+    '--once',
+    is_flag=True,
+    default=False,
+    help='Exit once no jobs are uncompleted (except chunks locked by others)',
+)
+@inject_session
+def retire_back_in_time(subject, poll_interval, once, session):
+    """
+    Retire stored GGOs back in time.
+
+    Runs uncompleted jobs, started by users or for the provided user,
+    one chunk at a time. Chunks already completed are skipped. Multiple
+    workers can run at once.
+    """
+    if subject:
+        user = UserQuery(session) \
+            .has_subject(subject) \
+            .one_or_none()
+
+        if user is None:
+            echo(f'User with subject "{subject}" not found')
+            raise Abort()
+
+        job = create_retire_back_in_time_job(user, session)
+        session.commit()
+
+        if job is None:
+            echo('User has no measured consumption')
+            return
+
+    def echo_job(job_id):
+        job = RetireBackInTimeJobQuery(session) \
+            .has_id(job_id) \
+            .one()
+
+        echo(f'Job {job.public_id} ({job.user_subject}): '
+             f'{job.begin_from.isoformat()} - {job.begin_to.isoformat()}, '
+             f'{job.chunks_completed}/{job.chunks_total} chunk(s), '
+             f'{job.ggos_consumed} GGO(s), '
+             f'{job.ggos_per_second:.1f} GGOs/s, '
+             f'{job.hours_per_second:.1f} hours/s')
+
+        session.rollback()
+
+    run_retire_back_in_time_worker(
+        poll_interval=poll_interval,
+        once=once,
+        on_progress=lambda c: echo(
+            f'{c.begin_from.isoformat()}: consumed {c.ggo_count} GGO(s) '
+            f'in {c.elapsed_seconds:.1f}s'),
+        on_job_run=echo_job,
+    )
+
+
+@command()
+@option(
+    '--limit',
+    type=IntRange(min=1),
+    required=True,
+    default=100,
+    help='Maximum number of pending keys (owner and begin) per transaction',
+)
+@option(
+    '--poll-interval',
+    type=IntRange(min=1),
+    required=True,
+    default=5,
+    help='Seconds to wait when nothing is pending',
+)
+@option(
+    '--once',
+    is_flag=True,
+    default=False,
+    help='Exit once nothing is pending (except GGOs locked by others)',
+)
+@option(
+    '--trace',
+    is_flag=True,
+    default=False,
+    help='Report time and SQL statements spent per consumer (on exit)',
+)
+def consume_pending(limit, poll_interval, once, trace):
+    """
+    Consume GGOs pending consumption (when CONSUME_GGOS_DEFERRED is enabled).
+
+    All GGOs stored for the same owner and begin are consumed in a single
+    pass. Multiple workers can run at once.
+    """
+    tracer = ConsumptionTracer()
+
+    try:
+        with tracer if trace else nullcontext():
+            run_consumption_worker(
+                limit=limit,
+                poll_interval=poll_interval,
+                once=once,
+                on_progress=lambda keys, ggos: echo(
+                    f'Consumed {ggos} GGO(s) for {keys} pending key(s)'),
+            )
+    finally:
+        if trace:
+            echo_trace(tracer)
+
+
+# -- Benchmarks --------------------------------------------------------------
+
+
+@command()
+@option(
+    '--facilities',
+    type=IntRange(min=1),
+    multiple=True,
+    default=[3, 30, 300],
+    help='Number of recipient facilities (repeat for more)',
+)
+@option(
+    '--hours',
+    type=IntRange(min=1),
+    required=True,
+    default=24,
+    help='Number of hours to consume a GGO for',
+)
+def benchmark_remaining_consumption_command(facilities, hours):
+    """
+    Count statements consuming via agreements limited to consumption.
+
+    Consumes a GGO per hour, one at a time, via an agreement limited to
+    the recipient's consumption, for each number of recipient facilities.
+    The number of statements should not grow with the number of
+    facilities. Nothing is written to the database.
+    """
+    echo(f'{"facilities":>10} {"GGOs":>6} {"statements":>11} '
+         f'{"by consumer":>12} {"seconds":>8}')
+
+    for result in benchmark_remaining_consumption(sorted(facilities), hours):
+        echo(f'{result.facilities:>10} {result.ggos:>6} '
+             f'{result.statements:>11} {result.consumer_statements:>12} '
+             f'{result.seconds:>8.3f}')
+
+
+@command()
+@option(
+    '--facilities',
+    type=IntRange(min=1),
+    required=True,
+    default=3,
+    help='Number of recipient facilities',
+)
+@option(
+    '--hours',
+    type=IntRange(min=1),
+    required=True,
+    default=48,
+    help='Number of hours to look up amounts for',
+)
+@option(
+    '--repeat',
+    type=IntRange(min=1),
+    required=True,
+    default=3,
+    help='Number of times to repeat each lookup (the best time is reported)',
+)
+def benchmark_aggregate_queries_command(facilities, hours, repeat):
+    """
+    Time aggregate lookups using GgoQuery versus GgoAggregateQuery.
+
+    Seeds and consumes GGOs like "remaining-consumption", and times the
+    stored amount lookups of the consumption path using GgoQuery (before)
+    and GgoAggregateQuery (after). Nothing is written to the database.
+    """
+    echo(f'{"lookup":<28} {"count":>6} {"before":>9} {"after":>9}')
+
+    for result in benchmark_aggregate_queries(facilities, hours, repeat):
+        echo(f'{result.lookup:<28} {result.count:>6} '
+             f'{result.before:>8.3f}s {result.after:>8.3f}s')
+
+
+@group()
+def benchmark_group() -> None:
+    """
+    Benchmark consumption (against the configured database)
+    """
+    pass
+
+
+benchmark_group.add_command(
+    benchmark_remaining_consumption_command, 'remaining-consumption')
+benchmark_group.add_command(
+    benchmark_aggregate_queries_command, 'aggregate-queries')
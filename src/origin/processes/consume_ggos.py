@@ -1,12 +1,16 @@
-from math import floor
 from itertools import takewhile
 
 from origin.auth import User
-from origin.measurements import MeasurementQuery
-from origin.meteringpoints import MeteringPoint, MeteringPointQuery
-from origin.agreements import TradeAgreement, AgreementQuery
+from origin.config import SUBMIT_BATCHES_TO_LEDGER
+from origin.meteringpoints import MeteringPoint
+from origin.agreements import TradeAgreement
+from origin.ggo import Ggo, GgoComposer, GgoQuery
 
-from origin.ggo import GgoComposer, GgoQuery, TransactionQuery
+from .context import ConsumptionContext
+from .tracing import ConsumptionTracer
+from .solver import \
+    desired_retire_amount, desired_transfer_amount, \
+    desired_limited_transfer_amount
 
 
 def handle_ggo_received(ggo, session):
@@ -20,97 +24,177 @@ def handle_ggo_received(ggo, session):
     if not ggo.stored:
         return
 
+    context = ConsumptionContext.of(session)
+    context.on_ggo_received(ggo)
+
+    controller = GgoConsumerController()
+    controller.consume_ggo(ggo.user, ggo, session, context=context)
+
+
+def consume_ggos_bulk(ggos, session):
+    """
+    Invoked whenever a batch of GGOs has been received, for instance
+    when importing measurements. Has the same effect as invoking
+    handle_ggo_received() for each GGO in the order provided, but
+    prefetches everything necessary for the whole batch in a handful
+    of queries, and allocates the GGOs in memory.
+
+    The GGOs must have been added to the session beforehand.
+
+    :param collections.abc.Iterable[origin.ggo.Ggo] ggos:
+    :param sqlalchemy.orm.Session session:
+    """
+    ggos = [ggo for ggo in ggos if ggo.stored]
+
+    if not ggos:
+        return
+
+    session.flush()
+
+    context = ConsumptionContext.of(session)
+    context.prefetch(ggos)
     controller = GgoConsumerController()
-    controller.consume_ggo(ggo.user, ggo, session)
+
+    for ggo in ggos:
+        context.on_ggo_received(ggo)
+        controller.consume_ggo(ggo.user, ggo, session, context=context)
+
+
+def consume_stored_ggos(begin, session):
+    """
+    Consumes all GGOs currently stored which begins at the provided
+    datetime, in the order they were issued/received. Expired GGOs can
+    not be consumed, and are excluded. Consumption of
+    GGOs only depends on data with the same begin, so different begins
+    can safely be consumed in parallel (in separate transactions).
+
+    GGOs locked by concurrent transactions (ie. being composed by a
+    user) are skipped rather than waited for.
+
+    :param datetime.datetime begin:
+    :param sqlalchemy.orm.Session session:
+    :rtype: int
+    :returns: The number of GGOs consumed
+    """
+    ggos = GgoQuery(session) \
+        .is_tradable() \
+        .begins_at(begin) \
+        .for_update(skip_locked=True) \
+        .order_by(Ggo.id.asc()) \
+        .all()
+
+    consume_ggos_bulk(ggos, session)
+
+    return len(ggos)
 
 
 class GgoConsumerController(object):
     """
-    TODO
+    Retires and/or transfers a GGO according to the owner's retiring
+    priorities and outbound agreements (in that order), until either
+    all consumers are satisfied or the GGO is used up.
+
+    Consumers look up amounts (consumption, retired, transferred etc.)
+    through the session's ConsumptionContext, which memoizes them for
+    the remainder of the transaction.
     """
 
-    def get_consumers(self, user, ggo, session):
+    def get_consumers(self, user, ggo, context):
         """
         :param origin.auth.User user:
         :param origin.ggo.Ggo ggo:
-        :param sqlalchemy.orm.Session session:
+        :param ConsumptionContext context:
         :rtype: collections.abc.Iterable[GgoConsumer]
         """
-        yield from self.get_retire_consumers(user, ggo, session)
-        yield from self.get_agreement_consumers(user, ggo, session)
+        yield from self.get_retire_consumers(user, ggo, context)
+        yield from self.get_agreement_consumers(user, ggo, context)
 
-    def get_retire_consumers(self, user, ggo, session):
+    def get_retire_consumers(self, user, ggo, context):
         """
         TODO test this
 
         :param User user:
         :param Ggo ggo:
-        :param sqlalchemy.orm.Session session:
+        :param ConsumptionContext context:
         :rtype: collections.abc.Iterable[RetiringConsumer]
         """
-        facilities = MeteringPointQuery(session) \
-            .belongs_to(user) \
-            .is_retire_receiver() \
-            .is_eligible_to_retire(ggo) \
-            .order_by(MeteringPoint.retiring_priority.asc()) \
-            .all()
+        for facility in context.get_retire_facilities(user, ggo):
+            yield RetiringConsumer(facility, context)
 
-        for facility in facilities:
-            yield RetiringConsumer(facility, session)
-
-    def get_agreement_consumers(self, user, ggo, session):
+    def get_agreement_consumers(self, user, ggo, context):
         """
         TODO test this
 
         :param User user:
         :param Ggo ggo:
-        :param sqlalchemy.orm.Session session:
+        :param ConsumptionContext context:
         :rtype: collections.abc.Iterable[AgreementConsumer]
         """
-        agreements = AgreementQuery(session) \
-            .is_outbound_from(user) \
-            .is_elibigle_to_trade(ggo) \
-            .is_operating_at(ggo.begin) \
-            .is_active() \
-            .order_by(TradeAgreement.transfer_priority.asc()) \
-            .all()
-
-        # TODO test query ordering (transfer_priority)
-
-        for agreement in agreements:
+        for agreement in context.get_agreements(user, ggo):
             if agreement.limit_to_consumption:
-                yield AgreementLimitedToConsumptionConsumer(agreement, session)
+                yield AgreementLimitedToConsumptionConsumer(agreement, context)
             else:
-                yield AgreementConsumer(agreement, session)
+                yield AgreementConsumer(agreement, context)
 
-    def consume_ggo(self, user, ggo, session):
+    def consume_ggo(self, user, ggo, session, context=None):
         """
         :param User user:
         :param Ggo ggo:
         :param Session session:
+        :param ConsumptionContext context:
         """
-        composer = GgoComposer(ggo, session)
-        consumers = self.get_consumers(user, ggo, session)
-        remaining_amount = ggo.amount
+        if context is None:
+            context = ConsumptionContext.of(session)
 
-        for consumer in takewhile(lambda _: remaining_amount > 0, consumers):
-            already_transferred = ggo.amount - remaining_amount
+        context.lock_consumers(user, ggo)
 
-            desired_amount = consumer.get_desired_amount(
-                ggo, already_transferred)
+        composer = context.get_composer(ggo)
+        consumers = self.get_consumers(user, ggo, context)
+        remaining_amount = ggo.amount
 
-            assigned_amount = min(remaining_amount, desired_amount)
-            remaining_amount -= assigned_amount
+        tracer = ConsumptionTracer.active
 
-            if assigned_amount > 0:
-                consumer.consume(composer, ggo, assigned_amount)
+        for consumer in takewhile(lambda _: remaining_amount > 0, consumers):
+            if tracer is not None:
+                with tracer.trace(ggo, consumer) as trace:
+                    trace.desired_amount, trace.assigned_amount = \
+                        self.consume_by(consumer, composer, ggo, remaining_amount)
+                remaining_amount -= trace.assigned_amount
+            else:
+                remaining_amount -= self.consume_by(
+                    consumer, composer, ggo, remaining_amount)[1]
 
         if remaining_amount < ggo.amount:
             batch, recipients = composer.build_batch()
-            batch.on_commit()
+
+            # Otherwise, the batch is completed by the ledger submitter
+            if not SUBMIT_BATCHES_TO_LEDGER:
+                batch.on_commit()
 
             session.add(batch)
 
+    def consume_by(self, consumer, composer, ggo, remaining_amount):
+        """
+        Lets a single consumer consume (some of) the remaining amount
+        of the GGO.
+
+        :param GgoConsumer consumer:
+        :param GgoComposer composer:
+        :param Ggo ggo:
+        :param int remaining_amount:
+        :rtype: (int, int)
+        :returns: The desired and assigned amount
+        """
+        desired_amount = consumer.get_desired_amount(
+            ggo, ggo.amount - remaining_amount)
+
+        assigned_amount = min(remaining_amount, desired_amount)
+
+        if assigned_amount > 0:
+            consumer.consume(composer, ggo, assigned_amount)
+
+        return desired_amount, assigned_amount
+
     def get_affected_subjects(self, user, ggo, session):
         """
         :param User user:
@@ -118,9 +202,10 @@ class GgoConsumerController(object):
         :param Session session:
         :rtype: list[str]
         """
-        unique_subjects = set([user.sub])
+        unique_subjects = set([user.subject])
+        context = ConsumptionContext.of(session)
 
-        for consumer in self.get_consumers(user, ggo, session):
+        for consumer in self.get_consumers(user, ggo, context):
             unique_subjects.update(consumer.get_affected_subjects())
 
         return list(unique_subjects)
@@ -157,13 +242,13 @@ class RetiringConsumer(GgoConsumer):
     """
     TODO
     """
-    def __init__(self, meteringpoint, session):
+    def __init__(self, meteringpoint, context):
         """
         :param MeteringPoint meteringpoint:
-        :param sqlalchemy.orm.Session session:
+        :param ConsumptionContext context:
         """
         self.meteringpoint = meteringpoint
-        self.session = session
+        self.context = context
 
     def __str__(self):
         return 'RetiringConsumer<%s>' % self.meteringpoint.gsrn
@@ -191,40 +276,39 @@ class RetiringConsumer(GgoConsumer):
         :param int already_transferred:
         :rtype: int
         """
-        measurement = get_consumption(
+        measurement = self.context.get_consumption(
             user=self.meteringpoint.user,
             gsrn=self.meteringpoint.gsrn,
             begin=ggo.begin,
-            session=self.session,
         )
 
         if measurement is None:
             return 0
 
-        retired_amount = get_retired_amount(
+        retired_amount = self.context.get_retired_amount(
             user=self.meteringpoint.user,
-            gsrn=self.meteringpoint.gsrn,
             measurement=measurement,
-            session=self.session,
         )
 
-        desired_amount = measurement.amount - retired_amount
-
-        return max(0, min(ggo.amount, desired_amount))
+        return int(desired_retire_amount(
+            ggo_amount=ggo.amount,
+            consumption=measurement.amount,
+            retired_amount=retired_amount,
+        ))
 
 
 class AgreementConsumer(GgoConsumer):
     """
     TODO
     """
-    def __init__(self, agreement, session):
+    def __init__(self, agreement, context):
         """
         :param TradeAgreement agreement:
-        :param sqlalchemy.orm.Session session:
+        :param ConsumptionContext context:
         """
         self.agreement = agreement
         self.reference = agreement.public_id
-        self.session = session
+        self.context = context
 
     def __str__(self):
         return 'AgreementConsumer<%s>' % self.reference
@@ -233,7 +317,7 @@ class AgreementConsumer(GgoConsumer):
         """
         :rtype: list[str]
         """
-        return [self.agreement.user_to.sub]
+        return [self.agreement.user_to.subject]
 
     def consume(self, composer, ggo, amount):
         """
@@ -253,38 +337,25 @@ class AgreementConsumer(GgoConsumer):
         :param int already_transferred:
         :rtype: int
         """
-        transferred_amount = get_transferred_amount(
+        transferred_amount = self.context.get_transferred_amount(
             user=self.agreement.user_from,
             reference=self.reference,
             begin=ggo.begin,
-            session=self.session,
         )
 
-        if self.agreement.amount_percent:
-            # Transfer percentage of ggo.amount
-            percentage_amount = self.agreement.amount_percent / 100 * ggo.amount
-            desired_amount = min(self.agreement.calculated_amount,
-                                 floor(percentage_amount))
-            desired_amount = desired_amount - transferred_amount
-        else:
-            # Transfer all of ggo.amount
-            desired_amount = self.agreement.calculated_amount - transferred_amount
-
-        return max(0, min(ggo.amount, desired_amount))
+        # Transfer either a percentage of ggo.amount, or all of it
+        return int(desired_transfer_amount(
+            ggo_amount=ggo.amount,
+            calculated_amount=self.agreement.calculated_amount,
+            amount_percent=self.agreement.amount_percent or float('nan'),
+            transferred_amount=transferred_amount,
+        ))
 
 
 class AgreementLimitedToConsumptionConsumer(AgreementConsumer):
     """
     TODO
     """
-    def __init__(self, agreement, session):
-        """
-        :param TradeAgreement agreement:
-        :param sqlalchemy.orm.Session session:
-        """
-        super(AgreementLimitedToConsumptionConsumer, self).__init__(agreement)
-        self.session = session
-
     def __str__(self):
         return 'AgreementLimitedToConsumptionConsumer<%s>' % self.reference
 
@@ -309,176 +380,20 @@ class AgreementLimitedToConsumptionConsumer(AgreementConsumer):
         if remaining_amount <= 0:
             return 0
 
-        desired_amount = 0
-
-        # TODO takewhile desired_amount < min(ggo.amount, remaining_amount)
-        for facility in self.get_facilities(ggo):
-            desired_amount += self.get_desired_amount_for_facility(
-                facility=facility,
-                begin=ggo.begin,
-            )
-
-        desired_amount -= already_transferred
-        try:
-            desired_amount -= get_stored_amount(
-                user=self.agreement.user_to,
-                begin=ggo.begin,
-                session=self.session,
-            )
-        except Exception as e:
-            raise
-
-        return max(0, min(ggo.amount, remaining_amount, desired_amount))
-
-    def get_desired_amount_for_facility(self, facility, begin):
-        """
-        :param Facility facility:
-        :param datetime.datetime begin:
-        :rtype: int
-        """
-        try:
-            measurement = get_consumption(
-                user=self.agreement.user_to,
-                gsrn=facility.gsrn,
-                begin=begin,
-                session=self.session,
-            )
-        except Exception as e:
-            raise
-
-        if measurement is None:
-            return 0
-
-        retired_amount = get_retired_amount(
+        consumption = self.context.get_remaining_consumption(
             user=self.agreement.user_to,
-            gsrn=facility.gsrn,
-            measurement=measurement,
-            session=self.session,
+            ggo=ggo,
         )
 
-        remaining_amount = measurement.amount - retired_amount
-
-        return max(0, remaining_amount)
-
-    def get_facilities(self, ggo):
-        """
-        :param Ggo ggo:
-        :rtype: list[Facility]
-        """
-        return MeteringPointQuery(self.session) \
-            .belongs_to(self.agreement.user_to) \
-            .is_retire_receiver() \
-            .is_eligible_to_retire(ggo) \
-            .all()
-
-
-# -- Helpers -----------------------------------------------------------------
-
-
-def get_consumption(user, gsrn, begin, session):
-    """
-    :param str gsrn:
-    :param datetime.datetime begin:
-    :param sqlalchemy.orm.Session session:
-    :rtype: Measurement
-    """
-    return MeasurementQuery(session) \
-        .belongs_to(user) \
-        .has_gsrn(gsrn) \
-        .begins_at(begin) \
-        .one_or_none()
-
-    # request = GetMeasurementRequest(gsrn=gsrn, begin=begin)
-    # response = datahub_service.get_consumption(token, request)
-    # return response.measurement
-
-
-def get_stored_amount(user, begin, session):
-    """
-    :param origin.auth.User user:
-    :param datetime.datetime begin:
-    :param sqlalchemy.orm.Session session:
-    :rtype: int
-    """
-    return GgoQuery(session) \
-        .belongs_to(user) \
-        .begins_at(begin) \
-        .is_stored() \
-        .get_total_amount()
-
-    # request = GetTotalAmountRequest(
-    #     filters=GgoFilters(
-    #         begin=begin,
-    #         category=GgoCategory.STORED,
-    #     )
-    # )
-    # response = account_service.get_total_amount(token, request)
-    # return response.amount
-
+        stored_amount = self.context.get_stored_amount(
+            user=self.agreement.user_to,
+            begin=ggo.begin,
+        )
 
-def get_retired_amount(user, gsrn, measurement, session):
-    """
-    :param origin.auth.User user:
-    :param str gsrn:
-    :param Measurement measurement:
-    :param sqlalchemy.orm.Session session:
-    :rtype: int
-    """
-    return GgoQuery(session) \
-        .belongs_to(user) \
-        .is_retired() \
-        .is_retired_to_gsrn(gsrn) \
-        .is_retired_to_measurement(measurement) \
-        .get_total_amount()
-
-    # request = GetTotalAmountRequest(
-    #     filters=GgoFilters(
-    #         retire_gsrn=[gsrn],
-    #         retire_address=[measurement.address],
-    #         category=GgoCategory.RETIRED,
-    #     )
-    # )
-    # response = account_service.get_total_amount(token, request)
-    # return response.amount
-
-
-def get_transferred_amount(user, reference, begin, session):
-    """
-    :param origin.auth.User user:
-    :param str reference:
-    :param datetime.datetime begin:
-    :param sqlalchemy.orm.Session session:
-    :rtype: int
-    """
-    return TransactionQuery(session) \
-        .sent_by_user(user) \
-        .begins_at(begin) \
-        .has_reference(reference) \
-        .get_total_amount()
-
-    # request = GetTransferredAmountRequest(
-    #     direction=TransferDirection.OUTBOUND,
-    #     filters=TransferFilters(
-    #         reference=[reference],
-    #         begin=begin,
-    #     )
-    # )
-    # response = account_service.get_transferred_amount(token, request)
-    # return response.amount
-
-
-# def ggo_is_available(ggo):
-#     """
-#     Check whether a GGO is available for transferring/retiring.
-#
-#     :param Ggo ggo:
-#     :rtype: bool
-#     """
-#     request = GetGgoListRequest(
-#         filters=GgoFilters(
-#             address=[ggo.address],
-#             category=GgoCategory.STORED,
-#         )
-#     )
-#     response = account_service.get_ggo_list(token, request)
-#     return len(response.results) > 0
+        return int(desired_limited_transfer_amount(
+            ggo_amount=ggo.amount,
+            transfer_amount=remaining_amount,
+            remaining_consumption=consumption,
+            already_transferred=already_transferred,
+            stored_amount=stored_amount,
+        ))
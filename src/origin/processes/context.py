@@ -0,0 +1,645 @@
+import sqlalchemy as sa
+from itertools import product
+from sqlalchemy.orm import Session
+
+from origin.measurements import \
+    Measurement, MeasurementQuery, lock_retire_accounting
+from origin.meteringpoints import MeteringPointQuery
+from origin.agreements import AgreementQuery
+from origin.ggo import \
+    Ggo, SplitTarget, GgoComposer, GgoAggregateQuery, TransactionQuery
+
+from .solver import remaining_consumption
+
+
+class ConsumptionContext(object):
+    """
+    Provides GGO consumers with the data necessary to decide how much of
+    a GGO they desire (consumption, retired amounts, transferred amounts
+    etc.). Each lookup is queried once and memoized for the remainder of
+    the session's transaction.
+
+    Retires and transfers are applied to the memoized amounts locally as
+    they are added to a GgoComposer (created using get_composer()), so
+    lookups stay correct without querying the database again.
+
+    Retired amounts are only read while holding the lock of the retire
+    accounting of the measurement's owner at its begin, so concurrent
+    transactions can not retire the same consumption twice, while
+    consuming different subjects or begins in parallel. All locks needed
+    to consume a GGO (or a batch of GGOs, see prefetch()) are taken in a
+    single call up front (see lock_consumers()), so concurrent
+    transactions take them in the same order.
+
+    Use ConsumptionContext.of(session) to get the context of a session.
+    The context is discarded when the session commits or rolls back.
+    """
+
+    SESSION_KEY = 'consumption_context'
+
+    def __init__(self, session):
+        """
+        :param sqlalchemy.orm.Session session:
+        """
+        self.session = session
+
+        # {subject: [MeteringPoint]}, ordered by retiring priority
+        self.facilities = {}
+
+        # {subject: [TradeAgreement]}, ordered by transfer priority
+        self.agreements = {}
+
+        # {(gsrn, begin): Measurement|None}
+        self.measurements = {}
+
+        # {measurement_id: amount}
+        self.retired_amounts = {}
+
+        # {(subject, reference, begin): amount}
+        self.transferred_amounts = {}
+
+        # {(subject, begin): amount}
+        self.stored_amounts = {}
+
+        # {(subject, begin)} of the retire accounting locked
+        self.locked = set()
+
+    @classmethod
+    def of(cls, session):
+        """
+        Returns the context of the provided session,
+        creating it if necessary.
+
+        :param sqlalchemy.orm.Session session:
+        :rtype: ConsumptionContext
+        """
+        if cls.SESSION_KEY not in session.info:
+            session.info[cls.SESSION_KEY] = cls(session)
+        return session.info[cls.SESSION_KEY]
+
+    @classmethod
+    def discard(cls, session):
+        """
+        Discards the context of the provided session (if any).
+
+        :param sqlalchemy.orm.Session session:
+        """
+        session.info.pop(cls.SESSION_KEY, None)
+
+    # -- Locking -------------------------------------------------------------
+
+    def lock_retire_accounting(self, keys):
+        """
+        Locks the retire accounting of the provided (subject, begin) pairs
+        until the transaction ends (see lock_retire_accounting()), waiting
+        for concurrent transactions which hold any of them. Locks already
+        held by the context are not taken again.
+
+        :param collections.abc.Iterable[(str, datetime.datetime)] keys:
+        """
+        keys = set(keys) - self.locked
+
+        if keys:
+            lock_retire_accounting(self.session, keys)
+            self.locked.update(keys)
+
+    def lock_consumers(self, user, ggo):
+        """
+        Locks the retire accounting of the user, and of the recipients of
+        the user's agreements limited to consumption, at the GGO's begin,
+        ie. everything which consuming the GGO may lock. The locks are
+        taken in a single call, so concurrent transactions can not take
+        the same locks in opposite order.
+
+        :param origin.auth.User user:
+        :param Ggo ggo:
+        """
+        keys = [(user.subject, ggo.begin)]
+        keys.extend(
+            (a.user_to_subject, ggo.begin)
+            for a in self.get_agreements(user, ggo)
+            if a.limit_to_consumption)
+
+        self.lock_retire_accounting(keys)
+
+    # -- Prefetching ---------------------------------------------------------
+
+    def prefetch(self, ggos):
+        """
+        Populates the context with everything necessary to consume the
+        provided GGOs, using a handful of queries. The GGOs must have been
+        flushed to the database beforehand.
+
+        GGOs in the batch are not included in the stored amounts until
+        they are received one at a time (see on_ggo_received()).
+
+        :param list[Ggo] ggos:
+        """
+        subjects = list(set(ggo.subject for ggo in ggos))
+        begins = list(set(ggo.begin for ggo in ggos))
+
+        # Outbound agreements
+        agreements = self.prefetch_agreements(subjects)
+
+        # Facilities of the owners, and of the recipients of agreements
+        # limited to consumption
+        recipients = list(set(
+            a.user_to_subject for a in agreements if a.limit_to_consumption))
+
+        facilities = self.prefetch_facilities(subjects + recipients)
+
+        # Retire accounting of the owners, and of the recipients, must be
+        # locked before reading the amounts retired
+        keys = set((ggo.subject, ggo.begin) for ggo in ggos)
+        keys.update(
+            (a.user_to_subject, begin)
+            for subject, begin in list(keys)
+            for a in self.agreements[subject]
+            if a.limit_to_consumption)
+
+        self.lock_retire_accounting(keys)
+
+        # Consumption measurements and the amounts retired to them
+        self.prefetch_consumption([f.gsrn for f in facilities], begins)
+
+        # Amounts already transferred via the agreements
+        self.prefetch_transferred_amounts(agreements, begins)
+
+        # Amounts currently stored by the recipients
+        self.prefetch_stored_amounts(recipients, begins)
+
+        for ggo in ggos:
+            key = (ggo.subject, ggo.begin)
+            if ggo.subject in recipients:
+                self.stored_amounts[key] -= ggo.amount
+            else:
+                self.stored_amounts.pop(key, None)
+
+    def prefetch_agreements(self, subjects):
+        """
+        :param list[str] subjects:
+        :rtype: list[TradeAgreement]
+        """
+        agreements = AgreementQuery(self.session) \
+            .is_outbound_from_any(subjects) \
+            .is_active() \
+            .all()
+
+        for subject in subjects:
+            self.agreements[subject] = []
+
+        for agreement in sorted(agreements, key=self.agreement_order):
+            self.agreements[agreement.user_from_subject].append(agreement)
+
+        return agreements
+
+    def prefetch_facilities(self, subjects):
+        """
+        :param list[str] subjects:
+        :rtype: list[MeteringPoint]
+        """
+        facilities = MeteringPointQuery(self.session) \
+            .belongs_to_any(subjects) \
+            .is_retire_receiver() \
+            .is_consumption() \
+            .all()
+
+        for subject in subjects:
+            self.facilities[subject] = []
+
+        for facility in sorted(facilities, key=self.facility_order):
+            self.facilities[facility.subject].append(facility)
+
+        return facilities
+
+    def prefetch_consumption(self, gsrn, begins):
+        """
+        Prefetches consumption measurements along with the amounts
+        already retired to them, using a single query.
+
+        :param list[str] gsrn:
+        :param list[datetime.datetime] begins:
+        """
+        if not gsrn:
+            return
+
+        results = MeasurementQuery(self.session) \
+            .has_any_gsrn(gsrn) \
+            .begins_at_any(begins) \
+            .get_with_retired_amount()
+
+        self.measurements.update(dict.fromkeys(product(gsrn, begins)))
+
+        for measurement, retired_amount in results:
+            key = (measurement.gsrn, measurement.begin)
+            self.measurements[key] = measurement
+            self.retired_amounts[measurement.id] = retired_amount
+
+    def prefetch_transferred_amounts(self, agreements, begins):
+        """
+        :param list[TradeAgreement] agreements:
+        :param list[datetime.datetime] begins:
+        """
+        if not agreements:
+            return
+
+        transferred_amounts = TransactionQuery(self.session) \
+            .sent_by_any_user(list(set(a.user_from_subject for a in agreements))) \
+            .has_any_reference([a.public_id for a in agreements]) \
+            .begins_at_any(begins) \
+            .get_total_amount_by(
+                TransactionQuery.parent_ggo.subject,
+                SplitTarget.reference,
+                Ggo.begin,
+            )
+
+        for agreement, begin in product(agreements, begins):
+            key = (agreement.user_from_subject, agreement.public_id, begin)
+            self.transferred_amounts[key] = 0
+
+        self.transferred_amounts.update(transferred_amounts)
+
+    def prefetch_stored_amounts(self, subjects, begins):
+        """
+        :param list[str] subjects:
+        :param list[datetime.datetime] begins:
+        """
+        if not subjects:
+            return
+
+        stored_amounts = GgoAggregateQuery(self.session) \
+            .belongs_to_any(subjects) \
+            .begins_at_any(begins) \
+            .is_stored() \
+            .get_total_amount_by(Ggo.subject, Ggo.begin)
+
+        self.stored_amounts.update(dict.fromkeys(product(subjects, begins), 0))
+        self.stored_amounts.update(stored_amounts)
+
+    # -- Events --------------------------------------------------------------
+
+    def on_measurement_created(self, measurement):
+        """
+        Invoked when a new measurement has been added to the session.
+
+        :param origin.measurements.Measurement measurement:
+        """
+        key = (measurement.meteringpoint.gsrn, measurement.begin)
+
+        if key in self.measurements:
+            self.measurements[key] = measurement
+
+    def on_ggo_received(self, ggo):
+        """
+        Invoked when a user receives a new GGO, before consuming it.
+
+        :param Ggo ggo:
+        """
+        self.add_stored_amount(ggo.subject, ggo.begin, ggo.amount)
+
+    def on_retire_added(self, measurement, amount):
+        """
+        Invoked when a retire is added to a GgoComposer.
+
+        :param origin.measurements.Measurement measurement:
+        :param int amount:
+        """
+        if measurement.id in self.retired_amounts:
+            self.retired_amounts[measurement.id] += amount
+
+    def on_transfer_added(self, ggo, user, amount, reference):
+        """
+        Invoked when a transfer is added to a GgoComposer.
+
+        :param Ggo ggo:
+        :param origin.auth.User user:
+        :param int amount:
+        :param str reference:
+        """
+        key = (ggo.subject, reference, ggo.begin)
+
+        if key in self.transferred_amounts and user.subject != ggo.subject:
+            self.transferred_amounts[key] += amount
+
+    def on_batch_built(self, ggo, transfers):
+        """
+        Invoked when a GgoComposer has built a Batch. The GGO is no longer
+        stored, but the transferred GGOs (including any remaining amount
+        transferred back to the owner) are.
+
+        :param Ggo ggo:
+        :param list[(origin.auth.User, int, str)] transfers:
+        """
+        self.add_stored_amount(ggo.subject, ggo.begin, -ggo.amount)
+
+        for user, amount, reference in transfers:
+            self.add_stored_amount(user.subject, ggo.begin, amount)
+
+    def add_stored_amount(self, subject, begin, amount):
+        """
+        :param str subject:
+        :param datetime.datetime begin:
+        :param int amount:
+        """
+        if (subject, begin) in self.stored_amounts:
+            self.stored_amounts[(subject, begin)] += amount
+
+    # -- Lookups -------------------------------------------------------------
+
+    def get_composer(self, ggo):
+        """
+        :param Ggo ggo:
+        :rtype: ContextGgoComposer
+        """
+        return ContextGgoComposer(ggo, self)
+
+    def get_retire_facilities(self, user, ggo):
+        """
+        Returns the user's facilities which the GGO can be retired to,
+        ordered by their retiring priority.
+
+        :param origin.auth.User user:
+        :param Ggo ggo:
+        :rtype: list[MeteringPoint]
+        """
+        if user.subject not in self.facilities:
+            self.prefetch_facilities([user.subject])
+
+        return [f for f in self.facilities[user.subject]
+                if f.is_eligible_to_retire(ggo)]
+
+    def get_agreements(self, user, ggo):
+        """
+        Returns the user's outbound agreements which the GGO can be
+        transferred via, ordered by their transfer priority.
+
+        :param origin.auth.User user:
+        :param Ggo ggo:
+        :rtype: list[TradeAgreement]
+        """
+        if user.subject not in self.agreements:
+            self.prefetch_agreements([user.subject])
+
+        return [a for a in self.agreements[user.subject]
+                if a.is_eligible_to_trade(ggo)]
+
+    def get_consumption(self, user, gsrn, begin):
+        """
+        :param origin.auth.User user:
+        :param str gsrn:
+        :param datetime.datetime begin:
+        :rtype: origin.measurements.Measurement
+        """
+        key = (gsrn, begin)
+
+        if key not in self.measurements:
+            self.measurements[key] = get_consumption(
+                user, gsrn, begin, self.session)
+
+        return self.measurements[key]
+
+    def get_remaining_consumption(self, user, ggo):
+        """
+        Returns the total consumption of the user's facilities, which the
+        GGO can be retired to, minus what has already been retired.
+
+        Consumption for all of the facilities is fetched using a single
+        query (if not already available), regardless of the number
+        of facilities.
+
+        :param origin.auth.User user:
+        :param Ggo ggo:
+        :rtype: int
+        """
+        facilities = self.get_retire_facilities(user, ggo)
+
+        self.lock_retire_accounting([(user.subject, ggo.begin)])
+
+        missing = [f.gsrn for f in facilities
+                   if not self.has_consumption(f.gsrn, ggo.begin)]
+
+        if missing:
+            self.prefetch_consumption(missing, [ggo.begin])
+
+        remaining_amount = 0
+
+        for facility in facilities:
+            measurement = self.measurements[(facility.gsrn, ggo.begin)]
+
+            if measurement is not None:
+                remaining_amount += remaining_consumption(
+                    consumption=measurement.amount,
+                    retired_amount=self.get_retired_amount(
+                        user, measurement),
+                )
+
+        return int(remaining_amount)
+
+    def get_stored_amount(self, user, begin):
+        """
+        :param origin.auth.User user:
+        :param datetime.datetime begin:
+        :rtype: int
+        """
+        key = (user.subject, begin)
+
+        if key not in self.stored_amounts:
+            self.stored_amounts[key] = get_stored_amount(
+                user, begin, self.session)
+
+        return self.stored_amounts[key]
+
+    def get_retired_amount(self, user, measurement):
+        """
+        :param origin.auth.User user:
+        :param origin.measurements.Measurement measurement:
+        :rtype: int
+        """
+        if measurement.id is None:
+            self.session.flush()
+
+        if measurement.id not in self.retired_amounts:
+            self.lock_retire_accounting([(user.subject, measurement.begin)])
+            self.retired_amounts[measurement.id] = get_retired_amount(
+                measurement, self.session)
+
+        return self.retired_amounts[measurement.id]
+
+    def get_transferred_amount(self, user, reference, begin):
+        """
+        :param origin.auth.User user:
+        :param str reference:
+        :param datetime.datetime begin:
+        :rtype: int
+        """
+        key = (user.subject, reference, begin)
+
+        if key not in self.transferred_amounts:
+            self.transferred_amounts[key] = get_transferred_amount(
+                user, reference, begin, self.session)
+
+        return self.transferred_amounts[key]
+
+    # -- Helpers -------------------------------------------------------------
+
+    def has_consumption(self, gsrn, begin):
+        """
+        Returns True if both the measurement and the amount retired to
+        it (if measured) are available without querying the database.
+
+        :param str gsrn:
+        :param datetime.datetime begin:
+        :rtype: bool
+        """
+        if (gsrn, begin) not in self.measurements:
+            return False
+
+        measurement = self.measurements[(gsrn, begin)]
+
+        return measurement is None \
+            or (measurement.id is not None
+                and measurement.id in self.retired_amounts)
+
+    @staticmethod
+    def agreement_order(agreement):
+        """
+        Sort key equivalent to ORDER BY transfer_priority ASC (NULLS LAST).
+
+        :param TradeAgreement agreement:
+        """
+        return (agreement.transfer_priority is None,
+                agreement.transfer_priority,
+                agreement.id)
+
+    @staticmethod
+    def facility_order(facility):
+        """
+        Sort key equivalent to ORDER BY retiring_priority ASC.
+
+        :param MeteringPoint facility:
+        """
+        return facility.retiring_priority, facility.id
+
+
+class ContextGgoComposer(GgoComposer):
+    """
+    A GgoComposer which validates retires using a ConsumptionContext
+    instead of querying the database, and keeps the context up-to-date
+    with the retires and transfers added to it.
+    """
+    def __init__(self, ggo, context):
+        """
+        :param Ggo ggo:
+        :param ConsumptionContext context:
+        """
+        super(ContextGgoComposer, self).__init__(ggo, context.session)
+        self.context = context
+
+    def add_transfer(self, user, amount, reference=None):
+        """
+        :param origin.auth.User user:
+        :param int amount:
+        :param str reference:
+        """
+        super(ContextGgoComposer, self).add_transfer(user, amount, reference)
+        self.context.on_transfer_added(self.ggo, user, amount, reference)
+
+    def add_retire(self, meteringpoint, amount):
+        """
+        :param MeteringPoint meteringpoint:
+        :param int amount:
+        """
+        super(ContextGgoComposer, self).add_retire(meteringpoint, amount)
+        measurement, meteringpoint, amount = self.retires[-1]
+        self.context.on_retire_added(measurement, amount)
+
+    def build_batch(self):
+        """
+        :rtype: (Batch, list[(User, Ggo)])
+        """
+        batch, recipients = super(ContextGgoComposer, self).build_batch()
+        self.context.on_batch_built(self.ggo, self.transfers)
+        return batch, recipients
+
+    def get_retired_amount(self, measurement):
+        """
+        :param origin.measurements.Measurement measurement:
+        :rtype: int
+        """
+        return self.context.get_retired_amount(self.ggo.user, measurement)
+
+    def get_consumption(self, gsrn, begin):
+        """
+        :param str gsrn:
+        :param datetime.datetime begin:
+        :rtype: origin.measurements.Measurement
+        """
+        return self.context.get_consumption(self.ggo.user, gsrn, begin)
+
+
+# -- Helpers -----------------------------------------------------------------
+
+
+def get_consumption(user, gsrn, begin, session):
+    """
+    :param origin.auth.User user:
+    :param str gsrn:
+    :param datetime.datetime begin:
+    :param sqlalchemy.orm.Session session:
+    :rtype: Measurement
+    """
+    return MeasurementQuery(session) \
+        .belongs_to(user) \
+        .has_gsrn(gsrn) \
+        .begins_at(begin) \
+        .one_or_none()
+
+
+def get_stored_amount(user, begin, session):
+    """
+    :param origin.auth.User user:
+    :param datetime.datetime begin:
+    :param sqlalchemy.orm.Session session:
+    :rtype: int
+    """
+    return GgoAggregateQuery(session) \
+        .belongs_to(user) \
+        .begins_at(begin) \
+        .is_stored() \
+        .get_total_amount()
+
+
+def get_retired_amount(measurement, session):
+    """
+    :param Measurement measurement:
+    :param sqlalchemy.orm.Session session:
+    :rtype: int
+    """
+    return session \
+        .query(Measurement.retired_amount) \
+        .filter(Measurement.id == measurement.id) \
+        .scalar()
+
+
+def get_transferred_amount(user, reference, begin, session):
+    """
+    :param origin.auth.User user:
+    :param str reference:
+    :param datetime.datetime begin:
+    :param sqlalchemy.orm.Session session:
+    :rtype: int
+    """
+    return TransactionQuery(session) \
+        .sent_by_user(user) \
+        .begins_at(begin) \
+        .has_reference(reference) \
+        .get_total_amount()
+
+
+# -- Events ------------------------------------------------------------------
+
+
+@sa.event.listens_for(Session, 'after_commit')
+@sa.event.listens_for(Session, 'after_rollback')
+def on_transaction_end(session):
+    ConsumptionContext.discard(session)
@@ -1,28 +1,45 @@
 from datetime import datetime, timezone
 
-from origin.ggo.models import Ggo
+from origin.config import CONSUME_GGOS_DEFERRED
+from origin.ggo import Ggo, GgoQuery
 from origin.measurements import Measurement
 from origin.meteringpoints import MeteringPointType
 
-from .consume_ggos import handle_ggo_received
+from .context import ConsumptionContext
+from .consume_ggos import handle_ggo_received, consume_ggos_bulk
+from .pending import enqueue_consumption
 
 
 # -- Helpers -----------------------------------------------------------------
 
 
-def create_measurement(meteringpoint, begin, end, amount, session):
+def create_measurement(meteringpoint, begin, end, amount, session,
+                       consume=True):
     """
     Create a new measurement in the system.
 
     If this is a production meteringpoint, this function also:
     - Issues a new GGO
-    - Triggers consumption of said GGO (retire and/or transfer via agreement)
+    - Triggers consumption of said GGO (retire and/or transfer via agreement),
+      or enqueues it for consumption if CONSUME_GGOS_DEFERRED is enabled
+
+    If this is a consumption meteringpoint, this function also triggers
+    consumption of the owner's GGOs which were issued before the
+    consumption was measured (see get_ggos_awaiting_consumption()).
+
+    When importing many measurements at once, set consume=False and
+    consume the returned GGOs, along with the GGOs awaiting the imported
+    consumption, afterwards using handle_ggos_received().
 
     :param origin.meteringpoints.MeteringPoint meteringpoint:
     :param datetime begin:
     :param datetime end:
     :param int amount:
     :param sqlalchemy.orm.Session session:
+    :param bool consume: Whether or not to consume the issued GGO,
+        or the GGOs awaiting the measured consumption
+    :rtype: origin.ggo.Ggo | None
+    :returns: The issued GGO, if any
     """
     assert amount > 0, 'Amount has to be > 0'
 
@@ -36,10 +53,71 @@ def create_measurement(meteringpoint, begin, end, amount, session):
     # Issue Measurement
     session.add(measurement)
 
+    ConsumptionContext.of(session).on_measurement_created(measurement)
+
     # Issue GGO (if production meteringpoint)
     if meteringpoint.type is MeteringPointType.PRODUCTION:
         ggo = Ggo.from_measurement(measurement)
 
         session.add(ggo)
 
-        handle_ggo_received(ggo, session)
+        if consume and CONSUME_GGOS_DEFERRED:
+            enqueue_consumption([ggo], session)
+        elif consume:
+            handle_ggo_received(ggo, session)
+
+        return ggo
+
+    # Consume GGOs awaiting consumption (if consumption meteringpoint)
+    elif consume:
+        handle_ggos_received(get_ggos_awaiting_consumption(
+            [(meteringpoint, measurement.begin)], session), session)
+
+
+def get_ggos_awaiting_consumption(consumption, session):
+    """
+    Returns stored, tradable GGOs which belong to the owners of the
+    provided consumption meteringpoints, and which have the same sector
+    and begin as the consumption measured. These GGOs were issued before
+    the consumption was measured, and could not be retired to it.
+
+    All GGOs are looked up using a single query.
+
+    :param list[(origin.meteringpoints.MeteringPoint, datetime)] consumption:
+        Consumption meteringpoints and the begins measured
+    :param sqlalchemy.orm.Session session:
+    :rtype: list[origin.ggo.Ggo]
+    """
+    keys = set(
+        (meteringpoint.subject, meteringpoint.sector, begin)
+        for meteringpoint, begin in consumption
+        if meteringpoint.type is MeteringPointType.CONSUMPTION
+        and meteringpoint.retiring_priority is not None
+    )
+
+    if not keys:
+        return []
+
+    return GgoQuery(session) \
+        .is_tradable() \
+        .has_any_owner_sector_begin(keys) \
+        .all()
+
+
+def handle_ggos_received(ggos, session):
+    """
+    Consumes the provided GGOs in bulk (in order of begin and when they
+    were received), or enqueues them for consumption if
+    CONSUME_GGOS_DEFERRED is enabled. Duplicates are ignored.
+
+    :param collections.abc.Iterable[origin.ggo.Ggo] ggos:
+    :param sqlalchemy.orm.Session session:
+    """
+    ggos = list({id(ggo): ggo for ggo in ggos}.values())
+
+    if CONSUME_GGOS_DEFERRED:
+        enqueue_consumption(ggos, session)
+    else:
+        session.flush()
+        ggos.sort(key=lambda ggo: (ggo.begin, ggo.id))
+        consume_ggos_bulk(ggos, session)
@@ -0,0 +1,159 @@
+import time
+import logging
+import sqlalchemy as sa
+
+from origin.db import make_session
+from origin.ggo import Ggo, GgoQuery, PendingConsumption
+
+from .consume_ggos import consume_ggos_bulk
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_consumption(ggos, session):
+    """
+    Defers consumption of the provided GGOs by enqueuing a key (subject
+    and begin) for each distinct owner and begin among them. All GGOs of
+    the same owner and begin are consumed together by consume_pending(),
+    no matter how many times their key is pending.
+
+    Enqueuing never waits for workers consuming the same key. Keys are
+    appended, rather than merged into those already pending, so a key
+    enqueued while it's being consumed is left pending, and the GGOs
+    issued meanwhile are consumed by the next pass.
+
+    :param collections.abc.Iterable[origin.ggo.Ggo] ggos:
+    :param sqlalchemy.orm.Session session:
+    """
+    keys = sorted(set((ggo.subject, ggo.begin) for ggo in ggos if ggo.stored))
+
+    enqueue_keys(keys, session)
+
+
+def enqueue_keys(keys, session):
+    """
+    Enqueues the provided keys (subject and begin), as described by
+    enqueue_consumption().
+
+    :param list[(str, datetime.datetime)] keys:
+    :param sqlalchemy.orm.Session session:
+    """
+    if not keys:
+        return
+
+    session.execute(PendingConsumption.__table__.insert().values(
+        [{'subject': s, 'begin': b} for s, b in keys]))
+
+
+def consume_pending(session, limit=100):
+    """
+    Claims the "limit" keys pending the longest, along with any other
+    entries pending for the same keys, consumes all tradable GGOs
+    currently stored for each key in a single pass, and deletes the
+    entries claimed. Entries claimed by other transactions are skipped,
+    so multiple workers can consume pending keys at once, as are GGOs
+    locked by other transactions (ie. being composed by a user).
+
+    Keys with any GGOs skipped this way are re-enqueued (behind the keys
+    already pending), so their skipped GGOs are consumed once released.
+
+    :param sqlalchemy.orm.Session session:
+    :param int limit: Maximum number of keys to claim
+    :rtype: (int, int)
+    :returns: The number of keys and GGOs consumed, not counting
+        re-enqueued keys
+    """
+    pending = session.query(PendingConsumption) \
+        .order_by(PendingConsumption.id.asc()) \
+        .with_for_update(skip_locked=True) \
+        .limit(limit) \
+        .all()
+
+    if not pending:
+        return 0, 0
+
+    keys = sorted(set((p.subject, p.begin) for p in pending))
+
+    # Entries of the same keys, enqueued by other transactions,
+    # are consumed (and deleted) along with them
+    pending += session.query(PendingConsumption) \
+        .filter(sa.tuple_(
+            PendingConsumption.subject, PendingConsumption.begin).in_(keys)) \
+        .filter(PendingConsumption.id.notin_([p.id for p in pending])) \
+        .with_for_update(skip_locked=True) \
+        .all()
+
+    ggos = GgoQuery(session) \
+        .is_tradable() \
+        .filter(sa.tuple_(Ggo.subject, Ggo.begin).in_(keys)) \
+        .for_update(skip_locked=True) \
+        .order_by(Ggo.begin.asc(), Ggo.id.asc()) \
+        .all()
+
+    skipped = get_skipped_keys(keys, ggos, session)
+
+    consume_ggos_bulk(ggos, session)
+
+    for p in pending:
+        session.delete(p)
+
+    enqueue_keys(sorted(skipped), session)
+
+    return len(keys) - len(skipped), len(ggos)
+
+
+def get_skipped_keys(keys, ggos, session):
+    """
+    Returns the keys (subject and begin) which have tradable GGOs other
+    than the provided, ie. GGOs locked by other transactions.
+
+    :param list[(str, datetime.datetime)] keys:
+    :param list[Ggo] ggos: The GGOs locked by this transaction
+    :param sqlalchemy.orm.Session session:
+    :rtype: set[(str, datetime.datetime)]
+    """
+    query = GgoQuery(session) \
+        .is_tradable() \
+        .filter(sa.tuple_(Ggo.subject, Ggo.begin).in_(keys)) \
+        .filter(Ggo.id.notin_([ggo.id for ggo in ggos])) \
+        .with_entities(Ggo.subject, Ggo.begin) \
+        .distinct()
+
+    return set((subject, begin) for subject, begin in query)
+
+
+def run_consumption_worker(limit=100, poll_interval=5, once=False,
+                           on_progress=None):
+    """
+    Consumes pending keys, "limit" keys at a time, each in a separate
+    transaction. Polls for new keys every "poll_interval" seconds when
+    none are pending (or all were re-enqueued), or returns if "once"
+    is True.
+
+    :param int limit: Maximum number of keys per transaction
+    :param float poll_interval: Seconds to wait when no keys are pending
+    :param bool once: Whether to return once no keys are pending
+    :param collections.abc.Callable[[int, int], None] on_progress:
+        Invoked with the number of keys and GGOs consumed
+        after each transaction
+    """
+    while True:
+        session = make_session()
+        try:
+            keys, ggos = consume_pending(session, limit)
+            session.commit()
+        except:
+            session.rollback()
+            logger.exception('Failed to consume pending GGOs')
+            raise
+        finally:
+            session.close()
+
+        if keys and on_progress is not None:
+            on_progress(keys, ggos)
+
+        if not keys:
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,209 @@
+import time
+import logging
+from datetime import datetime, timezone
+
+from origin.db import make_session
+from origin.config import RETIRE_BACK_IN_TIME_CHUNK_SIZE, GGO_ISSUE_INTERVAL
+from origin.ggo import Ggo, GgoQuery
+from origin.measurements import MeasurementQuery
+from origin.meteringpoints import MeteringPointQuery
+from origin.facilities import \
+    RetireBackInTimeJob, RetireBackInTimeCheckpoint, RetireBackInTimeJobQuery
+
+from .consume_ggos import consume_ggos_bulk
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_retire_back_in_time_job(user, session):
+    """
+    Creates a new job to retire the user's stored GGOs back in time,
+    from the first to the last measured consumption of the user's
+    facilities. If the user already has an uncompleted job, it is
+    returned instead (to be resumed).
+
+    Returns None if the user has no measured consumption.
+
+    :param origin.auth.User user:
+    :param sqlalchemy.orm.Session session:
+    :rtype: RetireBackInTimeJob | None
+    """
+    job = RetireBackInTimeJobQuery(session) \
+        .belongs_to(user) \
+        .is_completed(False) \
+        .get_latest()
+
+    if job is not None:
+        return job
+
+    gsrn = MeteringPointQuery(session) \
+        .belongs_to(user) \
+        .is_consumer() \
+        .get_distinct_gsrn()
+
+    if not gsrn:
+        return None
+
+    # Get first and last "begin" for all measurements of all
+    # facilities which are retiring GGOs
+    measurements = MeasurementQuery(session).has_any_gsrn(gsrn)
+    first = measurements.get_first_measured_begin()
+    last = measurements.get_last_measured_begin()
+
+    if first is None or last is None:
+        return None
+
+    job = RetireBackInTimeJob(
+        user=user,
+        user_subject=user.subject,
+        begin_from=first,
+        begin_to=last + GGO_ISSUE_INTERVAL,
+    )
+
+    job.add_chunks(RETIRE_BACK_IN_TIME_CHUNK_SIZE)
+
+    session.add(job)
+    session.flush()
+
+    return job
+
+
+def run_retire_back_in_time_worker(poll_interval=5, once=False,
+                                  on_progress=None, on_job_run=None):
+    """
+    Runs uncompleted jobs (see run_retire_back_in_time_job()), one job at
+    a time, starting with the job which has the oldest uncompleted chunk.
+    Polls for new jobs every "poll_interval" seconds when no chunks are
+    left to consume, or returns if "once" is True.
+
+    Jobs are created by users (see create_retire_back_in_time_job()), and
+    run by this worker only, so they outlive the requests creating them.
+
+    :param float poll_interval: Seconds to wait when no chunks are left
+    :param bool once: Whether to return once no chunks are left
+    :param collections.abc.Callable[[RetireBackInTimeCheckpoint], None] on_progress:
+        Invoked with each checkpoint once it has been completed
+    :param collections.abc.Callable[[int], None] on_job_run:
+        Invoked with the ID of each job once it has been run
+    """
+    while True:
+        session = make_session()
+        try:
+            job_id = get_next_retire_back_in_time_job_id(session)
+        finally:
+            session.rollback()
+            session.close()
+
+        if job_id is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        run_retire_back_in_time_job(job_id, on_progress=on_progress)
+
+        if on_job_run is not None:
+            on_job_run(job_id)
+
+
+def get_next_retire_back_in_time_job_id(session):
+    """
+    Returns the ID of the job which has the oldest uncompleted chunk,
+    not counting chunks being consumed (by another thread or process),
+    or None if no chunks are left to consume.
+
+    :param sqlalchemy.orm.Session session:
+    :rtype: int | None
+    """
+    checkpoint = session.query(RetireBackInTimeCheckpoint) \
+        .filter(RetireBackInTimeCheckpoint.completed.is_(None)) \
+        .order_by(RetireBackInTimeCheckpoint.id.asc()) \
+        .with_for_update(skip_locked=True) \
+        .first()
+
+    if checkpoint is not None:
+        return checkpoint.job_id
+
+
+def run_retire_back_in_time_job(job_id, on_progress=None):
+    """
+    Consumes all uncompleted chunks of a job, one chunk at a time, each
+    in a separate transaction. Completed chunks are skipped, so an
+    interrupted job can be resumed by invoking this function again.
+
+    Chunks are locked while being consumed, so the same job can safely
+    be run by multiple threads or processes at once.
+
+    :param int job_id:
+    :param collections.abc.Callable[[RetireBackInTimeCheckpoint], None] on_progress:
+        Invoked with each checkpoint once it has been completed
+    """
+    while True:
+        session = make_session()
+        try:
+            checkpoint = session.query(RetireBackInTimeCheckpoint) \
+                .filter(RetireBackInTimeCheckpoint.job_id == job_id) \
+                .filter(RetireBackInTimeCheckpoint.completed.is_(None)) \
+                .order_by(RetireBackInTimeCheckpoint.begin_from.asc()) \
+                .with_for_update(skip_locked=True) \
+                .first()
+
+            if checkpoint is None:
+                complete_retire_back_in_time_job(job_id, session)
+                session.commit()
+                return
+
+            consume_checkpoint(checkpoint, session)
+            session.commit()
+        except:
+            session.rollback()
+            logger.exception(f'Failed to retire back in time, job {job_id}')
+            raise
+        finally:
+            session.close()
+
+        if on_progress is not None:
+            on_progress(checkpoint)
+
+
+def consume_checkpoint(checkpoint, session):
+    """
+    Consumes the user's tradable GGOs within the checkpoint's period,
+    and marks the checkpoint as completed. Expired GGOs can not be
+    consumed, and are left stored.
+
+    :param RetireBackInTimeCheckpoint checkpoint:
+    :param sqlalchemy.orm.Session session:
+    """
+    checkpoint.started = datetime.now(tz=timezone.utc)
+
+    ggos = GgoQuery(session) \
+        .belongs_to(checkpoint.job.user) \
+        .is_tradable() \
+        .filter(Ggo.begin >= checkpoint.begin_from) \
+        .filter(Ggo.begin < checkpoint.begin_to) \
+        .for_update(skip_locked=True) \
+        .order_by(Ggo.begin.asc(), Ggo.id.asc()) \
+        .all()
+
+    consume_ggos_bulk(ggos, session)
+
+    checkpoint.ggo_count = len(ggos)
+    checkpoint.completed = datetime.now(tz=timezone.utc)
+
+
+def complete_retire_back_in_time_job(job_id, session):
+    """
+    Marks the job as completed, unless some of its chunks are still
+    being consumed (by another thread or process).
+
+    :param int job_id:
+    :param sqlalchemy.orm.Session session:
+    """
+    job = RetireBackInTimeJobQuery(session) \
+        .has_id(job_id) \
+        .one()
+
+    if job.completed is None and job.chunks_completed == job.chunks_total:
+        job.completed = datetime.now(tz=timezone.utc)
@@ -0,0 +1,262 @@
+import pytz
+import numpy as np
+from datetime import timezone
+from itertools import groupby
+
+from origin.measurements import Measurement, MeasurementQuery
+from origin.meteringpoints import MeteringPointQuery
+from origin.agreements import AgreementQuery
+from origin.ggo import \
+    Ggo, SplitTarget, GgoQuery, TransactionQuery
+
+from .context import ConsumptionContext
+from .solver import AllocationProblem, AllocationSolver
+
+
+class ConsumptionSimulation(object):
+    """
+    Simulates consuming all tradable GGOs currently stored within a period
+    of time (like consume_stored_ggos() does for each begin) without
+    writing anything to the database.
+
+    Data is loaded using a few queries, and allocation is done in memory
+    by the AllocationSolver.
+    """
+    def __init__(self, begin_from, begin_to, session):
+        """
+        :param datetime.datetime begin_from: Begin from (included)
+        :param datetime.datetime begin_to: Begin to (excluded)
+        :param sqlalchemy.orm.Session session:
+        """
+        self.begin_from = begin_from.astimezone(timezone.utc)
+        self.begin_to = begin_to.astimezone(timezone.utc)
+        self.session = session
+
+        self.begins = []
+        self.ggos = []
+        self.subjects = []
+        self.subject_index = {}
+        self.facilities = []
+        self.agreements = []
+
+    def run(self):
+        """
+        :rtype: origin.processes.solver.Allocation
+        """
+        return AllocationSolver().solve(self.load())
+
+    # -- Loading -------------------------------------------------------------
+
+    def load(self):
+        """
+        :rtype: AllocationProblem
+        """
+        ggos = GgoQuery(self.session) \
+            .is_tradable() \
+            .filter(Ggo.begin >= self.begin_from) \
+            .filter(Ggo.begin < self.begin_to) \
+            .order_by(Ggo.begin.asc(), Ggo.id.asc()) \
+            .all()
+
+        # GGOs per hour, in the order they are consumed
+        self.ggos = [list(g) for b, g in groupby(ggos, lambda g: g.begin)]
+        self.begins = [g[0].begin for g in self.ggos]
+
+        owners = list(set(ggo.subject for ggo in ggos))
+
+        self.agreements = self.load_agreements(owners)
+
+        recipients = list(set(
+            a.user_to_subject for a in self.agreements
+            if a.limit_to_consumption))
+
+        self.facilities = self.load_facilities(owners + recipients)
+
+        self.subjects = list(set(
+            owners + [a.user_to_subject for a in self.agreements]))
+
+        # {subject: index}, as subjects are looked up for every GGO
+        self.subject_index = {s: i for i, s in enumerate(self.subjects)}
+
+        H = len(self.begins)
+        K = max(map(len, self.ggos), default=0)
+        S = len(self.subjects)
+
+        ggo_amount = np.zeros((H, K), dtype=np.int64)
+        ggo_owner = np.full((H, K), -1, dtype=np.int64)
+        ggo_sector = np.full((H, K), '', dtype=object)
+
+        for h, k, ggo in self.iter_ggos():
+            ggo_amount[h, k] = ggo.amount
+            ggo_owner[h, k] = self.subject_index[ggo.subject]
+            ggo_sector[h, k] = ggo.sector
+
+        facility_sector = np.array(
+            [f.sector for f in self.facilities], dtype=object)
+
+        consumption, retired_amount = self.load_consumption()
+
+        return AllocationProblem(
+            ggo_amount=ggo_amount,
+            ggo_owner=ggo_owner,
+
+            # All GGOs stored within the period are consumed (one at
+            # a time), so nothing else is stored initially
+            stored_amount=np.zeros((H, S), dtype=np.int64),
+
+            facility_owner=np.array(
+                [self.subject_index[f.subject] for f in self.facilities],
+                dtype=np.int64),
+            consumption=consumption,
+            retired_amount=retired_amount,
+            facility_eligible=(
+                ggo_sector[:, :, None] == facility_sector[None, None, :]
+            ).astype(bool),
+
+            agreement_from=np.array(
+                [self.subject_index[a.user_from_subject]
+                 for a in self.agreements], dtype=np.int64),
+            agreement_to=np.array(
+                [self.subject_index[a.user_to_subject]
+                 for a in self.agreements], dtype=np.int64),
+            agreement_amount=np.array(
+                [a.calculated_amount for a in self.agreements],
+                dtype=np.int64),
+            agreement_percent=np.array(
+                [a.amount_percent or np.nan for a in self.agreements],
+                dtype=np.float64),
+            agreement_limited=np.array(
+                [bool(a.limit_to_consumption) for a in self.agreements],
+                dtype=bool),
+            transferred_amount=self.load_transferred_amounts(),
+            agreement_eligible=self.get_agreement_eligibility(),
+        )
+
+    def load_agreements(self, subjects):
+        """
+        :param list[str] subjects:
+        :rtype: list[origin.agreements.TradeAgreement]
+        """
+        if not self.begins:
+            return []
+
+        tz = pytz.timezone('Europe/Copenhagen')
+
+        agreements = AgreementQuery(self.session) \
+            .is_outbound_from_any(subjects) \
+            .is_operating_within(
+                self.begins[0].astimezone(tz).date(),
+                self.begins[-1].astimezone(tz).date()) \
+            .is_active() \
+            .all()
+
+        return sorted(agreements, key=ConsumptionContext.agreement_order)
+
+    def load_facilities(self, subjects):
+        """
+        :param list[str] subjects:
+        :rtype: list[origin.meteringpoints.MeteringPoint]
+        """
+        facilities = MeteringPointQuery(self.session) \
+            .belongs_to_any(subjects) \
+            .is_retire_receiver() \
+            .is_consumption() \
+            .all()
+
+        return sorted(facilities, key=ConsumptionContext.facility_order)
+
+    def load_consumption(self):
+        """
+        Returns the consumption of each facility, and the amount already
+        retired to it, at each begin.
+
+        :rtype: (np.ndarray, np.ndarray)
+        """
+        H = len(self.begins)
+        F = len(self.facilities)
+        consumption = np.zeros((H, F), dtype=np.int64)
+        retired_amount = np.zeros((H, F), dtype=np.int64)
+
+        if not H or not F:
+            return consumption, retired_amount
+
+        gsrn = [f.gsrn for f in self.facilities]
+        h_index = {begin: h for h, begin in enumerate(self.begins)}
+        f_index = {g: f for f, g in enumerate(gsrn)}
+
+        measurements = MeasurementQuery(self.session) \
+            .has_any_gsrn(gsrn) \
+            .filter(Measurement.begin >= self.begin_from) \
+            .filter(Measurement.begin < self.begin_to) \
+            .all()
+
+        for m in measurements:
+            if m.begin in h_index:
+                consumption[h_index[m.begin], f_index[m.gsrn]] = m.amount
+                retired_amount[h_index[m.begin], f_index[m.gsrn]] = m.retired_amount
+
+        return consumption, retired_amount
+
+    def load_transferred_amounts(self):
+        """
+        Returns the amount already transferred via each agreement
+        at each begin.
+
+        :rtype: np.ndarray
+        """
+        H = len(self.begins)
+        A = len(self.agreements)
+        transferred_amount = np.zeros((H, A), dtype=np.int64)
+
+        if not H or not A:
+            return transferred_amount
+
+        h_index = {begin: h for h, begin in enumerate(self.begins)}
+        a_index = {(a.user_from_subject, a.public_id): i
+                   for i, a in enumerate(self.agreements)}
+
+        transferred_amounts = TransactionQuery(self.session) \
+            .sent_by_any_user([a.user_from_subject for a in self.agreements]) \
+            .has_any_reference([a.public_id for a in self.agreements]) \
+            .filter(Ggo.begin >= self.begin_from) \
+            .filter(Ggo.begin < self.begin_to) \
+            .get_total_amount_by(
+                TransactionQuery.parent_ggo.subject,
+                SplitTarget.reference,
+                Ggo.begin,
+            )
+
+        for (subject, reference, begin), amount in transferred_amounts.items():
+            if begin in h_index and (subject, reference) in a_index:
+                h = h_index[begin]
+                transferred_amount[h, a_index[(subject, reference)]] = amount
+
+        return transferred_amount
+
+    def get_agreement_eligibility(self):
+        """
+        Returns whether each GGO is eligible to be transferred via
+        each of its owner's agreements.
+
+        :rtype: np.ndarray
+        """
+        H = len(self.begins)
+        K = max(map(len, self.ggos), default=0)
+        eligible = np.zeros((H, K, len(self.agreements)), dtype=bool)
+
+        for h, k, ggo in self.iter_ggos():
+            for a, agreement in enumerate(self.agreements):
+                if agreement.user_from_subject == ggo.subject:
+                    eligible[h, k, a] = agreement.is_eligible_to_trade(ggo)
+
+        return eligible
+
+    # -- Helpers -------------------------------------------------------------
+
+    def iter_ggos(self):
+        """
+        :rtype: collections.abc.Iterable[(int, int, Ggo)]
+        """
+        for h, ggos in enumerate(self.ggos):
+            for k, ggo in enumerate(ggos):
+                yield h, k, ggo
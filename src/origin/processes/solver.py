@@ -0,0 +1,261 @@
+"""
+ORM-free implementation of how GGOs are allocated to consumers
+(retired to consumption meteringpoints and/or transferred via agreements).
+
+The functions operating on amounts work on both scalars and NumPy arrays.
+They are used by the consumers in consume_ggos.py when consuming a single
+GGO, and by AllocationSolver when simulating allocation for many hours
+at once (vectorized over hours).
+"""
+import numpy as np
+from dataclasses import dataclass
+
+
+# -- Amounts -----------------------------------------------------------------
+
+
+def remaining_consumption(consumption, retired_amount):
+    """
+    Returns the consumed amount which has not yet been retired to.
+
+    :param int|np.ndarray consumption:
+    :param int|np.ndarray retired_amount:
+    :rtype: int|np.ndarray
+    """
+    return np.maximum(0, consumption - retired_amount)
+
+
+def desired_retire_amount(ggo_amount, consumption, retired_amount):
+    """
+    Returns the amount desired by a RetiringConsumer.
+
+    :param int|np.ndarray ggo_amount:
+    :param int|np.ndarray consumption: Measured amount (0 if not measured)
+    :param int|np.ndarray retired_amount: Amount already retired
+    :rtype: int|np.ndarray
+    """
+    return np.clip(consumption - retired_amount, 0, ggo_amount)
+
+
+def desired_transfer_amount(ggo_amount, calculated_amount, amount_percent,
+                            transferred_amount):
+    """
+    Returns the amount desired by an AgreementConsumer.
+
+    :param int|np.ndarray ggo_amount:
+    :param int|np.ndarray calculated_amount: The agreed amount
+    :param float|np.ndarray amount_percent: NaN if not a percentage agreement
+    :param int|np.ndarray transferred_amount: Amount already transferred
+    :rtype: int|np.ndarray
+    """
+    percentage_amount = np.floor(amount_percent / 100 * ggo_amount)
+
+    agreed_amount = np.where(
+        np.isnan(amount_percent),
+        calculated_amount,
+        np.minimum(calculated_amount, percentage_amount),
+    )
+
+    return np.clip(agreed_amount - transferred_amount, 0, ggo_amount) \
+        .astype(np.int64)
+
+
+def desired_limited_transfer_amount(ggo_amount, transfer_amount,
+                                    remaining_consumption, already_transferred,
+                                    stored_amount):
+    """
+    Returns the amount desired by an AgreementLimitedToConsumptionConsumer.
+
+    :param int|np.ndarray ggo_amount:
+    :param int|np.ndarray transfer_amount: Result of desired_transfer_amount()
+    :param int|np.ndarray remaining_consumption: Sum of remaining_consumption()
+        for the recipient's facilities
+    :param int|np.ndarray already_transferred: Amount of the GGO already
+        assigned to other consumers
+    :param int|np.ndarray stored_amount: Amount currently stored by the
+        recipient
+    :rtype: int|np.ndarray
+    """
+    desired_amount = \
+        remaining_consumption - already_transferred - stored_amount
+
+    return np.clip(
+        np.minimum(transfer_amount, desired_amount), 0, ggo_amount)
+
+
+# -- Solver ------------------------------------------------------------------
+
+
+@dataclass
+class AllocationProblem:
+    """
+    Everything necessary to allocate GGOs to consumers, as plain arrays.
+
+    Dimensions:
+        H: Number of hours (begins)
+        K: Max. number of GGOs per hour (GGOs are consumed in this order)
+        S: Number of subjects (users)
+        F: Number of facilities (retire receivers), ordered by priority
+        A: Number of agreements, ordered by priority
+
+    Unused GGO slots must have an amount of 0 and an owner of -1.
+    """
+
+    # [H, K] GGO amounts
+    ggo_amount: np.ndarray
+
+    # [H, K] GGO owners (subject index)
+    ggo_owner: np.ndarray
+
+    # [H, S] Stored amount per subject, excluding the GGOs above
+    stored_amount: np.ndarray
+
+    # [F] Facility owners (subject index)
+    facility_owner: np.ndarray
+
+    # [H, F] Consumption (0 if not measured)
+    consumption: np.ndarray
+
+    # [H, F] Amount already retired to the consumption
+    retired_amount: np.ndarray
+
+    # [H, K, F] Whether GGO is eligible to be retired to the facility
+    facility_eligible: np.ndarray
+
+    # [A] Agreement sender and recipient (subject index)
+    agreement_from: np.ndarray
+    agreement_to: np.ndarray
+
+    # [A] Agreement calculated amount
+    agreement_amount: np.ndarray
+
+    # [A] Agreement percentage (NaN if not a percentage agreement)
+    agreement_percent: np.ndarray
+
+    # [A] Whether agreement is limited to the recipient's consumption
+    agreement_limited: np.ndarray
+
+    # [H, A] Amount already transferred via the agreement
+    transferred_amount: np.ndarray
+
+    # [H, K, A] Whether GGO is eligible to be transferred via the agreement
+    agreement_eligible: np.ndarray
+
+
+@dataclass
+class Allocation:
+    """
+    Result of AllocationSolver.solve().
+    """
+
+    # [H, K, F] Amount of each GGO retired to each facility
+    retired: np.ndarray
+
+    # [H, K, A] Amount of each GGO transferred via each agreement
+    transferred: np.ndarray
+
+
+class AllocationSolver(object):
+    """
+    Allocates GGOs to consumers the same way GgoConsumerController does,
+    but vectorized over hours (consumption of GGOs only depends on data
+    with the same begin).
+
+    For each GGO, retiring consumers comes first, followed by agreements,
+    both in order of priority, until either all consumers are satisfied
+    or the GGO is used up.
+    """
+    def solve(self, problem):
+        """
+        :param AllocationProblem problem:
+        :rtype: Allocation
+        """
+        p = problem
+        H, K = p.ggo_amount.shape
+        F = len(p.facility_owner)
+        A = len(p.agreement_from)
+        hours = np.arange(H)
+
+        # Working copies, updated as GGOs are allocated
+        stored = np.array(p.stored_amount, dtype=np.int64)
+        retired = np.array(p.retired_amount, dtype=np.int64)
+        transferred = np.array(p.transferred_amount, dtype=np.int64)
+
+        allocation = Allocation(
+            retired=np.zeros((H, K, F), dtype=np.int64),
+            transferred=np.zeros((H, K, A), dtype=np.int64),
+        )
+
+        for k in range(K):
+            amount = p.ggo_amount[:, k]
+            owner = p.ggo_owner[:, k]
+            exists = owner >= 0
+            remaining = np.array(amount, dtype=np.int64)
+
+            # GGO received
+            np.add.at(stored, (hours[exists], owner[exists]), amount[exists])
+
+            # Retiring consumers
+            for f in range(F):
+                eligible = (owner == p.facility_owner[f]) \
+                    & p.facility_eligible[:, k, f]
+
+                desired = desired_retire_amount(
+                    amount, p.consumption[:, f], retired[:, f])
+
+                assigned = np.where(
+                    eligible, np.minimum(remaining, desired), 0)
+
+                remaining -= assigned
+                retired[:, f] += assigned
+                allocation.retired[:, k, f] = assigned
+
+            # Agreement consumers
+            for a in range(A):
+                sender = p.agreement_from[a]
+                recipient = p.agreement_to[a]
+                eligible = (owner == sender) & p.agreement_eligible[:, k, a]
+
+                desired = desired_transfer_amount(
+                    ggo_amount=amount,
+                    calculated_amount=p.agreement_amount[a],
+                    amount_percent=p.agreement_percent[a],
+                    transferred_amount=transferred[:, a],
+                )
+
+                if p.agreement_limited[a]:
+                    facilities = p.facility_owner == recipient
+
+                    consumption = remaining_consumption(
+                        p.consumption[:, facilities],
+                        retired[:, facilities],
+                    )
+
+                    desired = desired_limited_transfer_amount(
+                        ggo_amount=amount,
+                        transfer_amount=desired,
+                        remaining_consumption=(
+                            consumption * p.facility_eligible[:, k, facilities]
+                        ).sum(axis=1),
+                        already_transferred=amount - remaining,
+                        stored_amount=stored[:, recipient],
+                    )
+
+                assigned = np.where(
+                    eligible, np.minimum(remaining, desired), 0)
+
+                remaining -= assigned
+                allocation.transferred[:, k, a] = assigned
+
+                if recipient != sender:
+                    transferred[:, a] += assigned
+
+            # The GGO has been split up: Transferred amounts are stored
+            # by the recipients, and the remaining amount by the owner
+            np.add.at(stored, (hours[exists], owner[exists]),
+                      remaining[exists] - amount[exists])
+
+            for a in range(A):
+                stored[:, p.agreement_to[a]] += allocation.transferred[:, k, a]
+
+        return allocation
@@ -0,0 +1,184 @@
+import time
+import bisect
+import logging
+import threading
+import sqlalchemy as sa
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+from sqlalchemy.engine import Engine
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds (in seconds) of the wall time histogram buckets,
+# the last bucket being everything slower
+TRACE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+@dataclass
+class ConsumerTrace:
+    """
+    A single consumer evaluated when consuming a GGO.
+    """
+    ggo_id: int
+    subject: str
+    begin: str
+    consumer: str
+    consumer_class: str
+    desired_amount: int = 0
+    assigned_amount: int = 0
+    statements: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class ConsumerStats:
+    """
+    Aggregated traces of a consumer class, or a single consumer.
+    """
+    count: int = 0
+    desired_amount: int = 0
+    assigned_amount: int = 0
+    statements: int = 0
+    seconds: float = 0.0
+    buckets: list = field(default_factory=lambda: [0] * (len(TRACE_BUCKETS) + 1))
+
+    def add(self, trace):
+        """
+        :param ConsumerTrace trace:
+        """
+        self.count += 1
+        self.desired_amount += trace.desired_amount
+        self.assigned_amount += trace.assigned_amount
+        self.statements += trace.statements
+        self.seconds += trace.seconds
+        self.buckets[bisect.bisect_left(TRACE_BUCKETS, trace.seconds)] += 1
+
+    def merge(self, other):
+        """
+        :param ConsumerStats other:
+        """
+        self.count += other.count
+        self.desired_amount += other.desired_amount
+        self.assigned_amount += other.assigned_amount
+        self.statements += other.statements
+        self.seconds += other.seconds
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+
+class ConsumptionTracer(object):
+    """
+    Traces each consumer evaluated by GgoConsumerController.consume_ggo():
+    its desired and assigned amount, the number of SQL statements issued,
+    and the wall time spent. Each trace is emitted as a structured log
+    record (DEBUG level, trace fields in "extra"), and aggregated per
+    consumer class (including a wall time histogram) and per consumer.
+
+    Tracing is opt-in, and only active within the "with" block::
+
+        with ConsumptionTracer() as tracer:
+            consume_ggos_bulk(ggos, session)
+
+        for consumer_class, stats in tracer.classes.items():
+            pass
+    """
+
+    # The tracer currently active (if any)
+    active = None
+
+    def __init__(self):
+        self.classes = {}
+        self.consumers = {}
+        self.local = threading.local()
+
+    def __enter__(self):
+        sa.event.listen(Engine, 'before_cursor_execute', self.on_execute)
+        ConsumptionTracer.active = self
+        return self
+
+    def __exit__(self, *args):
+        ConsumptionTracer.active = None
+        sa.event.remove(Engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args, **kwargs):
+        self.local.statements = getattr(self.local, 'statements', 0) + 1
+
+    @property
+    def statements(self):
+        """
+        Returns the number of SQL statements issued by the current thread
+        while tracing, whether or not by a consumer.
+
+        :rtype: int
+        """
+        return getattr(self.local, 'statements', 0)
+
+    @contextmanager
+    def trace(self, ggo, consumer):
+        """
+        Traces evaluating (and consuming by) a consumer. Amounts are set
+        on the yielded ConsumerTrace within the "with" block.
+
+        :param origin.ggo.Ggo ggo:
+        :param origin.processes.consume_ggos.GgoConsumer consumer:
+        :rtype: collections.abc.Iterator[ConsumerTrace]
+        """
+        trace = ConsumerTrace(
+            ggo_id=ggo.id,
+            subject=ggo.subject,
+            begin=ggo.begin.isoformat(),
+            consumer=str(consumer),
+            consumer_class=consumer.__class__.__name__,
+        )
+
+        statements = getattr(self.local, 'statements', 0)
+        started = time.perf_counter()
+
+        yield trace
+
+        trace.seconds = time.perf_counter() - started
+        trace.statements = getattr(self.local, 'statements', 0) - statements
+
+        self.add(trace)
+
+    def add(self, trace):
+        """
+        :param ConsumerTrace trace:
+        """
+        self.classes.setdefault(trace.consumer_class, ConsumerStats()).add(trace)
+        self.consumers.setdefault(trace.consumer, ConsumerStats()).add(trace)
+
+        logger.debug(
+            f'{trace.consumer}: desired {trace.desired_amount}, '
+            f'assigned {trace.assigned_amount}, '
+            f'{trace.statements} statement(s), {trace.seconds:.6f}s',
+            extra=vars(trace),
+        )
+
+    def merge(self, classes, consumers):
+        """
+        Merges stats aggregated by another tracer (for instance
+        in another process) into this tracer.
+
+        :param dict[str, ConsumerStats] classes:
+        :param dict[str, ConsumerStats] consumers:
+        """
+        for target, source in ((self.classes, classes),
+                               (self.consumers, consumers)):
+            for key, stats in source.items():
+                target.setdefault(key, ConsumerStats()).merge(stats)
+
+    def get_slowest_consumers(self, n=10):
+        """
+        Returns the consumers (agreements and facilities) which
+        dominate the time spent consuming.
+
+        :param int n:
+        :rtype: list[(str, ConsumerStats)]
+        """
+        return sorted(
+            self.consumers.items(),
+            key=lambda item: item[1].seconds,
+            reverse=True,
+        )[:n]
@@ -26,11 +26,14 @@ urls = (
     # Measurements
     ('/measurements', measurements.GetMeasurementList()),
     ('/measurements/summary', measurements.GetMeasurementSummary()),
+    ('/measurements/export', measurements.ExportMeasurementList()),
 
     # GGOs
     ('/ggo', ggo.GetGgoList()),
     ('/ggo/summary', ggo.GetGgoSummary()),
+    ('/ggo/export', ggo.ExportGgoList()),
     ('/ggo/compose', ggo.ComposeGgo()),
+    ('/ggo/compose/bulk', ggo.ComposeGgoBulk()),
 
     # Technologies
     ('/technologies', technology.GetTechnologies()),
@@ -40,18 +43,21 @@ urls = (
     ('/facilities/edit', facilities.EditFacilityDetails()),
     ('/facilities/get-filtering-options', facilities.GetFilteringOptions()),
     ('/facilities/set-retiring-priority', facilities.SetRetiringPriority()),
-    # ('/facilities/retire-back-in-time', facilities.RetireBackInTime()),
+    ('/facilities/retire-back-in-time', facilities.RetireBackInTime()),
+    ('/facilities/retire-back-in-time/progress', facilities.GetRetireBackInTimeProgress()),
 
     # Commodities
     ('/commodities/distributions', commodities.GetGgoDistributions()),
     ('/commodities/ggo-summary', commodities.GetGgoSummary()),
     ('/commodities/measurements', commodities.GetMeasurements()),
     ('/commodities/get-peak-measurement', commodities.GetPeakMeasurement()),
+    ('/commodities/hourly-matching', commodities.GetHourlyMatching()),
 
     # Agreements
     ('/agreements', agreements.GetAgreementList()),
     ('/agreements/details', agreements.GetAgreementDetails()),
     ('/agreements/summary', agreements.GetAgreementSummary()),
+    ('/agreements/transfers/export', agreements.ExportTransferList()),
     ('/agreements/cancel', agreements.CancelAgreement()),
     ('/agreements/set-transfer-priority', agreements.SetTransferPriority()),
     ('/agreements/propose', agreements.SubmitAgreementProposal()),